@@ -0,0 +1,292 @@
+"""Serve the dashboard's aggregates as compact columnar JSON over a local HTTP API, without streamlit.
+
+Run from the project root:
+    python api.py --port 8502
+    curl "http://127.0.0.1:8502/daily_totals?start=2024-01-01&end=2024-03-31&category=Travel&category=Dining&freq=W"
+
+Every endpoint takes the sidebar filters as query parameters: start and end dates (YYYY-MM-DD) and any dimension
+column repeated once per selected value, e.g. category=Travel&category=Dining. A missing filter selects everything.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+import pandas as pd
+import streamlit.config
+import streamlit.logger
+
+# no streamlit server runs the api, the cached functions would log "No runtime found" warnings from their
+# import on; the config is read first, otherwise reading it later resets the log level
+streamlit.config.get_option("logger.level")
+streamlit.logger.set_log_level("error")
+
+import benford  # noqa: E402
+import charts  # noqa: E402
+import functions as fx  # noqa: E402
+
+## DATASET FUNCTIONS ##
+
+# filter query parameters, as in the dashboard sidebar
+FILTER_PARAMS = ["start", "end"] + fx.DIMENSION_COLUMNS
+
+# Returns the transactions, cube and prefix index the filter spec reads from
+    # file_path = csv, or directory or glob of partition files (string)
+    # spec = filter spec from fx.make_filter_spec (dict)
+    # every loader is cached on the source_version of the data, as in the dashboard: the dataset is read once
+    # and shared by every request, a file that grows is picked up by the next request and only its appended
+    # rows are parsed; partitioned datasets only read the partitions overlapping the date filter
+def load_dataset(file_path, spec):
+    version = fx.source_version(file_path)
+    partitions = None
+    if fx.is_partitioned(file_path) and fx.partition_date_bounds(file_path):
+        partitions = fx.select_partitions(file_path, spec["date_range"])
+
+    df = fx.read_and_clean_data(file_path, version=version, partitions=partitions)
+    cube = fx.load_cube(file_path, version, partitions)
+    prefix_index = fx.load_prefix_index(file_path, fx.dimension_filter_key(spec), version, partitions)
+    return df, cube, prefix_index
+
+## RESPONSE FUNCTIONS ##
+
+# Returns the values of a column as JSON-ready python values: dates as YYYY-MM-DD, missing values as None
+    # values = column (panda Series, Index or numpy array)
+def json_values(values):
+    values = pd.Series(values)
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.dt.strftime("%Y-%m-%d").tolist()
+    if pd.api.types.is_float_dtype(values):
+        values = values.round(6)
+    values = values.astype(object)
+    return values.where(values.notna(), None).tolist()
+
+# Returns a DataFrame as columnar JSON: the number of rows and one list of values per column
+    # df = aggregate to send (panda DataFrame)
+def columnar(df):
+    return {"rows": len(df), "columns": {str(col): json_values(df[col]) for col in df.columns}}
+
+# Returns the total, mean and number of transactions matching the filters
+def metrics_response(df, cube, prefix_index, spec, params):
+    total, mean, count = fx.range_metrics(prefix_index, spec["date_range"])
+    return {"transactions": count, "total_amount": round(float(total), 2),
+            "mean_amount": None if np.isnan(mean) else round(float(mean), 2)}
+
+# Returns the total amount and number of transactions per day, week or month
+    # freq = key or value of charts.FREQUENCIES, e.g. "W" (string)
+def daily_totals_response(df, cube, prefix_index, spec, params):
+    freq = charts.FREQUENCIES.get(params.get("freq", "D"), params.get("freq", "D"))
+    if freq not in charts.FREQUENCIES.values():
+        raise ValueError(f"freq must be one of {', '.join(charts.FREQUENCIES.values())}")
+
+    totals = fx.range_daily_totals(prefix_index, spec["date_range"])
+    if freq != "D":
+        totals = totals.resample(freq, on="Date")[["amount", "count"]].sum().reset_index()
+    return columnar(totals)
+
+# Returns the average amount and number of transactions by day of the week
+def weekday_response(df, cube, prefix_index, spec, params):
+    return columnar(fx.weekday_summary(fx.filter_data(cube, spec)))
+
+# Returns the total amount of the top 5 categories, split by a segment column
+    # segment = value of charts.SEGMENTS, e.g. "payment_method" (string)
+def category_stacks_response(df, cube, prefix_index, spec, params):
+    segment = params.get("segment", "payment_method")
+    if segment not in charts.SEGMENTS.values():
+        raise ValueError(f"segment must be one of {', '.join(charts.SEGMENTS.values())}")
+
+    stacks = fx.stacked_bar_data(fx.filter_data(cube, spec), "category", "amount", segment)
+    # the top category first, stacked_bar_chart lists it last to draw it on top
+    stacks = stacks.sort_values("category", ascending=False, kind="stable")
+    return columnar(stacks.astype({"category": str, segment: str}))
+
+# Returns the histogram bin edges and counts of the amounts
+    # log_scale = "1" to bin log10 of the positive amounts (string)
+def histogram_response(df, cube, prefix_index, spec, params):
+    positions = fx.filter_positions(df, spec)
+    edges, counts = fx.histogram_bins(fx.filtered_column(df, positions, "amount"),
+                                      log_scale=params.get("log_scale") == "1")
+    return columnar(pd.DataFrame({"start": edges[:-1], "end": edges[1:], "count": counts}))
+
+# Returns the number of transactions and total amount of the top rows of a heatmap
+    # rows, columns, top_n, rank_by = see fx.heatmap_matrices (strings)
+def heatmap_response(df, cube, prefix_index, spec, params):
+    rows, columns = params.get("rows", "merchant"), params.get("columns", "month")
+    rank_by = params.get("rank_by", "count")
+    if rows not in charts.HEATMAP_AXES.values():
+        raise ValueError(f"rows must be one of {', '.join(charts.HEATMAP_AXES.values())}")
+    if columns not in charts.HEATMAP_BUCKETS.values():
+        raise ValueError(f"columns must be one of {', '.join(charts.HEATMAP_BUCKETS.values())}")
+    if rank_by not in ("count", "amount"):
+        raise ValueError("rank_by must be count or amount")
+    top_n = int(params.get("top_n", 10))
+    if top_n < 1:
+        raise ValueError("top_n must be at least 1")
+
+    counts, amounts = fx.heatmap_matrices(fx.filter_data(cube, spec), rows, columns, top_n=top_n, rank_by=rank_by)
+    return {"rows": json_values(counts.index), "columns": json_values(counts.columns),
+            "count": counts.to_numpy().tolist(), "amount": amounts.to_numpy().tolist()}
+
+# Returns the Benford's Law deviation of every group, largest first
+    # group = value of charts.BENFORD_GROUPS, e.g. "merchant" (string)
+def benford_ranking_response(df, cube, prefix_index, spec, params):
+    group_col = params.get("group", "merchant")
+    if group_col not in charts.BENFORD_GROUPS.values():
+        raise ValueError(f"group must be one of {', '.join(charts.BENFORD_GROUPS.values())}")
+
+    positions = fx.filter_positions(df, spec)
+    by_group = pd.DataFrame({group_col: fx.filtered_column(df, positions, group_col),
+                             "amount": fx.filtered_column(df, positions, "amount")})
+    ranking = benford.benford_by_group(by_group[by_group["amount"] >= 1], group_col, min_count=30)
+    return columnar(ranking.astype({group_col: str}))
+
+# Returns the values of every dimension column, to build filters from
+def dimension_values_response(df, cube, prefix_index, spec, params):
+    return {col: sorted(map(str, cube[col].cat.categories)) for col in fx.DIMENSION_COLUMNS}
+
+# path of every endpoint, its function and the parameters it takes besides the filters
+ENDPOINTS = {
+    "/metrics": (metrics_response, []),
+    "/daily_totals": (daily_totals_response, ["freq"]),
+    "/weekday": (weekday_response, []),
+    "/category_stacks": (category_stacks_response, ["segment"]),
+    "/histogram": (histogram_response, ["log_scale"]),
+    "/heatmap": (heatmap_response, ["rows", "columns", "top_n", "rank_by"]),
+    "/benford_ranking": (benford_ranking_response, ["group"]),
+    "/dimension_values": (dimension_values_response, []),
+}
+
+# Returns the filter spec and endpoint parameters of a query string
+    # query = query string of the request (string)
+    # allowed = parameters the endpoint takes besides the filters (list)
+def parse_query(query, allowed):
+    values = parse_qs(query, strict_parsing=False)
+    unknown = set(values) - set(FILTER_PARAMS) - set(allowed)
+    if unknown:
+        raise ValueError(f"unknown parameters: {', '.join(sorted(unknown))}")
+    for name in ["start", "end"] + allowed:
+        if len(values.get(name, [])) > 1:
+            raise ValueError(f"{name} is given more than once")
+
+    date_range = None
+    if "start" in values or "end" in values:
+        # an open end of the range falls back to the earliest or latest possible date
+        date_range = (pd.Timestamp(values.get("start", ["1900-01-01"])[0]).date(),
+                      pd.Timestamp(values.get("end", ["2262-04-11"])[0]).date())
+    spec = fx.make_filter_spec(date_range, *[values.get(col) for col in fx.DIMENSION_COLUMNS])
+    params = {name: values[name][0] for name in allowed if name in values}
+    return spec, params
+
+## SERVER ##
+
+# HTTP server holding the dataset path and the response cache shared by every request thread
+    # file_path = csv, or directory or glob of partition files (string)
+    # cache = response cache (fx.FigureCache)
+class AggregateServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, file_path, cache):
+        super().__init__(address, AggregateHandler)
+        self.file_path = file_path
+        self.cache = cache
+        self.started = time.monotonic()
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    # Returns the encoded response of an endpoint and whether it came from the cache
+        # path = endpoint path, a key of ENDPOINTS (string)
+        # spec, params = output of parse_query
+        # responses are cached by endpoint, source_version of the data, filter spec hash and parameters, so a
+        # repeated query is answered without touching the data and a changed file is never answered from the cache
+    def respond(self, path, spec, params):
+        built = []
+
+        def build():
+            built.append(True)
+            endpoint = ENDPOINTS[path][0]
+            body = endpoint(*load_dataset(self.file_path, spec), spec, params)
+            return json.dumps(body, separators=(",", ":"), allow_nan=False).encode()
+
+        key = fx.figure_key(path, self.file_path, spec, **params)
+        return self.cache.get_or_build(key, build), not built
+
+    # Returns the response cache counters and the number of requests served (dict)
+    def stats(self):
+        with self._lock:
+            requests = self.requests
+        return {"requests": requests, "uptime_seconds": round(time.monotonic() - self.started, 1),
+                **self.cache.stats()}
+
+class AggregateHandler(BaseHTTPRequestHandler):
+    # keep-alive, so a client sends many requests over one connection; the headers and body are written
+    # separately, without TCP_NODELAY the body would wait for the client's delayed ACK (~40 ms)
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        with self.server._lock:
+            self.server.requests += 1
+
+        if url.path == "/stats":
+            return self.send_json(200, json.dumps(self.server.stats()).encode())
+        if url.path not in ENDPOINTS:
+            return self.send_error_json(404, f"unknown endpoint {url.path}, use one of {', '.join(ENDPOINTS)} or /stats")
+
+        try:
+            spec, params = parse_query(url.query, ENDPOINTS[url.path][1])
+            body, cached = self.server.respond(url.path, spec, params)
+        except ValueError as e:
+            return self.send_error_json(400, str(e))
+        except Exception as e:
+            self.log_error("%s failed: %r", self.path, e)
+            return self.send_error_json(500, f"{type(e).__name__}: {e}")
+        self.send_json(200, body, cached)
+
+    def send_json(self, status, body, cached=None):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if cached is not None:
+            self.send_header("X-Cache", "hit" if cached else "miss")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_json(self, status, message):
+        self.send_json(status, json.dumps({"error": message}).encode())
+
+    # requests are counted in /stats instead of logged one line each, errors are still logged
+    def log_request(self, code="-", size="-"):
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data", default=os.environ.get("DASHBOARD_DATA", "financial_transactions.csv"),
+                        help="csv, or directory or glob of partition files (default: $DASHBOARD_DATA)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502, help="0 picks a free port")
+    parser.add_argument("--cache-entries", type=int, default=1024, help="most responses cached")
+    parser.add_argument("--cache-mb", type=float, default=256, help="most megabytes of responses cached")
+    parser.add_argument("--cache-ttl", type=float, default=300, help="seconds a response stays cached")
+    args = parser.parse_args()
+
+    # the dataset is loaded before the first request, which then only filters and aggregates
+    started = time.perf_counter()
+    df, _, _ = load_dataset(args.data, fx.make_filter_spec())
+    print(f"{len(df):,} transactions loaded in {time.perf_counter() - started:.1f} s")
+
+    cache = fx.FigureCache(args.cache_entries, int(args.cache_mb * 1024 * 1024), ttl=args.cache_ttl)
+    server = AggregateServer((args.host, args.port), args.data, cache)
+    print(f"serving on http://{server.server_address[0]}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
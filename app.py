@@ -1,354 +1,562 @@
+import functools
+import os
+
+import numpy as np
 import pandas as pd
 import streamlit as st
 import functions as fx
-
-file_path = 'financial_transactions.csv'
-df_ft = fx.read_and_clean_data(file_path)
-df_copy = df_ft.copy()
+import benford
+import charts
+import detection
+import outliers
+import profiling
+import sketches
+import sql_backend
+import streaming
+
+# opt-in timing of every stage (DASHBOARD_PROFILE=1), nothing is wrapped or recorded when it is off
+profiling.instrument(fx, fx.FigureCache, benford, charts, detection, outliers, sketches, sql_backend, streaming)
+profiling.start_rerun()
+
+# a single csv, or a directory or glob of monthly partition files (csv or parquet)
+file_path = os.environ.get("DASHBOARD_DATA", 'financial_transactions.csv')
+partitioned = fx.is_partitioned(file_path)
+
+# "pandas" keeps the transactions in memory, "sql" pushes the filters and aggregations down to a
+# local sqlite database so only aggregated results are loaded, for files larger than RAM, "stream" reads the
+# csv once in chunks into mergeable aggregates so memory stays bounded whatever the size of the file
+data_backend = os.environ.get("DASHBOARD_BACKEND", "pandas")
+use_sql = data_backend == "sql"
+use_stream = data_backend == "stream"
+
+# (size, mtime) of the csv, or of every partition: every loader below is keyed on it, so a file that grows
+# is picked up on the next rerun and only the appended rows are parsed
+data_version = fx.source_version(file_path)
+
+if partitioned and (use_sql or use_stream):
+    st.error(f"The {data_backend} backend reads a single csv, set DASHBOARD_DATA to a file or use the pandas backend.")
+    st.stop()
+
+# Loads the transactions, their cube and the dimension index the sidebar options come from
+    # partitions = partition files overlapping the selected dates, None for a single csv (tuple)
+    # the transactions, the cube and the index are shared read-only by every session, each one only holds a
+    # view of them
+    # the sketch and day order of approximate results are built here too, in the background load of a single
+    # csv, so turning exact results off never waits for them
+def load_pandas_data(partitions=None):
+    df = fx.read_and_clean_data(file_path, version=data_version, partitions=partitions)
+    cube = fx.load_cube(file_path, data_version, partitions)
+    dimension_index = fx.load_dimension_index(file_path, data_version, partitions)
+    sketches.load_sketch(file_path, data_version, partitions)
+    sketches.load_day_order(file_path, data_version, partitions)
+    return fx.session_view(df), fx.session_view(cube), dimension_index
+
+# Loads the preliminary sample of the csv, its cube and dimension index, see load_pandas_data
+def load_sample_data():
+    sample, sample_cube, sample_index = fx.load_sample(file_path, data_version)
+    return fx.session_view(sample), fx.session_view(sample_cube), sample_index
+
+# datasets whose partition paths all hold a date are pruned to the partitions overlapping the date filter
+partition_bounds = fx.partition_date_bounds(file_path) if partitioned else None
+data_partitions = None
+
+# a single csv is loaded in a background thread shared by every session: until it is loaded, reruns render
+# preliminary results from a stratified sample of the file and poll the load
+progressive = not (partitioned or use_sql or use_stream or file_path.endswith(".parquet"))
+preliminary = False
+
+with profiling.stage("load data"):
+    if use_sql:
+        db_path = sql_backend.load_database(file_path, data_version)
+        dimension_values, (min_d, max_d) = sql_backend.load_dimension_values(db_path, data_version)
+        dimension_index = sql_backend.load_dimension_index(db_path, data_version)
+    elif use_stream:
+        stream_meta = streaming.current_aggregates(file_path)
+        if stream_meta is None:
+            # the bar follows the bytes read, the aggregates are stored so later runs skip this step
+            progress_bar = st.progress(0.0, text="Reading transactions...")
+            stream_meta = streaming.build_aggregates(
+                file_path,
+                progress=lambda fraction, rows: progress_bar.progress(fraction, text=f"Read {rows:,} transactions ({fraction:.0%})")
+            )
+            progress_bar.empty()
+        aggregates = streaming.load_aggregates(file_path, stream_meta["content_hash"])
+        cube = aggregates["cube"]
+        dimension_index = streaming.load_dimension_index(file_path, stream_meta["content_hash"])
+        dimension_values = dimension_index["values"]
+        min_d, max_d = cube["Date"].min().date(), cube["Date"].max().date()
+    elif partition_bounds:
+        # the date range comes from the partition paths, the partitions are read once the date filter is set below
+        min_d, max_d = partition_bounds
+    else:
+        if progressive:
+            background_load = fx.get_background_loads().start(file_path, data_version, load_pandas_data)
+            preliminary = not background_load.wait(fx.BACKGROUND_WAIT_SECONDS)
+
+        if preliminary:
+            df_copy, cube, dimension_index = load_sample_data()
+            min_d, max_d = df_copy.attrs["sample"]["dates"]
+        else:
+            # a finished load is served by the cached loaders, a failed one raises its error here
+            df_copy, cube, dimension_index = load_pandas_data()
+            min_d, max_d = df_copy["Date"].min().date(), df_copy["Date"].max().date()
+        dimension_values = dimension_index["values"]
 
 st.set_page_config(page_title="Financial Transaction Monitoring Dashboard", layout="wide")
 st.title("Financial Transaction Monitoring Dashboard")
 
+if preliminary:
+    # reruns the whole page once the full data is loaded
+    @st.fragment(run_every=fx.BACKGROUND_POLL_SECONDS)
+    def loading_status():
+        if background_load.wait():
+            st.rerun()
+        sample_info = df_copy.attrs["sample"]
+        st.info(
+            f"**Preliminary results** from a sample of {len(df_copy):,} transactions, stratified by category and "
+            f"month, while all {sample_info['estimated_rows']:,} or so are loaded in the background "
+            f"({background_load.elapsed():,.0f} s so far). The page switches to the full data once they are loaded. \n\n"
+            "Totals, averages and numbers of transactions are estimated from the sample; distributions, the "
+            "scatter plot, outliers and Benford's Law only cover the sampled transactions.",
+            icon=":material/hourglass_top:"
+        )
+
+    loading_status()
+
 ## sidebar
-with st.sidebar:
+with st.sidebar, profiling.stage("sidebar filters"):
     st.header("Filters")
 
     ### date filter
-    min_d, max_d = df_copy["Date"].min().date(), df_copy["Date"].max().date()
+    # the dates of the sample can fall short of the full data's: new bounds make a new widget, which keeps a
+    # selected range (clipped to the bounds) and follows the bounds when the whole range was selected
+    selected_dates = st.session_state.get("date_range")
+    if not selected_dates or tuple(selected_dates) == st.session_state.get("date_bounds"):
+        selected_dates = (min_d, max_d)
+    st.session_state["date_range"] = tuple(min(max(day, min_d), max_d) for day in selected_dates)
+    st.session_state["date_bounds"] = (min_d, max_d)
     date_range = st.date_input(
         "Date Range",
-        value=(min_d, max_d), # default selection
+        key="date_range",
         min_value=min_d, # earliest allowed date
         max_value=max_d # latest allowed date
     )
 
+    if partition_bounds:
+        data_partitions = fx.select_partitions(file_path, date_range)
+        df_copy, cube, dimension_index = load_pandas_data(data_partitions)
+        dimension_values = dimension_index["values"]
+
+    # each filter only lists the values that occur with the selections of the other filters, with their number
+    # of transactions, looked up in the dimension index; an empty filter selects every value. The selections
+    # are read before any filter is drawn so every option list follows the latest change
+    selections = {col: [value for value in st.session_state.get(f"filter_{col}", []) if value in dimension_values[col]]
+                  for col in fx.DIMENSION_COLUMNS}
+    option_counts = fx.filter_options(dimension_index, selections)
+
+    # Draws the multiselect of one dimension column and returns its selection
+        # label = filter label (string)
+        # col = dimension column (string)
+    def dimension_filter(label, col):
+        counts = option_counts[col]
+        options = [value for value in dimension_values[col] if counts[value] > 0 or value in selections[col]]
+        # new options make a new widget, which starts from this session state instead of losing the selection
+        st.session_state[f"filter_{col}"] = selections[col]
+        # counts of the preliminary sample are estimates
+        about = "~" if preliminary else ""
+        return st.multiselect(
+            label, options, key=f"filter_{col}",
+            format_func=lambda value: f"{value} ({about}{counts[value]:,})",
+            placeholder=f"All ({about}{counts.sum():,} transactions)",
+            help="Counts cover every date and follow the other filters."
+        )
+
     ### category filter
-    cats = sorted(df_copy["category"].unique())
-    sel_cat = st.multiselect("Category", cats, default=cats) 
+    sel_cat = dimension_filter("Category", "category")
 
     ### merchant filter
-    merch = sorted(df_copy["merchant"].unique())
-    sel_merch = st.multiselect("Merchant", merch, default=merch)
+    sel_merch = dimension_filter("Merchant", "merchant")
 
     ### payment filter
-    pay_methods = sorted(df_copy["payment_method"].unique())
-    sel_pay_method = st.multiselect("Payment Method", pay_methods, default=pay_methods)
+    sel_pay_method = dimension_filter("Payment Method", "payment_method")
 
     ### account type filter
-    accs = sorted(df_copy["account_type"].unique())
-    sel_acc = st.multiselect("Account Type", accs, default=accs)
+    sel_acc = dimension_filter("Account Type", "account_type")
 
     ### transaction type filter
-    tran = sorted(df_copy["transaction_type"].unique())
-    sel_tran = st.multiselect("Transaction Type", tran, default=tran)
+    sel_tran = dimension_filter("Transaction Type", "transaction_type")
+
+    ### exact or approximate results
+    # the sql backend reads exact amounts from the database and the stream backend only keeps a histogram grid,
+    # the pandas backend reads the percentiles and distribution from a sketch built once per data version
+    if use_sql or use_stream:
+        exact_results = use_sql
+    else:
+        exact_results = st.toggle(
+            "Exact results", value=True, disabled=preliminary,
+            help=f"Turn off on large datasets to read the amount percentiles, distinct counts and distribution "
+                 f"from a sketch of the data, within {sketches.QUANTILE_ACCURACY:.0%} of the exact amounts."
+        )
+        # the sample is small enough to read its amounts directly, the sketch is built from the full data
+        exact_results = exact_results or preliminary
+        if not exact_results:
+            # built with the data by load_pandas_data, read from the cache here
+            with profiling.stage("load sketch"):
+                sketch = sketches.load_sketch(file_path, data_version, data_partitions)
+                day_order = sketches.load_day_order(file_path, data_version, data_partitions)
+
+filter_spec = fx.make_filter_spec(date_range, sel_cat, sel_merch, sel_pay_method, sel_acc, sel_tran)
+# the date slider only moves within this index, so dragging it never rescans the data
+with profiling.stage("prefix index"):
+    if use_sql:
+        prefix_index = sql_backend.load_prefix_index(db_path, fx.dimension_filter_key(filter_spec), data_version)
+    elif use_stream:
+        prefix_index = streaming.load_prefix_index(file_path, stream_meta["content_hash"], fx.dimension_filter_key(filter_spec))
+    elif preliminary:
+        prefix_index = fx.build_prefix_index(fx.filter_data(cube, {**filter_spec, "date_range": None}))
+    else:
+        prefix_index = fx.load_prefix_index(file_path, fx.dimension_filter_key(filter_spec), data_version, data_partitions)
 
-filtered_df = fx.filter_dates(df_copy, date_range)
-filtered_df = fx.filter_category(filtered_df, sel_cat)
-filtered_df = fx.filter_merchant(filtered_df, sel_merch)
-filtered_df = fx.filter_payment(filtered_df, sel_pay_method)
-filtered_df = fx.filter_account(filtered_df, sel_acc)
-filtered_df = fx.filter_transaction(filtered_df, sel_tran)
+# figures and aggregates are shared between reruns and sessions, keyed on the filter spec and chart parameters
+figure_cache = fx.get_figure_cache()
+
+def chart_key(name, **params):
+    return fx.figure_key(name, file_path, filter_spec, backend=data_backend, preliminary=preliminary, **params)
+
+# the filtered rows are only computed when a chart misses the figure cache, at most once per rerun, and each
+# chart then takes just the columns it needs (the sql and stream backends never materialize the filtered rows,
+# their charts use aggregates instead)
+@functools.cache
+def get_filtered_positions():
+    return fx.filter_positions(df_copy, filter_spec)
+
+def filtered(column):
+    return fx.filtered_column(df_copy, get_filtered_positions(), column)
+
+@functools.cache
+def get_filtered_cube():
+    if use_sql:
+        return sql_backend.query_cube(db_path, filter_spec, dimension_values)
+    return fx.filter_data(cube, filter_spec)
 
 ## key metrics
 st.subheader("Metrics of All Transactions")
-with st.container(height=120, vertical_alignment="center"):
+with st.container(height=120, vertical_alignment="center"), profiling.stage("key metrics"):
+    total_amount, mean_amount, num_transactions = fx.range_metrics(prefix_index, date_range)
     met1, met2, met3 = st.columns(3)
-    met1.metric("Total Transaction Amount", f"${filtered_df['amount'].sum():,.2f}")
-    met2.metric("Average Transaction Amount", f"${filtered_df['amount'].mean():,.2f}")
-    met3.metric("Number of Transactions", f"{len(filtered_df):,}")
-
-tab1, tab2 = st.tabs(["Overview", "Potential Anomalies"])
+    met1.metric("Total Transaction Amount", f"${total_amount:,.2f}")
+    met2.metric("Average Transaction Amount", "–" if np.isnan(mean_amount) else f"${mean_amount:,.2f}")
+    met3.metric("Number of Transactions", f"{num_transactions:,}")
+
+# percentiles and distinct counts: exact from the filtered rows or the database, approximate from the sketch
+# (pandas backend with exact results off) or the histogram grid (stream backend)
+def build_amount_summary():
+    if not exact_results and not use_stream:
+        return sketches.sketch_summary(sketches.filter_sketch(sketch, filter_spec, df_copy, day_order))
+
+    if use_sql:
+        amounts, amount_counts = sql_backend.query_amount_counts(db_path, filter_spec, dimension_values)
+        quantiles = sketches.weighted_quantiles(amounts, amount_counts)
+    elif use_stream:
+        amounts, amount_counts = streaming.histogram_counts(aggregates["histogram"], filter_spec)
+        quantiles = sketches.weighted_quantiles(amounts, amount_counts)
+    elif preliminary:
+        # the strata are sampled at different rates, so each sampled amount stands for its weight in transactions
+        amounts = filtered("amount")
+        known = np.flatnonzero(~np.isnan(amounts))
+        order = known[np.argsort(amounts[known], kind="stable")]
+        quantiles = sketches.weighted_quantiles(amounts[order], filtered("weight")[order])
+    else:
+        # missing amounts are nan (see fx.to_cents) and have no rank
+        amounts = filtered("amount")
+        amounts = amounts[~np.isnan(amounts)]
+        quantiles = (np.quantile(amounts, sketches.QUANTILES, method="inverted_cdf").tolist() if len(amounts)
+                     else [np.nan] * len(sketches.QUANTILES))
+    return {"quantiles": quantiles, "distinct": sketches.distinct_counts(get_filtered_cube())}
+
+# Returns the caption stating the error bounds of approximate results, None for exact results
+    # bounded = what is within the accuracy of the exact amounts, e.g. "percentiles are" (string)
+    # widened = what is counted over whole months, e.g. "percentiles include" (string)
+def approximation_note(bounded, widened):
+    if exact_results:
+        return None
+    # the histogram grid counts whole months, a range starting or ending mid-month also counts the other days of
+    # those months, which no error bound covers (the sketch reads the days of partly covered months from the rows)
+    whole_months = streaming.month_range(date_range) if use_stream else None
+    if whole_months:
+        first, last = max(whole_months[0], min_d), min(whole_months[1], max_d)
+        if first < date_range[0] or last > date_range[1]:
+            return (f"Approximate: {widened} every transaction from {first:%-d %B %Y} to {last:%-d %B %Y}, "
+                    "the whole months the histogram grid counts.")
+    accuracy = streaming.HISTOGRAM_ACCURACY if use_stream else sketches.QUANTILE_ACCURACY
+    return f"Approximate: {bounded} within ±{accuracy:.1%} of the exact amounts."
+
+with st.container(height=120, vertical_alignment="center"), profiling.stage("amount summary"):
+    amount_summary = figure_cache.get_or_build(chart_key("amount_summary", exact=exact_results), build_amount_summary)
+    quantile_columns = st.columns(len(sketches.QUANTILES) + len(sketches.DISTINCT_COLUMNS))
+    for column, q, value in zip(quantile_columns, sketches.QUANTILES, amount_summary["quantiles"]):
+        column.metric("Median Amount" if q == 0.5 else f"{q:.0%} of Amounts Below",
+                      "–" if np.isnan(value) else f"${value:,.2f}")
+    for column, (col, count) in zip(quantile_columns[len(sketches.QUANTILES):], amount_summary["distinct"].items()):
+        column.metric({"merchant": "Merchants", "account_type": "Account Types"}[col], f"{count:,}")
+
+note = approximation_note("percentiles are", "percentiles include")
+if note:
+    st.caption(note + " Totals, averages and numbers of transactions are exact.")
+
+# only the selected view is computed, so the anomaly analysis never runs while the overview is shown
+view = st.radio("View", ["Overview", "Potential Anomalies"], horizontal=True, key="view", label_visibility="collapsed")
+
+# each section below is a fragment: changing one of its widgets only reruns that section
 
 ## tab 1: overview
-with tab1:
+@st.fragment
+@profiling.section
+def transactions_over_time_section():
     st.subheader("Transactions Over Time")
-    freq = st.radio("Frequency of Transaction Overview", ["Daily", "Weekly", "Monthly"], horizontal=True)
-    freq_map = {"Daily": "D", "Weekly": "W", "Monthly": "ME"}
+    freq = st.radio("Frequency of Transaction Overview", list(charts.FREQUENCIES), horizontal=True)
     
     col1, col2 = st.columns(2)
     
     ### Line chart for spending over time with mean line
-    with col1:
-        overall_fig = fx.line_with_mean(df=filtered_df,
-                                x="Date",
-                                y="amount",
-                                freq=freq_map[freq])
-    
-        overall_fig.update_traces(
-            line=dict(color='lightblue'),
-            hovertemplate=
-                '%{x}<br>' +
-                'Total Amount: $%{y:,.2f}',
-            hoverlabel=dict(
-                bgcolor='#061e49',
-                font_size=12,
-                font_color='white'
-            )
-        )
+    def build_overall_fig():
+        return charts.overall_figure(fx.range_daily_totals(prefix_index, date_range), freq)
 
-        overall_fig.update_layout(
-            xaxis_title="Date",
-            yaxis_title="Total Amount ($)",
-        )
-
-        st.plotly_chart(overall_fig)
+    with col1:
+        profiling.plotly_chart(figure_cache.get_or_build(chart_key("overall", freq=freq), build_overall_fig), name="overall")
     
     ### Bar + line chart for amount by day of the week
-    with col2:
-        df_daily = filtered_df.copy()
-        df_daily['Day'] = df_daily['Date'].dt.day_name()
-
-        WEEKDAY_ORDER = ["Monday","Tuesday","Wednesday","Thursday","Friday","Saturday","Sunday"]
-
-        df_daily['Day'] = pd.Categorical(df_daily['Day'], 
-                                        categories=WEEKDAY_ORDER, 
-                                        ordered=True)
-        
-        avg_transaction_df = df_daily.groupby('Day', as_index=False, observed=False)["amount"].mean().sort_values('Day')
-        num_transaction_df = df_daily.groupby('Day', as_index=False, observed=False)["amount"].count().sort_values('Day')
-
-        daily_fig = fx.bar_line_chart(x1=avg_transaction_df["Day"],
-                                    y1=avg_transaction_df["amount"].round(2),
-                                    name1="Average Transaction Amount",
-                                    x2=num_transaction_df["Day"],
-                                    y2=num_transaction_df["amount"],
-                                    name2="Number of Transactions")
-        
-        daily_fig.update_layout(
-            title="By Day of the Week",
-            xaxis_title="Day of the Week",
-            yaxis_title="Average Amount ($) / Number of Transactions",
-            showlegend=False,
-            hovermode="x",
-        )
+    def build_daily_fig():
+        return charts.weekday_figure(get_filtered_cube())
 
-        daily_fig.update_traces(
-            selector=dict(type='bar'),
-            text=avg_transaction_df["amount"].round(2),
-            textposition='auto',
-            hovertemplate='Average Amount: $%{y:.2f}<extra></extra>',
-            hoverlabel=dict(
-                bgcolor='#061e49',
-                font_size=12,
-                font_color='white'
-            )
-        )
-
-        daily_fig.update_traces(
-            selector=dict(type='scatter'),
-            hovertemplate='Number of Transactions: %{y}<extra></extra>',
-            hoverlabel=dict(
-                bgcolor='#E54E04',
-                font_size=12,
-                font_color='white'
-            )
-        )
-
-        st.plotly_chart(daily_fig)
+    with col2:
+        profiling.plotly_chart(figure_cache.get_or_build(chart_key("weekday"), build_daily_fig), name="weekday")
 
+@st.fragment
+@profiling.section
+def spending_by_category_section():
     ### stacked bar chart for spending by category, payment method, account type, etc.
     st.subheader("Spending by Category and Payment Method / Account Type / Transaction Type")
 
-    segment_bar = st.radio("Segment barplot by:",
-                           ["Payment Method", "Account Type", "Transaction Type"],
-                           horizontal=True)
-    
-    bar_mapping = {"Payment Method": "payment_method",
-                   "Account Type": "account_type",
-                   "Transaction Type": "transaction_type"}
-
-    stacked_bar_fig = fx.stacked_bar_chart(
-        df=filtered_df,
-        x="category",
-        y="amount",
-        color=bar_mapping[segment_bar]
-    )
-
-    stacked_bar_fig.update_layout(
-        title="Spending for the Top 5 Categories (by Total Transaction Amount), Grouped By " + segment_bar, 
-        legend_title_text=segment_bar,
-        barmode="stack",
-        xaxis_title="Total Amount ($)",
-        yaxis_title="Category"
-    )
+    segment_bar = st.radio("Segment barplot by:", list(charts.SEGMENTS), horizontal=True)
 
-    stacked_bar_fig.update_traces(
-        hovertemplate='Spent $%{x:,.2f} in %{y} using %{fullData.name}<extra></extra>',
-        hoverlabel=dict(
-            bgcolor='#061e49',
-            font_size=12,
-            font_color='white'
-        )
-    )
+    def build_stacked_bar_fig():
+        return charts.stacked_bar_figure(get_filtered_cube(), segment_bar)
 
-    st.plotly_chart(stacked_bar_fig)
+    profiling.plotly_chart(figure_cache.get_or_build(chart_key("stacked_bar", segment=segment_bar), build_stacked_bar_fig), name="stacked_bar")
 
+@st.fragment
+@profiling.section
+def spending_distribution_section():
     ### histogram for distribution of spending
     st.subheader("Distribution of Spending")
 
-    df_hist = filtered_df.copy()
-
-    histo_fig = fx.histogram(
-        df=df_hist,
-        x="amount"
-    )
-
-    histo_fig.update_traces(
-        textposition="outside",
-        marker=dict(
-            color="lightblue",                
-            line=dict(width=1, color="black")
-        ),
-        textfont=dict(size=12, color="black"),
-        cliponaxis=False,
-        hovertemplate=
-            'Amount Range: %{x}<br>' +
-            'Frequency: %{y}',
-        hoverlabel=dict(
-            bgcolor='#061e49',
-            font_size=12,
-            font_color='white'
-        )
-)
-
-    histo_fig.update_layout(
-        title="Distribution of Transaction Amounts",
-        xaxis_title="Total Amount ($)",
-        yaxis_title="Frequency"
-    )
-
-    st.plotly_chart(histo_fig)
+    hist_col1, hist_col2 = st.columns([1, 3])
+    hist_bins = hist_col1.selectbox("Number of bins", ["Auto", 10, 20, 50, 100])
+    hist_log = hist_col2.checkbox("Log scale amounts (positive amounts only)", value=False)
+    hist_rule = "fd" if hist_bins == "Auto" else hist_bins
+
+    def build_histo_fig():
+        if use_sql:
+            amounts, amount_counts = sql_backend.query_amount_counts(db_path, filter_spec, dimension_values)
+            histo_bins = fx.histogram_bins(amounts, bins=hist_rule, log_scale=hist_log, weights=amount_counts)
+        elif use_stream:
+            amounts, amount_counts = streaming.histogram_counts(aggregates["histogram"], filter_spec)
+            histo_bins = fx.histogram_bins(amounts, bins=hist_rule, log_scale=hist_log, weights=amount_counts)
+        elif not exact_results:
+            amounts, amount_counts = sketches.bucket_counts(sketches.filter_sketch(sketch, filter_spec, df_copy, day_order))
+            histo_bins = fx.histogram_bins(amounts, bins=hist_rule, log_scale=hist_log, weights=amount_counts)
+        else:
+            histo_bins = fx.histogram_bins(filtered("amount"), bins=hist_rule, log_scale=hist_log)
+
+        return charts.histogram_figure(histo_bins, log_scale=hist_log)
+
+    histo_key = chart_key("histogram", bins=hist_rule, log_scale=hist_log, exact=exact_results)
+    profiling.plotly_chart(figure_cache.get_or_build(histo_key, build_histo_fig), name="histogram")
+    histo_note = approximation_note("binned amounts are", "the bins include")
+    if histo_note:
+        st.caption(histo_note)
 
 ## tab 2: anomaly detection
-with tab2:
+@st.fragment
+@profiling.section
+def scatter_section():
     ### Scatter plot of Amount against Dates with Line of Best Fit
     st.subheader("Scatter Plot of Amount Against Time with Line of Best Fit")
 
-    df_scatter = filtered_df.copy()
-    df_scatter["Date_ordinal"] = df_scatter["Date"].map(pd.Timestamp.toordinal)
-
-    scatter_color = st.radio("Colour scatter plot by:",
-                             ["Category", "Merchant", "Payment Method", "Account Type", "Transaction Type"],
-                             horizontal=True)
-    scatter_mapping = {"Category": "category",
-                       "Merchant": "merchant",
-                       "Payment Method": "payment_method",
-                       "Account Type": "account_type",
-                       "Transaction Type": "transaction_type"}
-    
-    color_col = scatter_mapping[scatter_color]
+    scatter_color = st.radio("Colour scatter plot by:", list(charts.SCATTER_COLORS), horizontal=True)
     
-    scatter_fig = fx.scatterplot_with_line(
-        x=df_scatter["Date_ordinal"], 
-        y=df_scatter["amount"],
-        color=df_scatter[color_col]
-    )
+    color_col = charts.SCATTER_COLORS[scatter_color]
+
+    # outliers are either the points furthest above the line of best fit, or the transactions scoring highest
+    # against the usual amounts of their merchant, category and account type
+    score_methods = {"Line of best fit": None, "Mean and standard deviation per group": "moments"}
+    if not (use_sql or use_stream):
+        score_methods["Median and MAD per group"] = "robust"
+    set1, set2, set3 = st.columns(3)
+    score_method = score_methods[set1.selectbox("Find outliers with", list(score_methods))]
+    top_k = set2.number_input("Highlighted outliers", min_value=1, max_value=1000, value=100, step=10)
+    highlight_only = set3.checkbox("Only show highlighted outliers")
+
+    # baselines cover every transaction whatever the filters, they follow the data as rows are appended
+    def get_baselines():
+        def build_baselines():
+            if score_method == "robust":
+                return outliers.group_baselines(df_copy, "robust")
+            if use_sql:
+                return outliers.group_baselines(sql_backend.query_cube(db_path, fx.make_filter_spec(), dimension_values))
+            return outliers.group_baselines(cube)
+
+        key = fx.figure_key("outlier_baselines", file_path, fx.make_filter_spec(), backend=data_backend,
+                            method=score_method, partitions=data_partitions, preliminary=preliminary)
+        return figure_cache.get_or_build(key, build_baselines)
+
+    # the top scored transactions, with their position among the scatter points for the pandas and stream backends
+    def build_top_outliers():
+        if use_sql:
+            return sql_backend.query_top_scores(db_path, filter_spec, dimension_values, get_baselines(), top_k)
+        if use_stream:
+            rows = fx.filter_data(aggregates["sample"], filter_spec)
+            dates, amounts, column = rows["Date"].to_numpy(), rows["amount"].to_numpy(), lambda col: rows[col].array
+        else:
+            dates, amounts, column = filtered("Date"), filtered("amount"), filtered
+        scores = outliers.score_amounts(amounts, {col: column(col) for col in outliers.SCORE_COLUMNS}, get_baselines())
+        positions = outliers.top_positions(scores, top_k)
+        top = pd.DataFrame({"position": positions, "Date": dates[positions], "amount": amounts[positions],
+                            **{col: column(col)[positions] for col in fx.DIMENSION_COLUMNS},
+                            "score": scores[positions]})
+        # descriptions stay in the columnar cache, only those of the listed transactions are read
+        if not (use_stream or preliminary):
+            frame_positions = positions if get_filtered_positions() is None else get_filtered_positions()[positions]
+            top["description"] = fx.load_descriptions(file_path, frame_positions, data_partitions)
+        return top
+
+    top_outliers = None
+    if score_method:
+        top_outliers = figure_cache.get_or_build(chart_key("top_outliers", method=score_method, k=top_k), build_top_outliers)
+
+    def build_scatter_fig():
+        highlight = None if top_outliers is None else top_outliers.get("position")
+        if use_sql or use_stream:
+            if use_sql:
+                # the sample is already within the point budget, with room left for the top scored rows
+                budget = fx.SCATTER_POINT_BUDGET - (0 if top_outliers is None else len(top_outliers))
+                sample = sql_backend.query_scatter_sample(db_path, filter_spec, dimension_values, color_col, budget)
+            else:
+                sample = streaming.scatter_sample(aggregates, get_filtered_cube(), filter_spec, color_col)
+            x, y, color = sample["x"], sample["y"], sample["color"]
+            if use_sql and top_outliers is not None:
+                # the top scored rows come from their own query, they are drawn after the sample
+                highlight = np.arange(len(x), len(x) + len(top_outliers))
+                x = np.concatenate([x, fx.date_ordinals(top_outliers["Date"]).astype("float64")])
+                y = np.concatenate([y, top_outliers["amount"].to_numpy(dtype="float64")])
+                color = np.concatenate([color, top_outliers[color_col].to_numpy(dtype=object)])
+            scatter_fig = fx.scatterplot_with_line(
+                x=x,
+                y=y,
+                color=color,
+                max_points=None if use_sql else fx.SCATTER_POINT_BUDGET,
+                fit=sample["fit"],
+                x_range=sample["x_range"],
+                highlight=None if highlight is None else np.asarray(highlight),
+                highlight_only=highlight_only
+            )
+            first_date, last_date = ([pd.Timestamp.fromordinal(int(x)) for x in sample["x_range"]]
+                                     if sample["x_range"] else (pd.NaT, pd.NaT))
+        else:
+            scatter_dates = filtered("Date")
+            scatter_fig = fx.scatterplot_with_line(
+                x=fx.date_ordinals(scatter_dates), 
+                y=filtered("amount"),
+                color=filtered(color_col),
+                max_points=fx.SCATTER_POINT_BUDGET,
+                highlight=None if highlight is None else np.asarray(highlight),
+                highlight_only=highlight_only
+            )
+            first_date, last_date = ((pd.Timestamp(scatter_dates.min()), pd.Timestamp(scatter_dates.max()))
+                                     if len(scatter_dates) else (pd.NaT, pd.NaT))
     
-    # update dates to be readable
-    monthly_ticks = df_scatter[df_scatter["Date"].dt.is_month_start]
-    tickvals = monthly_ticks["Date_ordinal"]
-    ticktext = monthly_ticks["Date"].dt.strftime("%b %Y")
-
-    scatter_fig.update_xaxes(
-        tickvals=tickvals,
-        ticktext=ticktext,
-        title_text="Date"
-    )
-    scatter_fig.update_yaxes(title_text="Total Amount ($)")
-    scatter_fig.update_layout(
-        title="Spending Against Time, Coloured by " + scatter_color, 
-        legend_title_text=scatter_color
-    )
-    scatter_fig.update_traces(
-        hovertemplate="$%{y} (%{fullData.name})<extra></extra>",
-        hoverlabel=dict(
-            bgcolor='#061e49',
-            font_size=12,
-            font_color='white'
-        )
-    )
+        # update dates to be readable, one tick per month start
+        return charts.style_scatter(scatter_fig, first_date, last_date, scatter_color)
 
-    st.plotly_chart(scatter_fig)
+    scatter_key = chart_key("scatter", color=color_col, max_points=fx.SCATTER_POINT_BUDGET,
+                            method=score_method, k=top_k, highlight_only=highlight_only)
+    profiling.plotly_chart(figure_cache.get_or_build(scatter_key, build_scatter_fig), name="scatter")
 
     st.caption(
         "This scatter plot highlights high-value outliers above the line of best fit. "
         "Use the radio buttons to change the color grouping of the points."
     )
 
-    ### Heatmap of Number of Transactions with Merchants by Week
-    # 1. Find the top 10 merchants with the highest total transaction counts for each month
-    # 2. Plot the heatmap of these merchants for both the number of transactions and total transaction amounts
+    if top_outliers is not None:
+        st.caption(
+            f"**Top Outliers** are the {top_k:,} transactions furthest above the usual amount of their merchant, "
+            "category or account type, counted in standard deviations (or scaled median absolute deviations) "
+            "of that group; the score is the highest of the three. Groups with fewer than "
+            f"{outliers.MIN_BASELINE_ROWS} transactions are not used."
+            + (" With the stream backend only the stored sample of transactions is scored." if use_stream else "")
+        )
+        with st.expander("Top scored transactions"):
+            st.dataframe(top_outliers, hide_index=True,
+                         column_order=[col for col in ["Date", "amount"] + fx.DIMENSION_COLUMNS + fx.LAZY_COLUMNS + ["score"]
+                                       if col in top_outliers],
+                         column_config={
+                             **{col: col.replace("_", " ").title() for col in fx.DIMENSION_COLUMNS + fx.LAZY_COLUMNS},
+                             "Date": st.column_config.DatetimeColumn("Date"),
+                             "amount": st.column_config.NumberColumn("Amount ($)", format="%.2f"),
+                             "score": st.column_config.NumberColumn("Score", format="%.2f"),
+                         })
+
+    if num_transactions > fx.SCATTER_POINT_BUDGET and not preliminary and not (top_outliers is not None and highlight_only):
+        st.caption(
+            f"Showing {fx.SCATTER_POINT_BUDGET:,} of {num_transactions:,} transactions: the "
+            + ("top outliers" if top_outliers is not None else "points furthest above the line of best fit")
+            + " are always kept and the rest is a random sample of each colour group. "
+            "The line of best fit is computed on every transaction."
+        )
+
+@st.fragment
+@profiling.section
+def heatmap_section():
+    ### Heatmap of Number of Transactions and Total Amount, by merchant and month by default
+    # 1. Find the top N rows (e.g. merchants) with the highest total transaction counts
+    # 2. Plot the heatmap of these rows for both the number of transactions and total transaction amounts
 
-    st.subheader("Monthly Heatmap of Transactions and Total Amount by Merchant")
+    heatmap_axes, heatmap_buckets = charts.HEATMAP_AXES, charts.HEATMAP_BUCKETS
+
+    set1, set2, set3 = st.columns([2, 2, 1])
+    row_label = set1.selectbox("Heatmap rows", list(heatmap_axes))
+    col_label = set2.selectbox("Heatmap columns", list(heatmap_buckets))
+    top_n = set3.number_input("Top rows", min_value=1, max_value=50, value=10, step=1)
+
+    st.subheader(f"Heatmap of Transactions and Total Amount by {row_label} and {col_label}")
+    if col_label == row_label:
+        st.info("Choose different dimensions for the heatmap rows and columns.")
+        return
 
     col1, col2 = st.columns(2)
 
+    # both heatmaps share one aggregation of the filtered cube
+    def build_heatmap_data():
+        return fx.heatmap_matrices(get_filtered_cube(), rows=heatmap_axes[row_label],
+                                   columns=heatmap_buckets[col_label], top_n=top_n)
+
+    heatmap_params = dict(rows=row_label, columns=col_label, top_n=top_n)
+    heatmap_data_num, heatmap_data_total = figure_cache.get_or_build(chart_key("heatmap_data", **heatmap_params), build_heatmap_data)
+
+    def build_heatmap_num_fig():
+        return charts.heatmap_figure(heatmap_data_num, row_label, col_label, value="count")
+
+    def build_heatmap_total_fig():
+        return charts.heatmap_figure(heatmap_data_total, row_label, col_label, value="amount")
+
     # heatmap 1: Heatmap of Number of Transactions by Merchant
     with col1:
-        df_heatmap_merchants = filtered_df.copy()
-        # create 'Month' column
-        df_heatmap_merchants['Month'] = df_heatmap_merchants['Date'].dt.to_period('M').apply(lambda r: r.start_time)
-        # count the number of transactions for each month for every merchant
-        merchant_transactions_num = df_heatmap_merchants.groupby(['merchant', 'Month']).size().reset_index(name='transaction_count')
-        # calculate total number of transactions across all months    
-        merchant_transactions_totals = merchant_transactions_num.groupby('merchant')['transaction_count'].sum().sort_values(ascending=False)
-        # keep only top 10 merchants
-        top_10_merchants = merchant_transactions_totals.head(10).index
-        # filter the df to only keep the top 10 merchants
-        top_merchant_num_df = merchant_transactions_num[merchant_transactions_num['merchant'].isin(top_10_merchants)]
-        # pivot by merchant and month using transaction_counts
-        heatmap_data_num = top_merchant_num_df.pivot(index='merchant', columns='Month', values='transaction_count').fillna(0)
-        # sort by the order of the top 10 merchants
-        heatmap_data_num = heatmap_data_num.loc[top_10_merchants]
-
-        heatmap_merchant_num = fx.heatmap(heatmap_data_num)
-
-        heatmap_merchant_num.update_coloraxes(showscale=False)
-        heatmap_merchant_num.update_traces(
-            hovertemplate=
-                '<b>Merchant:</b> %{y}<br>' +
-                '<b>Month of</b> %{x}<br>' +
-                '<b>Total Amount:</b> $%{z}<extra></extra>',
-            hoverlabel=dict(
-                bgcolor='#061e49',
-                font_size=12,
-                font_color='white'
-            )
-        )
-        heatmap_merchant_num.update_layout(
-            yaxis_title="Merchant",
-            title="By Number of Transactions"
-        )
-
-        st.plotly_chart(heatmap_merchant_num)
+        profiling.plotly_chart(figure_cache.get_or_build(chart_key("heatmap_num", **heatmap_params), build_heatmap_num_fig), name="heatmap_num")
     
     # heatmap 2: Heatmap of Total Transaction Amount by Merchant
     with col2:
-        merchant_transactions_total = df_heatmap_merchants.groupby(['merchant', 'Month'])['amount'].sum().reset_index()
-        top_merchant_total_df = merchant_transactions_total[merchant_transactions_total['merchant'].isin(top_10_merchants)]
-        heatmap_data_total = top_merchant_total_df.pivot(index='merchant', columns='Month', values='amount').fillna(0)
-        heatmap_data_total = heatmap_data_total.loc[top_10_merchants]
-
-        heatmap_merchant_total = fx.heatmap(df=heatmap_data_total)
-
-        heatmap_merchant_total.update_coloraxes(showscale=False)
-        heatmap_merchant_total.update_traces(
-            hovertemplate=
-                '<b>Merchant:</b> %{y}<br>' +
-                '<b>Month of</b> %{x}<br>' +
-                '<b>Total Amount:</b> $%{z}<extra></extra>',
-            hoverlabel=dict(
-                bgcolor='#061e49',
-                font_size=12,
-                font_color='white'
-            )
-        )
-        heatmap_merchant_total.update_layout(
-            yaxis_title="",
-            title="By Total Transaction Amount"
-        )
-
-        st.plotly_chart(heatmap_merchant_total)
+        profiling.plotly_chart(figure_cache.get_or_build(chart_key("heatmap_total", **heatmap_params), build_heatmap_total_fig), name="heatmap_total")
 
     st.caption(
         "**Dark boxes** in the heatmaps indicate high values and **light boxes** indicate low values. \n\n"
@@ -357,6 +565,87 @@ with tab2:
         "- **Left heatmap bright / Right heatmap dark**: Indicates low number of transactions (left) but a high total amount (right), suggesting there were small large purchases in the month, which may warrant review to ensure proper approval was granted for these transactions."
     )
 
+@st.fragment
+@profiling.section
+def payment_patterns_section():
+    ### Split payments and duplicates
+    # 1. Payments to the same group that each stay below an approval limit but cross it together within a time window
+    # 2. Transactions of the same amount to the same group within a few minutes of each other
+    st.subheader("Split Payments and Duplicate Transactions")
+
+    if use_stream:
+        st.info("Split payment and duplicate detection needs every transaction, use the pandas or sql backend.")
+        return
+    if preliminary:
+        st.info("Split payment and duplicate detection needs every transaction, it runs once the full data is loaded.")
+        return
+
+    pattern_groups = {"Merchant": ["merchant"],
+                      "Merchant and Account Type": ["merchant", "account_type"],
+                      "Merchant and Payment Method": ["merchant", "payment_method"],
+                      "Account Type": ["account_type"]}
+
+    set1, set2, set3, set4 = st.columns(4)
+    pattern_group = set1.selectbox("Group payments by", list(pattern_groups))
+    approval_limit = set2.number_input("Approval limit ($)", min_value=1.0, value=1000.0, step=100.0)
+    split_hours = set3.number_input("Split payment window (hours)", min_value=1, max_value=24 * 31, value=24)
+    duplicate_minutes = set4.number_input("Duplicate window (minutes)", min_value=0, max_value=24 * 60, value=10)
+
+    group_cols = pattern_groups[pattern_group]
+    # an exact duplicate also matches on the time and every other dimension
+    exact_cols = [col for col in fx.DIMENSION_COLUMNS if col not in group_cols]
+
+    def detection_rows():
+        if use_sql:
+            return sql_backend.query_detection_rows(db_path, filter_spec, dimension_values, fx.DIMENSION_COLUMNS)
+        return pd.DataFrame({"Date": filtered("Date"), "amount_cents": filtered("amount_cents"),
+                             **{col: filtered(col) for col in fx.DIMENSION_COLUMNS}})
+
+    def build_patterns():
+        rows = detection_rows()
+        splits = detection.split_payments(rows, group_cols, pd.Timedelta(hours=split_hours), approval_limit)
+        duplicates = detection.duplicate_transactions(rows, group_cols, pd.Timedelta(minutes=duplicate_minutes), exact_cols)
+        return splits, duplicates
+
+    splits, duplicates = figure_cache.get_or_build(
+        chart_key("payment_patterns", group=pattern_group, limit=approval_limit, hours=split_hours, minutes=duplicate_minutes),
+        build_patterns
+    )
+
+    group_config = {col: col.replace("_", " ").title() for col in group_cols}
+    col1, col2 = st.columns(2)
+    with col1:
+        st.markdown(f"**{len(splits):,} possible split payments** (each payment below ${approval_limit:,.2f}, "
+                    f"together above it within {split_hours} hours)")
+        st.dataframe(splits, hide_index=True, column_config={
+            **group_config,
+            "first": st.column_config.DatetimeColumn("First Payment"),
+            "last": st.column_config.DatetimeColumn("Last Payment"),
+            "payments": st.column_config.NumberColumn("Payments", format="%d"),
+            "total": st.column_config.NumberColumn("Total ($)", format="%.2f"),
+            "largest": st.column_config.NumberColumn("Largest ($)", format="%.2f"),
+        })
+    with col2:
+        st.markdown(f"**{len(duplicates):,} possible duplicates** (same amount within {duplicate_minutes} minutes)")
+        st.dataframe(duplicates, hide_index=True, column_config={
+            **group_config,
+            "amount": st.column_config.NumberColumn("Amount ($)", format="%.2f"),
+            "first": st.column_config.DatetimeColumn("First"),
+            "last": st.column_config.DatetimeColumn("Last"),
+            "transactions": st.column_config.NumberColumn("Transactions", format="%d"),
+            "kind": "Kind",
+        })
+
+    st.caption(
+        "Click a column header to sort. A **split payment** row is a window of the chosen length in which payments that "
+        "are each below the approval limit reach it together; windows do not overlap. \n\n"
+        "A duplicate is **exact** when the time and every other field match as well, otherwise it is **near**."
+        + (" The sql backend stores the day of each transaction only, so duplicates are matched within the same day." if use_sql else "")
+    )
+
+@st.fragment
+@profiling.section
+def benford_chart_section():
     ### Benford's Law Bar Chart
     # Benford's Law describes the relative frequency distribution for leading digits of numbers in real-world datasets.
     st.subheader("Bar Chart of Benford's Law")
@@ -373,84 +662,134 @@ with tab2:
 
     include_negatives_zeros = st.checkbox("Include negative and zero amounts?", value=False)
 
-    df_benford = filtered_df.copy()
-
-    digits_without = ["1","2","3","4","5","6","7","8","9"]
-    # taken from: https://mathworld.wolfram.com/BenfordsLaw.html
-    benford_without = [30.103, 17.6091, 12.4939, 9.691, 7.91812, 6.69468, 5.79919, 5.11525, 4.57575]
-
-    if include_negatives_zeros:
-        digits = ["-1", "0"] + digits_without
-        benford_values = [0, 0] + benford_without
-    else:
-        digits = digits_without
-        benford_values = benford_without
-
-    neg_count = (df_benford['amount'] < 0).sum() if include_negatives_zeros else 0
-    zero_count = ((df_benford['amount'] > 0) & (df_benford['amount'] < 1)).sum() if include_negatives_zeros else 0
+    def build_benford_fig():
+        if use_sql:
+            observed_values, neg_count, zero_count = sql_backend.query_first_digit_counts(db_path, filter_spec, dimension_values)
+        elif use_stream:
+            observed_values, neg_count, zero_count = streaming.first_digit_counts(get_filtered_cube())
+        else:
+            benford_amounts = filtered("amount")
+            neg_count = (benford_amounts < 0).sum()
+            zero_count = ((benford_amounts > 0) & (benford_amounts < 1)).sum()
+            first_digits = benford.first_digit(benford_amounts[benford_amounts >= 1])
+            observed_values = benford.digit_counts(first_digits)[0].tolist()
+
+        return charts.benford_figure(observed_values, neg_count, zero_count, include_negatives_zeros)
+
+    profiling.plotly_chart(figure_cache.get_or_build(chart_key("benford", include_negatives_zeros=include_negatives_zeros), build_benford_fig), name="benford")
     
-    df_benford = df_benford[df_benford['amount'] >= 1]
-    df_benford['first_digit'] = df_benford['amount'].apply(lambda x: int(str(x)[0]))
-
-    first_digit_counts = df_benford['first_digit'].value_counts().sort_index()
-    observed_values = [first_digit_counts.get(i, 0) for i in range(1,10)]
-    total_count = sum(observed_values) + neg_count + zero_count
-
-    observed_percentages = [(count / total_count) * 100 for count in observed_values]
-    neg_percent = (neg_count / total_count) * 100
-    zero_percent = (zero_count / total_count) * 100
-    observed_percentages_full = ([neg_percent, zero_percent] + observed_percentages) if include_negatives_zeros else observed_percentages
-
-    benford_values_rounded = [round(val, 2) for val in benford_values]
-    observed_percentages_rounded = [round(val, 2) for val in observed_percentages_full]
-
-    benford_fig = fx.dual_bar_chart(
-        x1=digits,
-        y1=benford_values_rounded,
-        name1="Benford's Law",
-        x2=digits,
-        y2=observed_percentages_rounded,
-        name2="Observed"
+    st.caption(
+        "Note: The digit \"-1\" indicate that the number is a negative number. \n\n"
+        "Interpretation of bar chart: \n"
+        "- If the chart predominantly shows **green**, this is in line with expected values of the first digit of the amounts.\n"
+        "- However, if **yellow** or **blue** dominate, it might indicate a deviation from Benford's Law, suggesting a potential anomaly in the transactional data. \n"
+        "- If there are **negative values** in the transaction amounts, it could indicate a refund or potential error."
     )
 
-    benford_fig.update_layout(
-        title="Benford's Law vs Observed Data",
-        xaxis_title="First Digit of Transaction Amount",
-        yaxis_title="Percentage (%)",
-        barmode='overlay',
-        showlegend=True,
-        hovermode="x",
-        xaxis=dict(
-            dtick=1
+@st.fragment
+@profiling.section
+def benford_ranking_section():
+    ### Benford's Law deviation ranking
+    st.subheader("Benford's Law Deviation by Group")
+
+    benford_group = st.radio("Rank Benford's Law deviation by:", list(charts.BENFORD_GROUPS), horizontal=True)
+    benford_group_mapping = charts.BENFORD_GROUPS
+
+    def build_benford_ranking():
+        if use_sql:
+            group_col = benford_group_mapping[benford_group]
+            labels, counts = sql_backend.query_first_digit_counts_by_group(db_path, filter_spec, dimension_values, group_col)
+            return benford.rank_groups(labels, counts, group_col, min_count=30)
+        if use_stream:
+            group_col = benford_group_mapping[benford_group]
+            labels, counts = streaming.first_digit_counts_by_group(get_filtered_cube(), group_col)
+            return benford.rank_groups(labels, counts, group_col, min_count=30)
+
+        group_col = benford_group_mapping[benford_group]
+        benford_df = pd.DataFrame({group_col: filtered(group_col), "amount": filtered("amount")})
+        return benford.benford_by_group(
+            benford_df[benford_df['amount'] >= 1],
+            group_col=group_col,
+            min_count=30
         )
-    )
 
-    benford_fig.update_traces(
-        selector=dict(type='bar', name='Benford\'s Law'),
-        hovertemplate='%{fullData.name}<extra></extra>: %{y}%',
-        hoverlabel=dict(
-            bgcolor='skyblue',
-            font_color='black',
-            font_size=12
-        )
+    benford_ranking = figure_cache.get_or_build(chart_key("benford_ranking", group=benford_group), build_benford_ranking)
+
+    st.dataframe(
+        benford_ranking,
+        hide_index=True,
+        column_config={
+            benford_group_mapping[benford_group]: benford_group,
+            "n": st.column_config.NumberColumn("Transactions", format="%d"),
+            "chi_square": st.column_config.NumberColumn("Chi-Square", format="%.2f"),
+            "mad": st.column_config.NumberColumn("MAD", format="%.4f"),
+            "ks": st.column_config.NumberColumn("KS", format="%.4f"),
+            "conformity": "Conformity",
+        }
     )
 
-    benford_fig.update_traces(
-        selector=dict(type='bar', name='Observed'),
-        hovertemplate='%{fullData.name}<extra></extra>: %{y}%',
-        hoverlabel=dict(
-            bgcolor='#edc001',
-            font_color='black',
-            font_size=12
-        )
+    st.caption(
+        "Groups with at least 30 transactions of $1 or more, ranked by mean absolute deviation (MAD) from Benford's Law. \n\n"
+        "Conformity follows Nigrini's MAD thresholds for the first digit: **Close** (≤ 0.006), **Acceptable** (≤ 0.012), "
+        "**Marginal** (≤ 0.015), otherwise **Nonconformity**. Higher chi-square and KS values also indicate a larger deviation."
     )
 
-    st.plotly_chart(benford_fig)
-    
+if view == "Overview":
+    transactions_over_time_section()
+    spending_by_category_section()
+    spending_distribution_section()
+else:
+    scatter_section()
+    heatmap_section()
+    payment_patterns_section()
+    benford_chart_section()
+    benford_ranking_section()
+
+## figure cache statistics
+with st.sidebar.expander("Figure Cache"):
+    cache_stats = figure_cache.stats()
     st.caption(
-        "Note: The digit \"-1\" indicate that the number is a negative number. \n\n"
-        "Interpretation of bar chart: \n"
-        "- If the chart predominantly shows **green**, this is in line with expected values of the first digit of the amounts.\n"
-        "- However, if **yellow** or **blue** dominate, it might indicate a deviation from Benford's Law, suggesting a potential anomaly in the transactional data. \n"
-        "- If there are **negative values** in the transaction amounts, it could indicate a refund or potential error."
-    )
\ No newline at end of file
+        f"{cache_stats['entries']:,} cached figures and aggregates ({cache_stats['bytes'] / 1e6:,.1f} MB), "
+        f"{cache_stats['hits']:,} hits / {cache_stats['misses']:,} misses "
+        f"({cache_stats['hit_rate']:.0%} hit rate), {cache_stats['evictions']:,} evictions"
+    )
+
+## memory usage
+with st.sidebar.expander("Memory Usage"):
+    # objects returned by st.cache_data are copies held by this session, the dataset, its cube and the figure
+    # cache are held once by the process and shared by every session
+    held_objects = {("Prefix index", "session"): prefix_index}
+    if use_stream:
+        held_objects[("Streamed aggregates", "shared")] = aggregates
+    elif not use_sql:
+        held_objects[("Sample" if preliminary else "Transactions", "shared")] = df_copy
+        held_objects[("Sample cube" if preliminary else "Cube", "shared")] = cube
+        if get_filtered_positions.cache_info().currsize:
+            held_objects[("Filtered row positions", "session")] = get_filtered_positions()
+    memory = fx.memory_usage(held_objects)
+    memory.loc[len(memory)] = ["Figure cache", "shared", cache_stats["bytes"]]
+    memory["MB"] = memory["bytes"] / 1e6
+
+    st.dataframe(memory[["object", "scope", "MB"]], hide_index=True,
+                 column_config={"MB": st.column_config.NumberColumn(format="%.2f")})
+    st.caption(f"{memory.loc[memory['scope'] == 'session', 'MB'].sum():,.1f} MB held by this session")
+
+## performance breakdown, a debug panel only shown when profiling is on (DASHBOARD_PROFILE=1)
+if profiling.ENABLED:
+    with st.sidebar.expander("Performance"):
+        breakdown = profiling.rerun_breakdown()
+        top_level = breakdown[breakdown["depth"] == 0]
+        st.caption(f"{top_level['seconds'].sum():,.3f} s in {len(top_level)} top-level stages this rerun "
+                   f"(fragment reruns are added to it), function calls under 1 ms are only in the log")
+
+        # nested stages are indented under the stage that called them
+        breakdown["stage"] = ["\u2003" * depth + name for depth, name in zip(breakdown["depth"], breakdown["stage"])]
+        st.dataframe(breakdown[["stage", "kind", "seconds", "share", "rows", "bytes"]], hide_index=True,
+                     column_config={"seconds": st.column_config.NumberColumn(format="%.4f"),
+                                    "share": st.column_config.NumberColumn(format="percent")})
+
+        profile_log = profiling.log_frame()
+        col1, col2 = st.columns(2)
+        col1.download_button("Log (JSON)", profile_log.to_json(orient="records"), file_name="profile_log.json",
+                             mime="application/json")
+        col2.download_button("Log (CSV)", profile_log.to_csv(index=False), file_name="profile_log.csv", mime="text/csv")
@@ -0,0 +1,193 @@
+"""Load test the aggregate API (api.py): requests per second and latency with a cold and a warm response cache.
+
+Run from the project root:
+    python benchmarks/bench_api.py --rows 1000000 --clients 8 --duration 10
+    python benchmarks/bench_api.py --url http://127.0.0.1:8502 --clients 8
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+import numpy as np
+import pandas as pd
+import streamlit.config
+import streamlit.logger
+
+# the synthetic dataset is written with functions.py, whose cached functions log "No runtime found" on import
+streamlit.config.get_option("logger.level")
+streamlit.logger.set_log_level("error")
+
+from bench_pipeline import DEFAULT_DATA_DIR, dataset_path  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# endpoints and the parameters a client picks from at random, as a dashboard session would ask for them
+QUERIES = [
+    ("/metrics", {}),
+    ("/daily_totals", {"freq": ["D", "W", "ME"]}),
+    ("/weekday", {}),
+    ("/category_stacks", {"segment": ["payment_method", "account_type", "transaction_type"]}),
+    ("/histogram", {"log_scale": ["0", "1"]}),
+    ("/heatmap", {"rows": ["merchant", "category"], "columns": ["month", "week"]}),
+    ("/benford_ranking", {"group": ["merchant", "category", "account_type"]}),
+]
+
+# Starts api.py on a free port and returns the process and its base url once the dataset is loaded
+    # data = path to the csv (string)
+    # cache_ttl = seconds a response stays cached (float)
+def start_server(data, cache_ttl):
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, "api.py"), "--data", data, "--port", "0", "--cache-ttl", str(cache_ttl)],
+        stdout=subprocess.PIPE, text=True, cwd=ROOT
+    )
+    for line in process.stdout:
+        print(f"  api: {line.rstrip()}")
+        if line.startswith("serving on "):
+            return process, line.split()[-1]
+    raise RuntimeError("api.py exited before serving")
+
+# Returns the body of a GET request as parsed JSON
+    # base_url = url of the api (string)
+    # path = endpoint path with its query string (string)
+def get_json(base_url, path):
+    url = urlsplit(base_url)
+    connection = http.client.HTTPConnection(url.hostname, url.port)
+    try:
+        connection.request("GET", path)
+        return json.loads(connection.getresponse().read())
+    finally:
+        connection.close()
+
+# Returns request paths with random filters and parameters, each filter spec drawn from a pool of distinct specs
+    # dimension_values = output of the /dimension_values endpoint (dict)
+    # days = every day with transactions (pd.DatetimeIndex)
+    # n_requests = number of paths (int)
+    # n_specs = number of distinct filter specs, None makes every spec distinct (int)
+    # seed = random seed (int)
+def make_paths(dimension_values, days, n_requests, n_specs, seed=0):
+    rng = np.random.default_rng(seed)
+
+    def random_spec(i):
+        # distinct specs get distinct date ranges, so none of them can share a cached response
+        start = days[i % (len(days) - 1)]
+        end = days[min(len(days) - 1, (i % (len(days) - 1)) + 30 + i // (len(days) - 1))]
+        spec = [("start", start.strftime("%Y-%m-%d")), ("end", end.strftime("%Y-%m-%d"))]
+        column = rng.choice(["category", "payment_method", "account_type"])
+        values = dimension_values[column]
+        for value in rng.choice(values, size=rng.integers(1, len(values) + 1), replace=False):
+            spec.append((column, value))
+        return spec
+
+    pool = [random_spec(i) for i in range(n_specs or n_requests)]
+    paths = []
+    for i in range(n_requests):
+        endpoint, choices = QUERIES[rng.integers(len(QUERIES))]
+        params = [(name, rng.choice(values)) for name, values in choices.items()]
+        spec = pool[i % len(pool)] if n_specs else pool[i]
+        paths.append(f"{endpoint}?{urlencode(spec + params)}")
+    return paths
+
+# Sends the paths from a number of client threads, each over its own keep-alive connection
+    # base_url = url of the api (string)
+    # paths = request paths, split between the clients (list)
+    # clients = number of concurrent clients (int)
+    # duration = seconds each client keeps sending, cycling through its paths (float)
+    # returns the latency of every request in seconds and the number of cache hits
+def run_clients(base_url, paths, clients, duration):
+    url = urlsplit(base_url)
+    latencies, hits, errors = [], [], []
+    lock = threading.Lock()
+
+    def client(own_paths):
+        connection = http.client.HTTPConnection(url.hostname, url.port)
+        own_latencies, own_hits, i = [], 0, 0
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            connection.request("GET", own_paths[i % len(own_paths)])
+            response = connection.getresponse()
+            response.read()
+            own_latencies.append(time.perf_counter() - started)
+            if response.status != 200:
+                errors.append(response.status)
+            own_hits += response.getheader("X-Cache") == "hit"
+            i += 1
+        connection.close()
+        with lock:
+            latencies.extend(own_latencies)
+            hits.append(own_hits)
+
+    threads = [threading.Thread(target=client, args=(paths[i::clients],)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise RuntimeError(f"{len(errors)} requests failed, statuses {sorted(set(errors))}")
+
+    return np.array(latencies), sum(hits)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1_000_000, help="rows of the synthetic dataset")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="where the synthetic csv files are kept")
+    parser.add_argument("--url", help="load test a running api instead of starting one")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of each phase")
+    parser.add_argument("--specs", type=int, default=50, help="distinct filter specs of the warm phase")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    process = None
+    base_url = args.url
+    if base_url is None:
+        process, base_url = start_server(dataset_path(args.data_dir, args.rows, args.seed), cache_ttl=3600)
+
+    try:
+        dimension_values = get_json(base_url, "/dimension_values")
+        daily = get_json(base_url, "/daily_totals")
+        days = pd.DatetimeIndex(daily["columns"]["Date"])
+
+        # cold: every request has a filter spec of its own, so every response is computed;
+        # warm: requests cycle through a few specs, after one pass over them every response comes from the cache
+        cold_paths = make_paths(dimension_values, days, 100_000, None, seed=args.seed)
+        warm_paths = make_paths(dimension_values, days, 100_000, args.specs, seed=args.seed + 1)
+
+        results = []
+        print(f"{'phase':<6} {'requests':>9} {'req/s':>9} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} {'hit rate':>9}")
+        for phase, paths in [("cold", cold_paths), ("warm", warm_paths)]:
+            if phase == "warm":
+                for path in sorted(set(paths)):
+                    get_json(base_url, path)
+            started = time.perf_counter()
+            latencies, hits = run_clients(base_url, paths, args.clients, args.duration)
+            elapsed = time.perf_counter() - started
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+            result = {"phase": phase, "requests": len(latencies), "requests_per_second": len(latencies) / elapsed,
+                      "p50_ms": p50, "p95_ms": p95, "p99_ms": p99, "hit_rate": hits / len(latencies)}
+            results.append(result)
+            print(f"{phase:<6} {result['requests']:>9,} {result['requests_per_second']:>9.1f} {p50:>9.2f} "
+                  f"{p95:>9.2f} {p99:>9.2f} {result['hit_rate']:>9.1%}")
+
+        stats = get_json(base_url, "/stats")
+        print(f"cache: {stats['entries']:,} entries, {stats['bytes'] / 1e6:.1f} MB, {stats['evictions']:,} evictions")
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"clients": args.clients, "duration": args.duration, "rows": args.rows,
+                       "results": results, "cache": stats}, f, indent=2)
+        print(f"results written to {args.output}")
+
+if __name__ == "__main__":
+    main()
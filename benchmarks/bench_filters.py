@@ -0,0 +1,86 @@
+"""Benchmark the single-pass filter engine against the chained filter_* functions.
+
+Run from the project root:
+    python benchmarks/bench_filters.py --rows 1000000 10000000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import functions as fx  # noqa: E402
+
+# Returns a synthetic transactions frame with the same column dtypes as read_and_clean_data
+    # n_rows = number of rows to generate (int)
+    # seed = random seed (int)
+def make_frame(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    cardinalities = {"category": 10, "merchant": 32, "payment_method": 5,
+                     "account_type": 3, "transaction_type": 4}
+
+    df = pd.DataFrame({
+        "Date": pd.Timestamp("2020-01-01") + pd.to_timedelta(rng.integers(0, 5 * 365, n_rows), unit="D"),
+        "amount_cents": np.round(rng.lognormal(4.5, 1.3, n_rows) * 100).astype(np.int32),
+    })
+    for col, n in cardinalities.items():
+        labels = [f"{col}_{i}" for i in range(n)]
+        df[col] = pd.Categorical.from_codes(rng.integers(0, n, n_rows).astype(np.int8), labels)
+
+    return df
+
+# Returns the filter spec selecting everything (the dashboard default) and a narrowed spec
+    # df = synthetic frame (panda DataFrame)
+def make_specs(df):
+    everything = fx.make_filter_spec(
+        (df["Date"].min().date(), df["Date"].max().date()),
+        *[list(df[col].cat.categories) for col in fx.DIMENSION_COLUMNS]
+    )
+
+    narrowed = dict(everything)
+    narrowed["date_range"] = (pd.Timestamp("2022-01-01").date(), pd.Timestamp("2022-12-31").date())
+    narrowed["category"] = list(df["category"].cat.categories[:5])
+    narrowed["payment_method"] = list(df["payment_method"].cat.categories[:3])
+
+    return {"all selected": everything, "narrowed": narrowed}
+
+# Runs the six chained filter functions the way app.py used to
+def run_chain(df, spec):
+    out = fx.filter_dates(df, spec["date_range"])
+    out = fx.filter_category(out, spec["category"])
+    out = fx.filter_merchant(out, spec["merchant"])
+    out = fx.filter_payment(out, spec["payment_method"])
+    out = fx.filter_account(out, spec["account_type"])
+    out = fx.filter_transaction(out, spec["transaction_type"])
+    return out
+
+# Returns the best wall time in seconds over a number of repeats
+def best_time(func, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000_000, 10_000_000])
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>12} {'scenario':>14} {'chain (s)':>10} {'engine (s)':>11} {'speed-up':>9}")
+    for n_rows in args.rows:
+        df = make_frame(n_rows)
+        for name, spec in make_specs(df).items():
+            assert len(run_chain(df, spec)) == len(fx.filter_data(df, spec))
+            chain = best_time(lambda: run_chain(df, spec), args.repeats)
+            engine = best_time(lambda: fx.filter_data(df, spec), args.repeats)
+            print(f"{n_rows:>12,} {name:>14} {chain:>10.4f} {engine:>11.4f} {chain / engine:>8.1f}x")
+
+if __name__ == "__main__":
+    main()
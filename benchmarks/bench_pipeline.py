@@ -0,0 +1,204 @@
+"""Benchmark every stage of the dashboard pipeline on synthetic transactions, with peak memory, to JSON.
+
+Run from the project root:
+    python benchmarks/bench_pipeline.py --rows 1000 100000 1000000 10000000 --output bench.json
+    python benchmarks/bench_pipeline.py --rows 1000 100000 --compare bench.json
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from importlib import metadata
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benford  # noqa: E402
+import functions as fx  # noqa: E402
+from synthetic_transactions import write_transactions  # noqa: E402
+
+# stages run outside of a streamlit server, where every cached call logs a "No runtime found" warning
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), "dashboard-bench")
+PACKAGES = ["pandas", "numpy", "pyarrow", "plotly", "streamlit"]
+
+# a stage slower than its baseline by more than this fraction, and by more than timer noise, is a regression
+DEFAULT_TOLERANCE = 0.10
+NOISE_SECONDS = 0.002
+
+# Returns the path of the synthetic csv with the given number of rows, generating it on first use
+    # data_dir = folder holding the generated files (string)
+    # n_rows = number of rows (int)
+    # seed = random seed of the generator (int)
+def dataset_path(data_dir, n_rows, seed=0):
+    path = os.path.join(data_dir, f"transactions_{n_rows}_{seed}.csv")
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        write_transactions(path, n_rows, seed=seed)
+    return path
+
+# Reads the dataset through read_and_clean_data without the streamlit cache
+    # path = path to the csv (string)
+    # use_cache = read from the columnar cache instead of parsing the csv (bool)
+def read_data(path, use_cache):
+    fx.read_and_clean_data.clear()
+    return fx.read_and_clean_data(path, use_cache=use_cache)
+
+# Returns the inputs shared by the stages: the transactions, their cube, a narrowed filter spec and chart columns
+    # path = path to the csv (string)
+def prepare(path):
+    # the first read writes the columnar cache used by the "cached" stage
+    shutil.rmtree(os.path.join(os.path.dirname(path), fx.CACHE_DIR_NAME), ignore_errors=True)
+    df = read_data(path, use_cache=True)
+    cube = fx.build_cube(df)
+
+    dates = df["Date"]
+    first, last = dates.min(), dates.max()
+    spec = fx.make_filter_spec(
+        (first.date(), (first + (last - first) / 2).date()),
+        *[list(df[col].cat.categories[: max(1, len(df[col].cat.categories) // 2)]) for col in fx.DIMENSION_COLUMNS]
+    )
+
+    amounts = df["amount_cents"].to_numpy() / 100
+    return {
+        "path": path,
+        "df": df,
+        "cube": cube,
+        "spec": spec,
+        "amounts": amounts,
+        "daily": pd.DataFrame({"Date": dates, "amount": amounts}),
+        "by_merchant": pd.DataFrame({"merchant": df["merchant"], "amount": amounts}),
+        "ordinals": fx.date_ordinals(dates),
+    }
+
+# name of every stage and the call it times, on the inputs from prepare
+STAGES = {
+    "read_and_clean_data (parse csv)": lambda c: read_data(c["path"], use_cache=False),
+    "read_and_clean_data (cached)": lambda c: read_data(c["path"], use_cache=True),
+    "filter_dates": lambda c: fx.filter_dates(c["df"], c["spec"]["date_range"]),
+    "filter_category": lambda c: fx.filter_category(c["df"], c["spec"]["category"]),
+    "filter_merchant": lambda c: fx.filter_merchant(c["df"], c["spec"]["merchant"]),
+    "filter_payment": lambda c: fx.filter_payment(c["df"], c["spec"]["payment_method"]),
+    "filter_account": lambda c: fx.filter_account(c["df"], c["spec"]["account_type"]),
+    "filter_transaction": lambda c: fx.filter_transaction(c["df"], c["spec"]["transaction_type"]),
+    "filter_data": lambda c: fx.filter_data(c["df"], c["spec"]),
+    "build_cube": lambda c: fx.build_cube(c["df"]),
+    "line_with_mean": lambda c: fx.line_with_mean(c["daily"], "Date", "amount", "W"),
+    "stacked_bar_chart": lambda c: fx.stacked_bar_chart(c["cube"], "category", "amount", "payment_method"),
+    "scatterplot_with_line": lambda c: fx.scatterplot_with_line(c["ordinals"], c["amounts"], c["df"]["category"]),
+    "heatmap_matrices (merchant x month)": lambda c: fx.heatmap_matrices(c["cube"]),
+    "heatmap_matrices (category x week)": lambda c: fx.heatmap_matrices(c["cube"], "category", "week"),
+    "benford first digit": lambda c: benford.digit_counts(benford.first_digit(c["amounts"])),
+    "benford_by_group (merchant)": lambda c: benford.benford_by_group(c["by_merchant"], "merchant"),
+}
+
+# Returns the best wall time in seconds over a number of repeats, and the peak traced memory of one more run
+    # func = stage to run (callable)
+    # repeats = number of timed runs (int)
+    # memory is measured in a separate run because tracing allocations slows the stage down, it covers numpy and
+    # pandas allocations but not arrow buffers or memory-mapped pages (a cached read shows close to 0)
+def measure(func, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return min(times), peak
+
+# Returns the version of the code and libraries a run was made with, to tell results apart
+def run_metadata(repeats):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+
+    return {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "packages": {name: metadata.version(name) for name in PACKAGES},
+        "repeats": repeats,
+    }
+
+# Returns one row per stage found in both runs with the time and memory ratios, slowest ratio first
+    # results = results of this run (list of dicts)
+    # baseline = results of the run to compare with (list of dicts)
+    # tolerance = slowdown fraction above which a stage is a regression (float)
+def compare_results(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    before = {(row["rows"], row["stage"]): row for row in baseline}
+    rows = []
+    for row in results:
+        old = before.get((row["rows"], row["stage"]))
+        if old is None:
+            continue
+        time_ratio = row["seconds"] / old["seconds"] if old["seconds"] else np.nan
+        memory_ratio = row["peak_bytes"] / old["peak_bytes"] if old["peak_bytes"] else np.nan
+        rows.append({"rows": row["rows"], "stage": row["stage"], "time_ratio": time_ratio,
+                     "memory_ratio": memory_ratio,
+                     "regression": bool(time_ratio > 1 + tolerance and row["seconds"] - old["seconds"] > NOISE_SECONDS)})
+
+    return sorted(rows, key=lambda row: -np.nan_to_num(row["time_ratio"]))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 100_000, 1_000_000, 10_000_000])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES), metavar="STAGE")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="where the synthetic csv files are kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'rows':>12} {'stage':<32} {'time (s)':>10} {'peak (MB)':>10}")
+    for n_rows in args.rows:
+        context = prepare(dataset_path(args.data_dir, n_rows, args.seed))
+        for stage in args.stages:
+            seconds, peak = measure(lambda: STAGES[stage](context), args.repeats)
+            results.append({"rows": n_rows, "stage": stage, "seconds": seconds, "peak_bytes": peak})
+            print(f"{n_rows:>12,} {stage:<32} {seconds:>10.4f} {peak / 1e6:>10.1f}")
+        del context
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"metadata": run_metadata(args.repeats), "results": results}, f, indent=2)
+        print(f"results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        comparison = compare_results(results, baseline["results"], args.tolerance)
+        print(f"\ncompared with {args.compare} ({baseline['metadata'].get('git_commit')})")
+        print(f"{'rows':>12} {'stage':<32} {'time':>8} {'memory':>8}")
+        for row in comparison:
+            flag = "  REGRESSION" if row["regression"] else ""
+            print(f"{row['rows']:>12,} {row['stage']:<32} {row['time_ratio']:>7.2f}x {row['memory_ratio']:>7.2f}x{flag}")
+        if any(row["regression"] for row in comparison):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
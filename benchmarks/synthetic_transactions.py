@@ -0,0 +1,132 @@
+"""Generate a synthetic transactions csv with the schema and distributions of financial_transactions.csv.
+
+Run from the project root:
+    python benchmarks/synthetic_transactions.py --rows 10000000 --output /tmp/transactions_10m.csv
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import functions as fx  # noqa: E402
+
+SAMPLE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "financial_transactions.csv")
+
+# rows generated and written per chunk, so 10M+ row files are written in bounded memory
+GENERATE_CHUNK_ROWS = 1_000_000
+
+# spread of the multiplicative noise added to resampled amounts, so amounts are not limited to the sample values
+AMOUNT_JITTER = 0.05
+
+# number of distinct free-text descriptions drawn from the words of the sample descriptions
+DESCRIPTION_POOL = 100_000
+
+# Returns the sample rows and vocabulary the synthetic rows are drawn from
+    # sample_path = path to the sample csv (string)
+    # the joint distribution of category, merchant, payment method, account type, transaction type and amount
+    # is kept by resampling whole rows, recurring rows (R- rent, S- subscriptions) keep their share and ids
+def fit_profile(sample_path=SAMPLE_PATH):
+    sample = pd.read_csv(sample_path)
+    dates = pd.to_datetime(sample["date"], format=fx.DATE_FORMAT)
+
+    prefix = sample["transaction_id"].str.split("-").str[0]
+    free_text = sample.loc[prefix == "T", "description"]
+    words = np.unique(np.concatenate(free_text.str.rstrip(".").str.lower().str.split().to_list()))
+    lengths = free_text.str.split().str.len().to_numpy()
+
+    return {
+        "rows": sample.drop(columns=["transaction_id", "date"]).reset_index(drop=True),
+        "prefix": prefix.to_numpy(),
+        "first_day": dates.min().normalize(),
+        "time_of_day": dates.min() - dates.min().normalize(),
+        "days": (dates.max() - dates.min()).days + 1,
+        "words": words,
+        "description_lengths": lengths,
+    }
+
+# Returns a pool of random sentences built from the sample vocabulary, with the sample's sentence lengths
+    # profile = output of fit_profile (dict)
+    # size = number of sentences (int)
+    # rng = random generator (np.random.Generator)
+def description_pool(profile, size, rng):
+    lengths = rng.choice(profile["description_lengths"], size)
+    words = profile["words"][rng.integers(0, len(profile["words"]), lengths.sum())]
+    sentences = np.split(words, np.cumsum(lengths)[:-1])
+    return np.array([" ".join(sentence).capitalize() + "." for sentence in sentences], dtype=object)
+
+# Returns one chunk of synthetic rows in the schema of the source csv
+    # profile = output of fit_profile (dict)
+    # n_rows = number of rows (int)
+    # first_row = number of rows generated before this chunk, keeps transaction ids unique (int)
+    # rng = random generator (np.random.Generator)
+    # days = number of days the dates are spread over (int)
+    # descriptions = output of description_pool (numpy array)
+def generate_chunk(profile, n_rows, first_row, rng, days, descriptions):
+    picked = rng.integers(0, len(profile["rows"]), n_rows)
+    df = profile["rows"].iloc[picked].reset_index(drop=True)
+    prefix = profile["prefix"][picked]
+
+    # ids are unique across chunks: T-<row> for one-off payments, R-<row> and S-<merchant>-<row> for recurring ones
+    row_numbers = np.arange(first_row + 1, first_row + n_rows + 1).astype(str)
+    ids = np.char.add(np.char.add(prefix.astype(str), "-"), row_numbers).astype(object)
+    subscription = prefix == "S"
+    ids[subscription] = ("S-" + df.loc[subscription, "merchant"] + "-" + row_numbers[subscription]).to_numpy()
+
+    # one string per day, all at the sample's time of day
+    day_strings = (profile["first_day"] + profile["time_of_day"] + pd.to_timedelta(np.arange(days), unit="D"))
+    day_strings = np.asarray(day_strings.strftime(fx.EXPORT_DATE_FORMAT), dtype=object)
+
+    amounts = df["amount"].to_numpy() * rng.lognormal(0, AMOUNT_JITTER, n_rows)
+    free_text = prefix == "T"
+    description = df["description"].to_numpy(dtype=object).copy()
+    description[free_text] = descriptions[rng.integers(0, len(descriptions), free_text.sum())]
+
+    return pd.DataFrame({
+        "transaction_id": ids,
+        "date": day_strings[rng.integers(0, days, n_rows)],
+        "amount": np.round(amounts, 2),
+        "category": df["category"],
+        "merchant": df["merchant"],
+        "payment_method": df["payment_method"],
+        "account_type": df["account_type"],
+        "transaction_type": df["transaction_type"],
+        "description": description,
+    })
+
+# Writes a synthetic transactions csv, one chunk at a time
+    # path = output csv path (string)
+    # n_rows = number of rows (int)
+    # seed = random seed, the same seed and row count always give the same file (int)
+    # days = number of days the dates are spread over, the sample's span by default (int)
+    # sample_path = path to the sample csv the distributions are taken from (string)
+def write_transactions(path, n_rows, seed=0, days=None, sample_path=SAMPLE_PATH):
+    profile = fit_profile(sample_path)
+    rng = np.random.default_rng(seed)
+    days = days or profile["days"]
+    descriptions = description_pool(profile, min(DESCRIPTION_POOL, max(n_rows, 1)), rng)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", newline="") as f:
+        for first_row in range(0, max(n_rows, 1), GENERATE_CHUNK_ROWS):
+            chunk_rows = min(GENERATE_CHUNK_ROWS, n_rows - first_row)
+            chunk = generate_chunk(profile, chunk_rows, first_row, rng, days, descriptions)
+            chunk.to_csv(f, index=False, header=first_row == 0, float_format="%.2f")
+    os.replace(tmp_path, path)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, required=True)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--days", type=int, default=None, help="days the dates are spread over (default: the sample's)")
+    args = parser.parse_args()
+
+    write_transactions(args.output, args.rows, seed=args.seed, days=args.days)
+    print(f"wrote {args.rows:,} rows to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import numpy as np
+import pandas as pd
+
+## DIGIT EXTRACTION FUNCTIONS ##
+
+# expected Benford proportions for the first digit (1-9) and the first two digits (10-99)
+FIRST_DIGITS = np.arange(1, 10)
+FIRST_TWO_DIGITS = np.arange(10, 100)
+EXPECTED_FIRST = np.log10(1 + 1 / FIRST_DIGITS)
+EXPECTED_FIRST_TWO = np.log10(1 + 1 / FIRST_TWO_DIGITS)
+
+# Nigrini's mean absolute deviation thresholds: (upper bound, conformity label)
+MAD_THRESHOLDS = {
+    "first": [(0.006, "Close"), (0.012, "Acceptable"), (0.015, "Marginal")],
+    "first_two": [(0.0012, "Close"), (0.0018, "Acceptable"), (0.0022, "Marginal")],
+}
+
+# guards against values like 0.3 / 0.1 = 2.9999999999999996 (amounts are in cents, far above this)
+_DIGIT_TOLERANCE = 1e-9
+
+# Returns the mantissa of each value scaled into [1, 10), NaN for zero, negative or missing values
+    # values = amounts (numpy array or panda Series)
+def _mantissa(values):
+    values = np.asarray(values, dtype="float64")
+    mantissa = np.full(values.shape, np.nan)
+
+    positive = values > 0
+    exponent = np.floor(np.log10(values[positive]))
+    scaled = values[positive] / 10.0 ** exponent
+
+    # correct the rare off-by-one exponent from log10 rounding
+    scaled = np.where(scaled >= 10, scaled / 10, scaled)
+    scaled = np.where(scaled < 1, scaled * 10, scaled)
+
+    mantissa[positive] = scaled + _DIGIT_TOLERANCE
+    return mantissa
+
+# Returns the first significant digit (1-9) of each value, 0 for zero, negative or missing values
+    # values = amounts (numpy array or panda Series)
+def first_digit(values):
+    mantissa = _mantissa(values)
+    return np.where(np.isnan(mantissa), 0, np.floor(mantissa)).astype("int8")
+
+# Returns the first two significant digits (10-99) of each value, 0 for zero, negative or missing values
+    # values = amounts (numpy array or panda Series)
+def first_two_digits(values):
+    mantissa = _mantissa(values)
+    return np.where(np.isnan(mantissa), 0, np.floor(mantissa * 10)).astype("int8")
+
+## GOODNESS-OF-FIT FUNCTIONS ##
+
+# Returns the digit counts per group as a (groups x digits) matrix in a single bincount
+    # digits = output of first_digit or first_two_digits (numpy array)
+    # group_codes = integer group of each value, or None for a single group (numpy array)
+    # n_groups = number of groups (int)
+    # test = "first" or "first_two" (string)
+    # values with digit 0 or group code -1 are ignored
+def digit_counts(digits, group_codes=None, n_groups=1, test="first"):
+    possible = FIRST_DIGITS if test == "first" else FIRST_TWO_DIGITS
+    digits = np.asarray(digits)
+
+    if group_codes is None:
+        group_codes = np.zeros(len(digits), dtype="int64")
+    group_codes = np.asarray(group_codes, dtype="int64")
+
+    keep = (digits > 0) & (group_codes >= 0)
+    flat = group_codes[keep] * len(possible) + (digits[keep].astype("int64") - possible[0])
+    counts = np.bincount(flat, minlength=n_groups * len(possible))
+
+    return counts.reshape(n_groups, len(possible))
+
+# Returns chi-square, MAD and KS statistics for each row of a digit count matrix
+    # counts = output of digit_counts (numpy array)
+    # test = "first" or "first_two" (string)
+    # returns a panda DataFrame with columns n, chi_square, mad, ks and conformity
+def goodness_of_fit(counts, test="first"):
+    expected = EXPECTED_FIRST if test == "first" else EXPECTED_FIRST_TWO
+    counts = np.asarray(counts, dtype="float64")
+
+    n = counts.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        observed = counts / n[:, None]
+
+    expected_counts = n[:, None] * expected
+    with np.errstate(invalid="ignore", divide="ignore"):
+        chi_square = ((counts - expected_counts) ** 2 / expected_counts).sum(axis=1)
+    mad = np.abs(observed - expected).mean(axis=1)
+    ks = np.abs(np.cumsum(observed, axis=1) - np.cumsum(expected)).max(axis=1)
+
+    conformity = np.full(len(n), "Nonconformity", dtype=object)
+    for upper, label in reversed(MAD_THRESHOLDS[test]):
+        conformity[mad <= upper] = label
+    conformity[n == 0] = "No data"
+
+    return pd.DataFrame({
+        "n": n.astype("int64"),
+        "chi_square": np.where(n > 0, chi_square, np.nan),
+        "mad": mad,
+        "ks": ks,
+        "conformity": conformity,
+    })
+
+# Returns Benford statistics for every value of a grouping column, ranked by deviation (MAD)
+    # df = transactions (panda DataFrame)
+    # group_col = column to group by, e.g. "merchant" (string)
+    # value_col = column holding the amounts (string)
+    # test = "first" or "first_two" (string)
+    # min_count = groups with fewer positive amounts than this are dropped (int)
+def benford_by_group(df, group_col, value_col="amount", test="first", min_count=1):
+    groups = df[group_col]
+    if not isinstance(groups.dtype, pd.CategoricalDtype):
+        groups = groups.astype("category")
+
+    extract = first_digit if test == "first" else first_two_digits
+    digits = extract(df[value_col].to_numpy())
+
+    counts = digit_counts(
+        digits,
+        group_codes=groups.cat.codes.to_numpy(),
+        n_groups=len(groups.cat.categories),
+        test=test
+    )
+
+    return rank_groups(groups.cat.categories, counts, group_col, test=test, min_count=min_count)
+
+# Returns Benford statistics for pre-computed digit counts per group, ranked by deviation (MAD)
+    # labels = group values, one per row of counts (list)
+    # counts = output of digit_counts, or the same matrix computed elsewhere, e.g. in SQL (numpy array)
+    # group_col = name of the group column in the result (string)
+    # test, min_count = see benford_by_group
+def rank_groups(labels, counts, group_col, test="first", min_count=1):
+    stats = goodness_of_fit(counts, test=test)
+    stats.insert(0, group_col, list(labels))
+
+    return (
+        stats[stats["n"] >= max(min_count, 1)]
+        .sort_values("mad", ascending=False, kind="stable")
+        .reset_index(drop=True)
+    )
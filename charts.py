@@ -0,0 +1,260 @@
+import pandas as pd
+
+import functions as fx
+
+## DASHBOARD CHART FUNCTIONS ##
+
+# the dashboard's figures with their titles, axis labels and hover labels, built from data any backend can
+# provide, so app.py and the headless report (report.py) draw the same charts
+
+HOVER_LABEL = dict(bgcolor='#061e49', font_size=12, font_color='white')
+
+FREQUENCIES = {"Daily": "D", "Weekly": "W", "Monthly": "ME"}
+
+SEGMENTS = {"Payment Method": "payment_method",
+            "Account Type": "account_type",
+            "Transaction Type": "transaction_type"}
+
+SCATTER_COLORS = {"Category": "category",
+                  "Merchant": "merchant",
+                  "Payment Method": "payment_method",
+                  "Account Type": "account_type",
+                  "Transaction Type": "transaction_type"}
+
+HEATMAP_AXES = {"Merchant": "merchant", "Category": "category", "Payment Method": "payment_method",
+                "Account Type": "account_type", "Transaction Type": "transaction_type"}
+HEATMAP_BUCKETS = {"Month": "month", "Week": "week", **HEATMAP_AXES}
+
+BENFORD_GROUPS = {"Merchant": "merchant",
+                  "Category": "category",
+                  "Account Type": "account_type"}
+
+# expected first digit percentages, taken from: https://mathworld.wolfram.com/BenfordsLaw.html
+BENFORD_PERCENTAGES = [30.103, 17.6091, 12.4939, 9.691, 7.91812, 6.69468, 5.79919, 5.11525, 4.57575]
+
+# Returns the line chart of the total amount over time with its mean
+    # daily_totals = daily totals from fx.range_daily_totals (panda DataFrame)
+    # frequency = "Daily", "Weekly" or "Monthly" (string)
+def overall_figure(daily_totals, frequency="Daily"):
+    overall_fig = fx.line_with_mean(df=daily_totals, x="Date", y="amount", freq=FREQUENCIES[frequency])
+
+    overall_fig.update_traces(
+        line=dict(color='lightblue'),
+        hovertemplate=
+            '%{x}<br>' +
+            'Total Amount: $%{y:,.2f}',
+        hoverlabel=HOVER_LABEL
+    )
+
+    overall_fig.update_layout(
+        xaxis_title="Date",
+        yaxis_title="Total Amount ($)",
+    )
+
+    return overall_fig
+
+# Returns the bar + line chart of the average amount and number of transactions by day of the week
+    # cube = filtered cube (panda DataFrame)
+def weekday_figure(cube):
+    weekday_df = fx.weekday_summary(cube)
+
+    daily_fig = fx.bar_line_chart(x1=weekday_df["Day"],
+                                  y1=weekday_df["mean_amount"].round(2),
+                                  name1="Average Transaction Amount",
+                                  x2=weekday_df["Day"],
+                                  y2=weekday_df["count"],
+                                  name2="Number of Transactions")
+
+    daily_fig.update_layout(
+        title="By Day of the Week",
+        xaxis_title="Day of the Week",
+        yaxis_title="Average Amount ($) / Number of Transactions",
+        showlegend=False,
+        hovermode="x",
+    )
+
+    daily_fig.update_traces(
+        selector=dict(type='bar'),
+        text=weekday_df["mean_amount"].round(2),
+        textposition='auto',
+        hovertemplate='Average Amount: $%{y:.2f}<extra></extra>',
+        hoverlabel=HOVER_LABEL
+    )
+
+    daily_fig.update_traces(
+        selector=dict(type='scatter'),
+        hovertemplate='Number of Transactions: %{y}<extra></extra>',
+        hoverlabel=dict(
+            bgcolor='#E54E04',
+            font_size=12,
+            font_color='white'
+        )
+    )
+
+    return daily_fig
+
+# Returns the stacked bar chart of spending for the top categories
+    # cube = filtered cube (panda DataFrame)
+    # segment = key of SEGMENTS the bars are split by (string)
+def stacked_bar_figure(cube, segment="Payment Method"):
+    stacked_bar_fig = fx.stacked_bar_chart(df=cube, x="category", y="amount", color=SEGMENTS[segment])
+
+    stacked_bar_fig.update_layout(
+        title="Spending for the Top 5 Categories (by Total Transaction Amount), Grouped By " + segment,
+        legend_title_text=segment,
+        barmode="stack",
+        xaxis_title="Total Amount ($)",
+        yaxis_title="Category"
+    )
+
+    stacked_bar_fig.update_traces(
+        hovertemplate='Spent $%{x:,.2f} in %{y} using %{fullData.name}<extra></extra>',
+        hoverlabel=HOVER_LABEL
+    )
+
+    return stacked_bar_fig
+
+# Returns the histogram of transaction amounts
+    # binned = bins from fx.histogram_bins (tuple)
+    # log_scale = the bins are log-spaced (bool)
+def histogram_figure(binned, log_scale=False):
+    histo_fig = fx.histogram(df=None, x="amount", log_scale=log_scale, binned=binned)
+
+    histo_fig.update_traces(
+        textposition="outside",
+        marker=dict(
+            color="lightblue",
+            line=dict(width=1, color="black")
+        ),
+        textfont=dict(size=12, color="black"),
+        cliponaxis=False,
+        hovertemplate=
+            'Amount Range: $%{customdata[0]:,.2f} to $%{customdata[1]:,.2f}<br>' +
+            'Frequency: %{y}<extra></extra>',
+        hoverlabel=HOVER_LABEL
+    )
+
+    histo_fig.update_layout(
+        title="Distribution of Transaction Amounts",
+        xaxis_title="Total Amount ($)",
+        yaxis_title="Frequency"
+    )
+
+    return histo_fig
+
+# Styles a figure from fx.scatterplot_with_line: readable dates, one tick per month start, and titles
+    # scatter_fig = figure from fx.scatterplot_with_line (go.Figure)
+    # first_date, last_date = first and last date plotted, NaT without any point (pd.Timestamp)
+    # color_label = key of SCATTER_COLORS the points are coloured by (string)
+def style_scatter(scatter_fig, first_date, last_date, color_label="Category"):
+    if pd.notna(first_date) and pd.notna(last_date):
+        monthly_ticks = pd.date_range(first_date.normalize(), last_date, freq="MS")
+        scatter_fig.update_xaxes(
+            tickvals=fx.date_ordinals(monthly_ticks.to_series()),
+            ticktext=monthly_ticks.strftime("%b %Y")
+        )
+    scatter_fig.update_xaxes(title_text="Date")
+    scatter_fig.update_yaxes(title_text="Total Amount ($)")
+    scatter_fig.update_layout(
+        title="Spending Against Time, Coloured by " + color_label,
+        legend_title_text=color_label
+    )
+    scatter_fig.update_traces(
+        hovertemplate="$%{y} (%{fullData.name})<extra></extra>",
+        hoverlabel=HOVER_LABEL
+    )
+
+    return scatter_fig
+
+# Returns one of the two heatmaps, by number of transactions or by total amount
+    # matrix = one of the matrices from fx.heatmap_matrices (panda DataFrame)
+    # row_label = key of HEATMAP_AXES on the rows (string)
+    # col_label = key of HEATMAP_BUCKETS on the columns (string)
+    # value = "count" or "amount" (string)
+def heatmap_figure(matrix, row_label="Merchant", col_label="Month", value="count"):
+    heatmap_fig = fx.heatmap(df=matrix)
+    value_hover = '<b>Number of Transactions:</b> %{z}' if value == "count" else '<b>Total Amount:</b> $%{z}'
+
+    heatmap_fig.update_coloraxes(showscale=False)
+    heatmap_fig.update_traces(
+        hovertemplate=
+            f'<b>{row_label}:</b> %{{y}}<br>' +
+            f'<b>{col_label}{" of" if col_label in ("Month", "Week") else ":"}</b> %{{x}}<br>' +
+            value_hover + '<extra></extra>',
+        hoverlabel=HOVER_LABEL
+    )
+    heatmap_fig.update_layout(
+        yaxis_title=row_label if value == "count" else "",
+        title="By Number of Transactions" if value == "count" else "By Total Transaction Amount"
+    )
+
+    return heatmap_fig
+
+# Returns the overlay bar chart of observed first digits against Benford's Law
+    # observed_values = number of amounts of $1 or more starting with each digit 1 to 9 (list)
+    # neg_count = number of negative amounts (int)
+    # zero_count = number of amounts between 0 and 1 (int)
+    # include_negatives_zeros = show negative and below $1 amounts as the digits -1 and 0 (bool)
+def benford_figure(observed_values, neg_count, zero_count, include_negatives_zeros=False):
+    digits_without = [str(digit) for digit in range(1, 10)]
+
+    if include_negatives_zeros:
+        digits = ["-1", "0"] + digits_without
+        benford_values = [0, 0] + BENFORD_PERCENTAGES
+    else:
+        digits = digits_without
+        benford_values = BENFORD_PERCENTAGES
+        neg_count, zero_count = 0, 0
+    # without any amount every percentage is 0
+    total_count = (sum(observed_values) + neg_count + zero_count) or 1
+
+    observed_percentages = [(count / total_count) * 100 for count in observed_values]
+    neg_percent = (neg_count / total_count) * 100
+    zero_percent = (zero_count / total_count) * 100
+    observed_percentages_full = ([neg_percent, zero_percent] + observed_percentages) if include_negatives_zeros else observed_percentages
+
+    benford_values_rounded = [round(val, 2) for val in benford_values]
+    observed_percentages_rounded = [round(val, 2) for val in observed_percentages_full]
+
+    benford_fig = fx.dual_bar_chart(
+        x1=digits,
+        y1=benford_values_rounded,
+        name1="Benford's Law",
+        x2=digits,
+        y2=observed_percentages_rounded,
+        name2="Observed"
+    )
+
+    benford_fig.update_layout(
+        title="Benford's Law vs Observed Data",
+        xaxis_title="First Digit of Transaction Amount",
+        yaxis_title="Percentage (%)",
+        barmode='overlay',
+        showlegend=True,
+        hovermode="x",
+        xaxis=dict(
+            dtick=1
+        )
+    )
+
+    benford_fig.update_traces(
+        selector=dict(type='bar', name='Benford\'s Law'),
+        hovertemplate='%{fullData.name}<extra></extra>: %{y}%',
+        hoverlabel=dict(
+            bgcolor='skyblue',
+            font_color='black',
+            font_size=12
+        )
+    )
+
+    benford_fig.update_traces(
+        selector=dict(type='bar', name='Observed'),
+        hovertemplate='%{fullData.name}<extra></extra>: %{y}%',
+        hoverlabel=dict(
+            bgcolor='#edc001',
+            font_color='black',
+            font_size=12
+        )
+    )
+
+    return benford_fig
@@ -0,0 +1,189 @@
+import numpy as np
+import pandas as pd
+
+# integer cents of a missing amount, left out of every cluster
+MISSING_CENTS = np.iinfo("int64").min
+
+## GROUP AND TIME KEY FUNCTIONS ##
+
+# Returns one integer code per row for the combination of the given columns, and the labels of each column
+    # df = transactions (panda DataFrame)
+    # group_cols = columns the transactions are grouped by, e.g. ["merchant"] (list)
+    # rows with a missing value in any of the columns get -1
+def group_codes(df, group_cols):
+    codes, labels = [], []
+    for col in group_cols:
+        values = df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            col_codes, col_labels = values.cat.codes.to_numpy(), values.cat.categories
+        else:
+            col_codes, col_labels = pd.factorize(values, sort=True)
+        codes.append(np.asarray(col_codes, dtype="int64"))
+        labels.append(pd.Index(col_labels))
+
+    missing = np.zeros(len(df), dtype=bool)
+    for col_codes in codes:
+        missing |= col_codes < 0
+    combined = np.ravel_multi_index([np.where(missing, 0, c) for c in codes], [max(len(l), 1) for l in labels])
+    return np.where(missing, -1, combined), labels
+
+# Returns a DataFrame with one column per group column holding the labels of the given combined codes
+    # codes = combined codes from group_codes (numpy array)
+    # group_cols, labels = the columns and labels group_codes was called with / returned (list)
+def group_labels(codes, group_cols, labels):
+    parts = np.unravel_index(codes, [max(len(l), 1) for l in labels])
+    return pd.DataFrame({col: col_labels[part] for col, col_labels, part in zip(group_cols, labels, parts)})
+
+# Returns the times of the transactions in whole seconds since 1970-01-01
+    # dates = datetime64 column (panda Series or numpy array)
+def epoch_seconds(dates):
+    return np.asarray(dates).astype("datetime64[s]").astype("int64")
+
+# Returns the amounts in integer cents, so equal amounts compare equal
+    # df = transactions with amount_cents, or amount in dollars (panda DataFrame)
+    # missing amounts are MISSING_CENTS, below every amount
+def amount_cents(df):
+    if "amount_cents" in df:
+        cents = df["amount_cents"].to_numpy()
+    else:
+        cents = np.round(df["amount"].to_numpy(dtype="float64") * 100)
+    if cents.dtype.kind == "f":
+        cents = np.where(np.isnan(cents), MISSING_CENTS, cents)
+    return cents.astype("int64")
+
+# Returns the stable order sorting rows by several integer keys, the first key first
+    # keys = integer arrays of the same length (list)
+    # keys whose ranges fit together in an int64 are packed into one, a single argsort being faster than np.lexsort
+def sort_order(keys):
+    if not len(keys[0]):
+        return np.zeros(0, dtype="int64")
+
+    packed, capacity = np.zeros(len(keys[0]), dtype="int64"), 1
+    for key in reversed(keys):
+        low = int(key.min())
+        width = int(key.max()) - low + 1
+        if capacity * width >= 2 ** 62:
+            return np.lexsort(tuple(reversed(keys)))
+        packed += (key.astype("int64") - low) * capacity
+        capacity *= width
+    return np.argsort(packed, kind="stable")
+
+# Returns the run of every sorted row, a run being consecutive rows each linked to the one before it
+    # linked = True where a row belongs to the same run as the row before it (numpy bool array)
+    # returns the run id of every row, numbered from 0
+def run_ids(linked):
+    starts = np.ones(len(linked), dtype=bool)
+    starts[1:] = ~linked[1:]
+    return np.cumsum(starts) - 1
+
+## SPLIT PAYMENT FUNCTIONS ##
+
+# Finds groups of payments to the same group that each stay below an approval limit but cross it together
+# within a time window, e.g. several small payments to one merchant on the same day
+    # df = transactions with Date and amount_cents or amount (panda DataFrame)
+    # group_cols = columns defining a group, e.g. ["merchant"] or ["merchant", "account_type"] (list)
+    # window = longest time between the first and last payment of a window (pd.Timedelta)
+    # limit = approval limit in dollars, each payment is below it and a window's total reaches it (float)
+    # min_payments = fewest payments in a window (int)
+    # rows are sorted once by group and time, each window is found with a binary search and summed with prefix
+    # sums, so the cost is O(n log n) whatever the number of transactions in a group; windows do not overlap,
+    # the earliest ending window reaching the limit is taken first, then the earliest one starting after it
+    # returns a panda DataFrame with one row per window: the group columns, first and last payment, number of
+    # payments, total and largest amount, largest total first
+def split_payments(df, group_cols=("merchant",), window=pd.Timedelta(days=1), limit=1000.0, min_payments=2):
+    group_cols = list(group_cols)
+    groups, labels = group_codes(df, group_cols)
+    times = epoch_seconds(df["Date"])
+    cents = amount_cents(df)
+    window_s = int(pd.Timedelta(window).total_seconds())
+    limit_cents = int(round(limit * 100))
+
+    eligible = np.flatnonzero((groups >= 0) & (cents > 0) & (cents < limit_cents))
+    order = eligible[sort_order([groups[eligible], times[eligible]])]
+    g, t, c = groups[order], times[order], cents[order]
+    if not len(order):
+        return _empty_clusters(group_cols, ["first", "last", "payments", "total", "largest"])
+
+    # group and time in one sorted key: groups are span seconds apart, so a window never reaches the previous group
+    span = int(t.max() - t.min()) + window_s + 1
+    key = g * span + (t - t.min())
+    left = np.searchsorted(key, key - window_s, side="left")
+    right = np.arange(len(key))
+
+    csum = np.concatenate([[0], np.cumsum(c)])
+    flagged = np.flatnonzero(((right - left + 1) >= min_payments) & (csum[right + 1] - csum[left] >= limit_cents))
+    if not len(flagged):
+        return _empty_clusters(group_cols, ["first", "last", "payments", "total", "largest"])
+
+    # window starts never decrease in sorted order, so the next window starting after each one is a binary search
+    # and only the chain of kept windows is walked
+    next_window = np.searchsorted(left[flagged], flagged, side="right").tolist()
+    kept, i = [], 0
+    while i < len(flagged):
+        kept.append(i)
+        i = next_window[i]
+    ends = flagged[kept]
+    starts = left[ends]
+
+    clusters = group_labels(g[ends], group_cols, labels)
+    clusters["first"] = pd.to_datetime(t[starts], unit="s")
+    clusters["last"] = pd.to_datetime(t[ends], unit="s")
+    clusters["payments"] = ends - starts + 1
+    clusters["total"] = (csum[ends + 1] - csum[starts]) / 100
+    bounds = np.column_stack([starts, ends + 1]).ravel()
+    clusters["largest"] = np.maximum.reduceat(np.append(c, 0), bounds)[::2] / 100
+
+    return clusters.sort_values("total", ascending=False, kind="stable").reset_index(drop=True)
+
+## DUPLICATE FUNCTIONS ##
+
+# Finds exact and near duplicates: transactions of the same amount to the same group within a time window
+    # df = transactions with Date and amount_cents or amount (panda DataFrame)
+    # group_cols = columns that must match, e.g. ["merchant"] (list)
+    # window = longest time between two consecutive transactions of a duplicate cluster (pd.Timedelta)
+    # exact_cols = other columns that must also match, with the time, for a cluster to count as exact (list)
+    # rows are sorted once by group, amount and time and neighbours compared, O(n log n) with no pairwise join
+    # returns a panda DataFrame with one row per cluster: the group columns, amount, first and last transaction,
+    # number of transactions and kind ("exact" or "near"), largest cluster first
+def duplicate_transactions(df, group_cols=("merchant",), window=pd.Timedelta(minutes=10), exact_cols=()):
+    group_cols = list(group_cols)
+    groups, labels = group_codes(df, group_cols)
+    times = epoch_seconds(df["Date"])
+    cents = amount_cents(df)
+    window_s = int(pd.Timedelta(window).total_seconds())
+
+    valid = np.flatnonzero((groups >= 0) & (cents != MISSING_CENTS))
+    order = valid[sort_order([groups[valid], cents[valid], times[valid]])]
+    g, c, t = groups[order], cents[order], times[order]
+
+    linked = np.zeros(len(order), dtype=bool)
+    linked[1:] = (g[1:] == g[:-1]) & (c[1:] == c[:-1]) & (t[1:] - t[:-1] <= window_s)
+    # keep the rows of clusters with at least two transactions
+    in_cluster = linked.copy()
+    in_cluster[:-1] |= linked[1:]
+    if not in_cluster.any():
+        return _empty_clusters(group_cols, ["amount", "first", "last", "transactions", "kind"])
+
+    kept = np.flatnonzero(in_cluster)
+    order, g, c, t, linked = order[kept], g[kept], c[kept], t[kept], linked[kept]
+    cluster = run_ids(linked)
+    first = np.flatnonzero(~linked)
+
+    # a link is exact when the time and every exact column also match the previous transaction
+    same = linked & np.concatenate([[False], t[1:] == t[:-1]])
+    for col in exact_cols:
+        col_codes = group_codes(df, [col])[0][order]
+        same[1:] &= col_codes[1:] == col_codes[:-1]
+    inexact_links = np.bincount(cluster, weights=linked & ~same, minlength=len(first))
+
+    clusters = group_labels(g[first], group_cols, labels)
+    clusters["amount"] = c[first] / 100
+    clusters["first"] = pd.to_datetime(t[first], unit="s")
+    clusters["last"] = pd.to_datetime(np.maximum.reduceat(t, first), unit="s")
+    clusters["transactions"] = np.bincount(cluster)
+    clusters["kind"] = np.where(inexact_links == 0, "exact", "near")
+
+    return clusters.sort_values(["transactions", "amount"], ascending=False, kind="stable").reset_index(drop=True)
+
+def _empty_clusters(group_cols, columns):
+    return pd.DataFrame(columns=list(group_cols) + columns)
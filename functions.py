@@ -1,19 +1,523 @@
+import glob
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
 import streamlit as st
 
-# Convert dates in DataFrame into datetime format
-    # expects a panda DataFrame
-    # returns a panda DataFrame with date column converted to datetime format
-@st.cache_data(show_spinner=False)
-def read_and_clean_data(file_path):
-    df = pd.read_csv(file_path)
-    df = df.copy()
+## DATA LOADING FUNCTIONS ##
+
+# dimension columns stored as categoricals (small integer codes instead of python strings)
+DIMENSION_COLUMNS = ["category", "merchant", "payment_method", "account_type", "transaction_type"]
+
+# format the "date" column is parsed with: ISO 8601 skips per-row inference and still accepts timestamps with and
+# without fractional seconds ("2024-08-26 14:40:08" as written by str() when the microseconds are 0)
+DATE_FORMAT = "ISO8601"
+
+# format of the "date" column in the exported csv, used to write synthetic transactions
+EXPORT_DATE_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+# columnar cache files are written to this folder next to the source csv
+CACHE_DIR_NAME = ".ingest_cache"
+
+# columns held in memory: the raw "date" string is replaced by the parsed Date and amounts are integer cents,
+# LAZY_COLUMNS stay in the columnar cache and are only read for the rows that need them (load_descriptions)
+FRAME_COLUMNS = ["transaction_id", "Date", "amount_cents"] + DIMENSION_COLUMNS
+LAZY_COLUMNS = ["description"]
+
+# number of earlier (offset, content hash) ingest points kept in the metadata, see is_ingested_prefix
+INGEST_HISTORY = 16
+
+# the transactions and their cube are shared by every session (see read_and_clean_data): with copy-on-write,
+# a session that assigns into its view of a shared frame gets its own copy of the touched column instead
+pd.set_option("mode.copy_on_write", True)
+
+# Returns the (size, mtime) fingerprint of a file, cheap to compute on every load
+    # file_path = path to the file (string)
+def file_fingerprint(file_path):
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+# Returns a (size, mtime) tuple that changes whenever the file does, to key caches on the file version
+    # file_path = path to the file, or a directory or glob of partition files (string)
+    # for a partitioned dataset the tuple holds the (path, size, mtime) of every partition
+def source_version(file_path):
+    if is_partitioned(file_path):
+        return tuple(
+            (partition["path"],) + source_version(partition["path"])
+            for partition in list_partitions(file_path)
+        )
+
+    fingerprint = file_fingerprint(file_path)
+    return fingerprint["size"], fingerprint["mtime_ns"]
+
+# Feeds the first length bytes of an open file to a digest, in 8 MB blocks to keep memory flat
+def _hash_blocks(f, digest, length=None):
+    remaining = length
+    while remaining is None or remaining > 0:
+        block = f.read(8 * 1024 * 1024 if remaining is None else min(8 * 1024 * 1024, remaining))
+        if not block:
+            break
+        digest.update(block)
+        if remaining is not None:
+            remaining -= len(block)
+    return digest
+
+# Returns a hex digest of the file contents, or of its first length bytes
+    # file_path = path to the file (string)
+    # length = number of leading bytes to hash, None hashes the whole file (int)
+def file_content_hash(file_path, length=None):
+    with open(file_path, "rb") as f:
+        return _hash_blocks(f, hashlib.blake2b(digest_size=20), length).hexdigest()
+
+# Returns the ingest metadata of a file parsed in full
+    # file_path = path to the source csv (string)
+    # rows = number of rows parsed (int)
+    # offset is the number of bytes ingested and content_hash their digest, appends are parsed from offset
+def full_ingest_meta(file_path, rows):
+    meta = file_fingerprint(file_path)
+    meta["offset"] = meta["size"]
+    meta["content_hash"] = file_content_hash(file_path)
+    meta["rows"] = rows
+
+    # appends can only be parsed from a line boundary
+    with open(file_path, "rb") as f:
+        f.seek(max(meta["size"] - 1, 0))
+        meta["line_end"] = f.read(1) in (b"\n", b"")
+
+    meta["history"] = [[meta["offset"], meta["content_hash"]]]
+    return meta
+
+# Compares a file with the ingest metadata of the cache built from it
+    # file_path = path to the source csv (string)
+    # meta = metadata from full_ingest_meta or an earlier call (dict)
+    # returns (status, appended, new_meta): status is "unchanged", "appended" or "rewritten", appended holds the
+    # complete lines added after the ingested bytes (bytes) and new_meta the metadata once they are ingested
+def source_changes(file_path, meta):
+    fingerprint = file_fingerprint(file_path)
+    if not meta or "offset" not in meta:
+        return "rewritten", b"", None
+    if fingerprint["size"] == meta["size"] and fingerprint["mtime_ns"] == meta["mtime_ns"]:
+        return "unchanged", b"", meta
+    if fingerprint["size"] < meta["offset"]:
+        return "rewritten", b"", None
+
+    with open(file_path, "rb") as f:
+        # the ingested bytes must be untouched, otherwise the file was rewritten rather than appended
+        digest = _hash_blocks(f, hashlib.blake2b(digest_size=20), meta["offset"])
+        if digest.hexdigest() != meta["content_hash"]:
+            return "rewritten", b"", None
+        if fingerprint["size"] == meta["size"]:
+            return "unchanged", b"", meta | fingerprint
+        if not meta["line_end"]:
+            return "rewritten", b"", None
+
+        # a line still being written is left for the next call
+        tail = f.read()
+        appended = tail[:tail.rfind(b"\n") + 1]
+
+    digest.update(appended)
+    new_meta = meta | fingerprint
+    new_meta["offset"] = meta["offset"] + len(appended)
+    new_meta["content_hash"] = digest.hexdigest()
+    new_meta["history"] = (meta["history"] + [[new_meta["offset"], new_meta["content_hash"]]])[-INGEST_HISTORY:]
+
+    return "appended", appended, new_meta
+
+# Returns True if the (offset, content hash) ingest point is a prefix of the data described by meta
+    # meta = current ingest metadata (dict)
+    # offset, content_hash = an earlier ingest point (int, string)
+def is_ingested_prefix(meta, offset, content_hash):
+    return bool(meta) and [offset, content_hash] in meta.get("history", [])
+
+# Returns a csv buffer holding the header of the file followed by appended lines, for pd.read_csv
+    # file_path = path to the source csv (string)
+    # appended = complete lines from source_changes (bytes)
+def appended_rows(file_path, appended):
+    with open(file_path, "rb") as f:
+        header = f.readline()
+    return io.BytesIO(header + appended)
+
+# Returns the paths of the cached arrow file and its metadata file for a given csv
+    # file_path = path to the source csv (string)
+def cache_paths(file_path):
+    folder, name = os.path.split(os.path.abspath(file_path))
+    cache_dir = os.path.join(folder, CACHE_DIR_NAME)
+    return os.path.join(cache_dir, name + ".arrow"), os.path.join(cache_dir, name + ".json")
+
+# Returns amounts as integer cents, in int32 when every amount fits
+    # amounts = amounts in dollars (numpy array or panda Series)
+    # missing amounts stay missing as in the csv: the cents are then float64, nan where the amount is missing, and
+    # sums skip them while they still count as transactions
+def to_cents(amounts):
+    amounts = np.asarray(amounts, dtype="float64")
+    cents = np.round(amounts * 100)
+    if not np.isfinite(cents).all():
+        return np.where(np.isfinite(cents), cents, np.nan)
+
+    fits_int32 = len(cents) == 0 or np.abs(cents).max() < np.iinfo("int32").max
+    return cents.astype("int32" if fits_int32 else "int64")
+
+# Converts freshly read transactions to the compact in-memory layout
+    # df = rows with the raw csv columns (panda DataFrame)
+    # returns the FRAME_COLUMNS and LAZY_COLUMNS present, with categorical dimensions
+def compact_frame(df):
+    df = df.astype({col: "category" for col in DIMENSION_COLUMNS if col in df})
+
+    if pd.api.types.is_datetime64_any_dtype(df["date"]):
+        df["Date"] = df.pop("date")
+    else:
+        df["Date"] = pd.to_datetime(df.pop("date"), format=DATE_FORMAT)
+    df["amount_cents"] = to_cents(df.pop("amount"))
+
+    return df[[col for col in FRAME_COLUMNS + LAZY_COLUMNS if col in df]]
+
+# Parses the raw csv with explicit dtypes
+    # file_path = path to the source csv, or a buffer from appended_rows (string)
+    # returns a panda DataFrame in the layout of compact_frame
+def parse_csv(file_path):
+    df = pd.read_csv(
+        file_path,
+        dtype={col: "category" for col in DIMENSION_COLUMNS} | {"amount": "float64"}
+    )
+
+    return compact_frame(df)
+
+# Returns the in-memory columns of a transactions frame, without the lazily loaded columns
+    # df = frame from parse_csv (panda DataFrame)
+def frame_columns(df):
+    return df[[col for col in FRAME_COLUMNS if col in df]]
 
-    df["Date"] = pd.to_datetime(df["date"])
+# Returns a pandas array over one column of a memory-mapped arrow table, without copying it when possible
+    # column = table column (pa.ChunkedArray)
+    # numbers and dates in a single chunk without nulls become read-only numpy views of the mapped file,
+    # dictionary columns keep their mapped codes and strings stay arrow-backed, so every process that maps
+    # the same file shares the same physical pages
+def mapped_array(column):
+    if pa.types.is_string(column.type) or pa.types.is_large_string(column.type):
+        return pd.arrays.ArrowExtensionArray(column)
 
+    if column.num_chunks != 1 or column.null_count:
+        return column.to_pandas().array
+
+    chunk = column.chunk(0)
+    if pa.types.is_dictionary(chunk.type):
+        return pd.Categorical.from_codes(
+            chunk.indices.to_numpy(zero_copy_only=True),
+            categories=chunk.dictionary.to_pandas(),
+            validate=False
+        )
+    return chunk.to_numpy(zero_copy_only=True)
+
+# Maps the in-memory columns of the columnar cache, the lazily loaded columns are not read
+    # arrow_path = path to the cached arrow file (string)
+    # returns None for a cache written in an older layout
+def read_cached_frame(arrow_path):
+    table = pa.ipc.open_file(pa.memory_map(arrow_path)).read_all()
+    if "amount_cents" not in table.schema.names:
+        return None
+
+    columns = {col: mapped_array(table.column(col)) for col in FRAME_COLUMNS if col in table.schema.names}
+    return pd.DataFrame(columns, copy=False)
+
+# Concatenates frames whose dimension columns are categoricals with different categories
+    # frames = DataFrames with the same columns, all or some of the dimension columns among them (list)
+    # the result keeps categorical dimensions, with the sorted union of the categories
+def concat_categorical(frames):
+    frames = [frame for frame in frames if len(frame)] or frames[:1]
+    dimensions = [col for col in DIMENSION_COLUMNS if col in frames[0]]
+    frames = [
+        frame.astype({col: "category" for col in dimensions if not isinstance(frame[col].dtype, pd.CategoricalDtype)})
+        for frame in frames
+    ]
+    categories = {
+        col: sorted(set().union(*(frame[col].cat.categories for frame in frames)))
+        for col in dimensions
+    }
+    aligned = [
+        frame.assign(**{col: frame[col].cat.set_categories(categories[col]) for col in dimensions})
+        for frame in frames
+    ]
+    return pd.concat(aligned, ignore_index=True)
+
+# Returns the ingest metadata of the columnar cache, or None if there is no cache
+    # file_path = path to the source csv (string)
+def load_cache_meta(file_path):
+    _, meta_path = cache_paths(file_path)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        return json.load(f)
+
+# Returns the cached DataFrame brought up to date with the source file, or None if the file was rewritten
+    # file_path = path to the source csv (string)
+    # rows appended to the file since the cache was written are parsed on their own and added to the cache
+def load_cached_data(file_path):
+    arrow_path, meta_path = cache_paths(file_path)
+    meta = load_cache_meta(file_path)
+    if meta is None or not os.path.exists(arrow_path):
+        return None
+
+    status, appended, new_meta = source_changes(file_path, meta)
+    if status == "rewritten":
+        return None
+
+    df = read_cached_frame(arrow_path)
+    if df is None:
+        return None
+    if appended:
+        # the cache is rewritten with every column, the lazily loaded ones included, then mapped again
+        full = concat_categorical([feather.read_feather(arrow_path), parse_csv(appended_rows(file_path, appended))])
+        new_meta["rows"] = len(full)
+        write_cached_data(file_path, full, new_meta)
+        df = read_cached_frame(arrow_path)
+    elif new_meta != meta:
+        with open(meta_path, "w") as f:
+            json.dump(new_meta, f)
+
+    df.attrs["ingest"] = new_meta
+    return df
+
+# Writes the parsed DataFrame to the columnar cache together with its ingest metadata
+    # file_path = path to the source csv (string)
+    # df = parsed DataFrame from parse_csv, lazily loaded columns included (panda DataFrame)
+    # meta = metadata from full_ingest_meta or source_changes (dict)
+def write_cached_data(file_path, df, meta):
+    arrow_path, meta_path = cache_paths(file_path)
+    os.makedirs(os.path.dirname(arrow_path), exist_ok=True)
+
+    # uncompressed arrow ipc in a single record batch, so every column can be memory-mapped without copying
+    # (replacing the file leaves the pages of the previous version mapped until their readers let go)
+    tmp_path = arrow_path + ".tmp"
+    feather.write_feather(df, tmp_path, compression="uncompressed", chunksize=max(len(df), 1))
+    os.replace(tmp_path, arrow_path)
+
+    with open(meta_path, "w") as f:
+        json.dump(meta, f)
+
+# Reads one transactions file: a csv through the columnar cache, or a parquet file directly
+    # file_path = path to the source file (string)
+    # use_cache = read from / write to the columnar cache (bool)
+    # returns a panda DataFrame with date column converted to datetime format, the ingest metadata in df.attrs
+def load_file(file_path, use_cache=True):
+    if file_path.endswith(".parquet"):
+        return parse_parquet(file_path)
+
+    if use_cache:
+        df = load_cached_data(file_path)
+        if df is not None:
+            return df
+
+    df = parse_csv(file_path)
+    meta = full_ingest_meta(file_path, len(df))
+
+    if use_cache:
+        try:
+            write_cached_data(file_path, df, meta)
+            # map the cache just written, so this process shares its pages with the others
+            df = read_cached_frame(cache_paths(file_path)[0])
+        except OSError:
+            # read-only deployments still work, they just parse the csv every cold start
+            pass
+
+    df = frame_columns(df)
+    df.attrs["ingest"] = meta
+    return df
+
+# Returns the description of the given rows, read on demand instead of being held in memory
+    # file_path = path to the source csv, or a directory or glob of partition files (string)
+    # positions = row positions in the frame from read_and_clean_data (numpy array)
+    # partitions = the partitions passed to read_and_clean_data (tuple)
+    # returns a numpy object array in the order of positions
+def load_descriptions(file_path, positions, partitions=None):
+    if is_partitioned(file_path):
+        paths = partitions or tuple(partition["path"] for partition in list_partitions(file_path))
+    else:
+        paths = (file_path,)
+
+    columns = [read_lazy_column(path, "description") for path in paths]
+    return pd.concat(columns, ignore_index=True).take(positions).to_numpy(dtype=object)
+
+# Returns one lazily loaded column of a transactions file, from the columnar cache when there is one
+    # file_path = path to a csv or parquet file (string)
+    # column = name of the column (string)
+    # a cached column stays arrow-backed over the mapped file, so only the rows taken from it are converted
+def read_lazy_column(file_path, column):
+    if file_path.endswith(".parquet"):
+        if column not in pq.read_schema(file_path).names:
+            return pd.Series([None] * pq.read_metadata(file_path).num_rows, name=column)
+        return pd.read_parquet(file_path, columns=[column])[column]
+
+    arrow_path, _ = cache_paths(file_path)
+    if os.path.exists(arrow_path):
+        table = pa.ipc.open_file(pa.memory_map(arrow_path)).read_all()
+        if column in table.schema.names:
+            return pd.Series(mapped_array(table.column(column)), name=column, copy=False)
+
+    return pd.read_csv(file_path, usecols=[column])[column]
+
+# Returns the frame over read-only arrays, so writing into it in place raises instead of changing it for everyone
+    # df = frame shared between sessions (panda DataFrame)
+    # columns mapped from the columnar cache are read-only already, this covers parsed and aggregated frames
+def make_read_only(df):
+    columns = {}
+    for col in df.columns:
+        values = df[col].array
+        if isinstance(values, pd.arrays.ArrowExtensionArray):
+            # arrow buffers are immutable, copy-on-write keeps assignments out of the shared frame
+            columns[col] = values
+        elif pd.api.types.is_object_dtype(values.dtype):
+            # python strings become arrow strings like the ones mapped from the cache
+            columns[col] = pd.arrays.ArrowExtensionArray(pa.array(np.asarray(values), from_pandas=True))
+        elif isinstance(values, pd.Categorical):
+            # .codes is already a read-only view
+            columns[col] = pd.Categorical.from_codes(values.codes, dtype=values.dtype, validate=False)
+        else:
+            # the frame is rebuilt over these arrays, a flag set on an existing block's base would not reach it
+            array = np.asarray(values)
+            array.flags.writeable = False
+            columns[col] = array
+
+    read_only = pd.DataFrame(columns, index=df.index, copy=False)
+    read_only.attrs = df.attrs
+    return read_only
+
+# Returns a view of a shared frame for one session, adding or replacing its columns leaves the shared frame alone
+    # df = frame from read_and_clean_data or load_cube (panda DataFrame)
+def session_view(df):
+    return df.copy(deep=False)
+
+# Reads the transactions csv, or the partitions of a partitioned dataset, see list_partitions
+    # file_path = path to the source csv, or a directory or glob of partition files (string)
+    # use_cache = read from / write to the columnar cache (bool)
+    # version = source_version of the file, so a changed file is not served from the cache (tuple)
+    # partitions = partition files to read from select_partitions, None reads every partition (tuple)
+    # returns a read-only panda DataFrame shared by every session of the process (use session_view), whose
+    # columns are memory-mapped from the columnar cache so server processes on the same host share its pages
+@st.cache_resource(show_spinner=False, max_entries=2)
+def read_and_clean_data(file_path, use_cache=True, version=None, partitions=None):
+    if not is_partitioned(file_path):
+        return make_read_only(load_file(file_path, use_cache))
+
+    if partitions is None:
+        partitions = tuple(partition["path"] for partition in list_partitions(file_path))
+    return make_read_only(read_partitions(partitions, use_cache))
+
+## PARTITIONED DATASET FUNCTIONS ##
+
+# partition files are read by this many threads (parsing and arrow reads release the GIL)
+PARTITION_WORKERS = min(8, os.cpu_count() or 1)
+
+PARTITION_EXTENSIONS = (".csv", ".parquet")
+
+# hive-style partition folders (year=2024/month=08/day=26) and dates in file names (2024-08, 2024_08_26, 202408)
+HIVE_PATTERNS = {part: re.compile(rf"(?:^|[\\/]){part}=(\d+)(?=[\\/]|$)") for part in ["year", "month", "day"]}
+FILENAME_DATE_PATTERN = re.compile(r"(?<!\d)((?:19|20)\d{2})[-_]?(0[1-9]|1[0-2])(?:[-_]?(0[1-9]|[12]\d|3[01]))?(?!\d)")
+
+# Returns True if the path is a directory or a glob of partition files rather than a single file
+    # file_path = path given to read_and_clean_data (string)
+def is_partitioned(file_path):
+    return os.path.isdir(file_path) or glob.has_magic(file_path)
+
+# Returns the first and last day covered by a partition file, (None, None) if its path holds no date
+    # path = path of the partition file, relative to the dataset root for hive folders (string)
+def partition_dates(path):
+    hive = {part: pattern.search(os.path.dirname(path)) for part, pattern in HIVE_PATTERNS.items()}
+    if hive["year"]:
+        year, month, day = [int(hive[part].group(1)) if hive[part] else None for part in ["year", "month", "day"]]
+    else:
+        match = FILENAME_DATE_PATTERN.search(os.path.basename(path))
+        if not match:
+            return None, None
+        year, month, day = [int(group) if group else None for group in match.groups()]
+
+    start = pd.Timestamp(year=year, month=month or 1, day=day or 1)
+    if day:
+        end = start
+    elif month:
+        end = start + pd.offsets.MonthEnd(0)
+    else:
+        end = start + pd.offsets.YearEnd(0)
+    return start.date(), end.date()
+
+# Returns the partition files of a dataset with the dates each one covers, sorted by path
+    # file_path = directory (searched recursively) or glob of csv / parquet files (string)
+    # returns a list of dicts with path, start and end (dates, None when the path holds no date)
+def list_partitions(file_path):
+    if os.path.isdir(file_path):
+        root = file_path
+        paths = glob.glob(os.path.join(file_path, "**", "*"), recursive=True)
+    else:
+        root = re.split(r"[*?\[]", file_path, maxsplit=1)[0]
+        root = root if os.path.isdir(root) else os.path.dirname(root)
+        paths = glob.glob(file_path, recursive=True)
+
+    partitions = []
+    for path in sorted(paths):
+        if not (path.endswith(PARTITION_EXTENSIONS) and os.path.isfile(path)):
+            continue
+        # the folders above the dataset root are not partition keys
+        start, end = partition_dates(os.path.relpath(path, root) if root else path)
+        partitions.append({"path": path, "start": start, "end": end})
+
+    if not partitions:
+        raise FileNotFoundError(f"no .csv or .parquet partitions found in {file_path}")
+    return partitions
+
+# Returns the partition files overlapping the date range, partitions without a date are always kept
+    # file_path = directory or glob of partition files (string)
+    # date_range = (start, end) dates, anything else keeps every partition (tuple)
+def select_partitions(file_path, date_range):
+    partitions = list_partitions(file_path)
+    if date_range and len(date_range) == 2:
+        start, end = pd.Timestamp(date_range[0]).date(), pd.Timestamp(date_range[1]).date()
+        partitions = [
+            partition for partition in partitions
+            if partition["start"] is None or (partition["start"] <= end and partition["end"] >= start)
+        ]
+    return tuple(partition["path"] for partition in partitions)
+
+# Returns the first and last day covered by the partitions, or None if a partition has no date in its path
+    # file_path = directory or glob of partition files (string)
+def partition_date_bounds(file_path):
+    partitions = list_partitions(file_path)
+    if any(partition["start"] is None for partition in partitions):
+        return None
+    return min(p["start"] for p in partitions), max(p["end"] for p in partitions)
+
+# Reads a parquet partition with the same columns and dtypes as parse_csv, lazily loaded columns are not read
+    # file_path = path to the parquet file (string)
+def parse_parquet(file_path):
+    names = pq.read_schema(file_path).names
+    df = pd.read_parquet(file_path, columns=[col for col in names if col not in LAZY_COLUMNS])
+    return frame_columns(compact_frame(df))
+
+# Reads partition files in parallel and concatenates them in path order
+    # partitions = paths of the partition files (tuple)
+    # use_cache = see load_file (bool)
+def read_partitions(partitions, use_cache=True):
+    if not partitions:
+        raise FileNotFoundError("no partitions selected")
+
+    with ThreadPoolExecutor(max_workers=PARTITION_WORKERS) as pool:
+        frames = list(pool.map(lambda path: load_file(path, use_cache), partitions))
+
+    df = concat_categorical(frames)
+    # the rows of a partitioned dataset do not come from a single ingested file
+    df.attrs.pop("ingest", None)
     return df
 
 ## SIDEBAR FUNCTIONS ##
@@ -78,6 +582,519 @@ def filter_transaction(df, transactions):
     
     return df.loc[transactions_filter].copy()
 
+# Returns a filter spec (dict) holding every sidebar selection
+    # date_range = (start, end) dates (tuple)
+    # the remaining arguments are the selected values for each dimension column (list)
+    # an empty or missing selection means the dimension is not filtered
+def make_filter_spec(date_range=None, categories=None, merchants=None,
+                     payment_methods=None, account_types=None, transactions=None):
+    return {
+        "date_range": tuple(date_range) if date_range else None,
+        "category": list(categories) if categories else None,
+        "merchant": list(merchants) if merchants else None,
+        "payment_method": list(payment_methods) if payment_methods else None,
+        "account_type": list(account_types) if account_types else None,
+        "transaction_type": list(transactions) if transactions else None,
+    }
+
+# Returns a boolean numpy mask for the date range, or None if the range does not restrict anything
+    # dates = datetime64 column (panda Series)
+    # date_range = (start, end) dates, end date inclusive (tuple)
+def date_mask(dates, date_range):
+    if not date_range or len(date_range) != 2:
+        return None
+
+    start, end = pd.to_datetime(date_range[0]), pd.to_datetime(date_range[1])
+    end = end + pd.Timedelta(days=1) - pd.Timedelta(seconds=1)
+
+    values = dates.to_numpy()
+    return (values >= start.to_datetime64()) & (values <= end.to_datetime64())
+
+# Returns a boolean numpy mask for the selected values of one column, or None if every value is selected
+    # column = dimension column (panda Series)
+    # selected = values to keep (list)
+def code_mask(column, selected):
+    if not selected:
+        return None
+
+    if not isinstance(column.dtype, pd.CategoricalDtype):
+        mask = column.isin(selected).to_numpy()
+        return None if mask.all() else mask
+
+    # look-up table indexed by category code, the extra last slot maps code -1 (missing) to False
+    categories = column.cat.categories
+    lookup = np.zeros(len(categories) + 1, dtype=bool)
+    positions = categories.get_indexer(list(selected))
+    lookup[positions[positions >= 0]] = True
+
+    if lookup[:-1].all():
+        return None
+
+    return lookup[column.cat.codes.to_numpy()]
+
+# Returns the row positions that pass every filter in the spec, or None if no filter restricts the data
+    # df = DataFrame to filter (panda DataFrame)
+    # spec = filter spec from make_filter_spec (dict)
+def filter_positions(df, spec):
+    mask = date_mask(df["Date"], spec.get("date_range"))
+
+    for col in DIMENSION_COLUMNS:
+        col_mask = code_mask(df[col], spec.get(col))
+        if col_mask is None:
+            continue
+        if mask is None:
+            mask = col_mask
+        else:
+            mask &= col_mask
+
+    if mask is None:
+        return None
+
+    return np.flatnonzero(mask)
+
+# Returns one column of the filtered rows as an array, without copying the rest of the frame
+    # df = transactions from read_and_clean_data (panda DataFrame)
+    # positions = output of filter_positions, None keeps every row (numpy array)
+    # column = column name, "amount" returns the amounts in dollars computed from amount_cents (string)
+    # dimension columns are returned as a pd.Categorical, the other columns as numpy arrays
+def filtered_column(df, positions, column):
+    if column == "amount":
+        cents = df["amount_cents"].to_numpy()
+        return (cents if positions is None else cents[positions]) / 100
+
+    values = df[column].array if isinstance(df[column].dtype, pd.CategoricalDtype) else df[column].to_numpy()
+    return values if positions is None else values.take(positions)
+
+# Applies every sidebar filter in a single pass
+    # df = DataFrame to filter (panda DataFrame)
+    # spec = filter spec from make_filter_spec (dict)
+    # returns the original df when nothing is filtered out, otherwise one filtered copy
+def filter_data(df, spec):
+    positions = filter_positions(df, spec)
+
+    if positions is None or len(positions) == len(df):
+        return df
+
+    return df.take(positions)
+
+## AGGREGATE CUBE FUNCTIONS ##
+
+WEEKDAY_ORDER = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+# Returns a pre-aggregated cube keyed by day and every dimension column
+    # df = transactions from read_and_clean_data (panda DataFrame)
+    # returns a panda DataFrame with one row per observed (Date, dimensions...) combination and the
+    # columns amount (sum), count and amount_sq (sum of squares), so it can be filtered with filter_data
+    # and passed to the chart functions in place of the raw transactions
+def build_cube(df):
+    cents = df["amount_cents"].to_numpy()
+    amount = cents / 100
+
+    keyed = pd.DataFrame({
+        "Date": df["Date"].to_numpy().astype("datetime64[D]").astype("datetime64[ns]"),
+        **{col: df[col].array for col in DIMENSION_COLUMNS},
+        # missing amounts (nan cents, see to_cents) add nothing to the sums and are still counted
+        "cents": np.nan_to_num(cents).astype("int64"),
+        "amount_sq": amount * amount,
+    })
+
+    cube = (
+        keyed
+        .groupby(["Date"] + DIMENSION_COLUMNS, as_index=False, observed=True, sort=True)
+        .agg(amount=("cents", "sum"), count=("cents", "size"), amount_sq=("amount_sq", "sum"))
+    )
+    # integer cent sums are exact, whatever order the rows are summed in
+    cube["amount"] = cube["amount"] / 100
+
+    return round_cube_sums(cube)
+
+# Rounds the cube sums to the precision of the amounts (cents), so cubes summed in a different order,
+# e.g. by the sql backend, hold identical values
+    # cube = cube from build_cube (panda DataFrame)
+def round_cube_sums(cube):
+    cube["amount"] = cube["amount"].round(2)
+    cube["amount_sq"] = cube["amount_sq"].round(4)
+    return cube
+
+# Merges cubes built from different rows of the same data, e.g. before and after an append
+    # cubes = cubes from build_cube (list)
+def merge_cubes(cubes):
+    merged = (
+        concat_categorical(cubes)
+        .groupby(["Date"] + DIMENSION_COLUMNS, as_index=False, observed=True, sort=True)
+        .sum()
+    )
+    return round_cube_sums(merged)
+
+# Returns the process-wide store of the last cube built for each file, to update it after appends
+@st.cache_resource
+def get_cube_store():
+    return {}
+
+# Builds the cube once per version of the data file, only aggregating the appended rows when the
+# previous cube was built from a prefix of the file
+    # file_path = path to the source csv (string)
+    # version = source_version of the file (tuple)
+    # partitions = partition files to aggregate, see read_and_clean_data (tuple)
+    # returns a read-only cube shared by every session, like read_and_clean_data
+@st.cache_resource(show_spinner=False, max_entries=2)
+def load_cube(file_path, version=None, partitions=None):
+    df = read_and_clean_data(file_path, version=version, partitions=partitions)
+    meta = df.attrs.get("ingest")
+    if meta is None:
+        return make_read_only(build_cube(df))
+
+    store = get_cube_store()
+    previous = store.get(os.path.abspath(file_path))
+    if previous and previous["rows"] == len(df) and previous["content_hash"] == meta["content_hash"]:
+        cube = previous["cube"]
+    elif previous and is_ingested_prefix(meta, previous["offset"], previous["content_hash"]):
+        cube = merge_cubes([previous["cube"], build_cube(df.iloc[previous["rows"]:])])
+    else:
+        cube = build_cube(df)
+
+    if meta:
+        store[os.path.abspath(file_path)] = {
+            "offset": meta["offset"], "content_hash": meta["content_hash"], "rows": len(df), "cube": cube
+        }
+    return make_read_only(cube)
+
+# Returns the total, mean and number of transactions of a (filtered) cube
+    # cube = cube from build_cube, usually after filter_data (panda DataFrame)
+def cube_metrics(cube):
+    total = cube["amount"].sum()
+    count = int(cube["count"].sum())
+    mean = total / count if count else np.nan
+
+    return total, mean, count
+
+# Returns the average amount and number of transactions per day of the week from a (filtered) cube
+    # cube = cube from build_cube, usually after filter_data (panda DataFrame)
+    # returns a panda DataFrame with columns Day, mean_amount and count ordered Monday to Sunday
+def weekday_summary(cube):
+    day = pd.Categorical(cube["Date"].dt.day_name(), categories=WEEKDAY_ORDER, ordered=True)
+
+    summary = (
+        cube[["amount", "count"]]
+        .groupby(day, observed=False)
+        .sum()
+        .rename_axis("Day")
+        .reset_index()
+    )
+    summary["mean_amount"] = summary["amount"] / summary["count"].replace(0, np.nan)
+
+    return summary[["Day", "mean_amount", "count"]]
+
+## DATE RANGE INDEX FUNCTIONS ##
+
+# Returns a hashable key for the non-date part of a filter spec
+    # spec = filter spec from make_filter_spec (dict)
+def dimension_filter_key(spec):
+    return tuple(
+        (col, tuple(sorted(map(str, spec[col]))) if spec.get(col) else None)
+        for col in DIMENSION_COLUMNS
+    )
+
+# Returns a hashable key for the whole filter spec, dates included
+    # spec = filter spec from make_filter_spec (dict)
+def filter_spec_key(spec):
+    date_range = spec.get("date_range")
+    if not date_range or len(date_range) != 2:
+        date_range = None
+    else:
+        date_range = tuple(str(pd.Timestamp(d).date()) for d in date_range)
+
+    return (("date_range", date_range),) + dimension_filter_key(spec)
+
+# Returns a prefix-sum index over days for a cube that is already filtered on the non-date dimensions
+    # cube = cube from build_cube (panda DataFrame)
+    # returns a dict of numpy arrays: sorted days, daily amount and count, and their cumulative sums
+    # (with a leading 0) so that any date range resolves with two binary searches
+def build_prefix_index(cube):
+    daily = cube.groupby("Date")[["amount", "count"]].sum()
+
+    return {
+        "days": daily.index.to_numpy().astype("datetime64[D]"),
+        "amount": daily["amount"].to_numpy(),
+        "count": daily["count"].to_numpy(),
+        "cum_amount": np.concatenate([[0.0], np.cumsum(daily["amount"].to_numpy())]),
+        "cum_count": np.concatenate([[0], np.cumsum(daily["count"].to_numpy())]),
+    }
+
+# Builds the prefix-sum index once per version of the data file and combination of non-date filters
+    # file_path = path to the source csv (string)
+    # dimension_key = key from dimension_filter_key (tuple)
+    # version = source_version of the file (tuple)
+    # partitions = see load_cube (tuple)
+@st.cache_data(show_spinner=False, max_entries=64)
+def load_prefix_index(file_path, dimension_key, version=None, partitions=None):
+    spec = {col: list(values) if values else None for col, values in dimension_key}
+    return build_prefix_index(filter_data(load_cube(file_path, version, partitions), spec))
+
+# Returns the (lo, hi) slice of the index covering the date range, end date inclusive
+    # index = prefix-sum index from build_prefix_index (dict)
+    # date_range = (start, end) dates (tuple)
+def prefix_slice(index, date_range):
+    days = index["days"]
+    if not date_range or len(date_range) != 2:
+        return 0, len(days)
+
+    start, end = np.datetime64(date_range[0], "D"), np.datetime64(date_range[1], "D")
+    return np.searchsorted(days, start, side="left"), np.searchsorted(days, end, side="right")
+
+# Returns the total, mean and number of transactions within a date range
+    # index = prefix-sum index from build_prefix_index (dict)
+    # date_range = (start, end) dates (tuple)
+def range_metrics(index, date_range):
+    lo, hi = prefix_slice(index, date_range)
+    total = index["cum_amount"][hi] - index["cum_amount"][lo]
+    count = int(index["cum_count"][hi] - index["cum_count"][lo])
+    mean = total / count if count else np.nan
+
+    return total, mean, count
+
+# Returns the daily totals within a date range as a DataFrame that line_with_mean can resample
+    # index = prefix-sum index from build_prefix_index (dict)
+    # date_range = (start, end) dates (tuple)
+def range_daily_totals(index, date_range):
+    lo, hi = prefix_slice(index, date_range)
+
+    return pd.DataFrame({
+        "Date": index["days"][lo:hi].astype("datetime64[ns]"),
+        "amount": index["amount"][lo:hi],
+        "count": index["count"][lo:hi],
+    })
+
+## DIMENSION INDEX FUNCTIONS ##
+
+# Returns the dimension dictionary and co-occurrence index of a cube: the sorted values of every dimension
+# column, and the number of transactions of every combination of values that occurs
+    # cube = cube from build_cube, or any frame with the dimension columns as categoricals and a count column
+    # the days of the cube are collapsed through one flat combination code, so the index has one row per
+    # observed combination, far fewer than the transactions or the cube
+    # returns a dict: values = {column: sorted values (list)}, codes = {column: position of the combination's
+    # value in values (numpy array)}, count = transactions of every combination (numpy array)
+def build_dimension_index(cube):
+    valid = np.ones(len(cube), dtype=bool)
+    for col in DIMENSION_COLUMNS:
+        valid &= cube[col].cat.codes.to_numpy() >= 0
+    counts = cube["count"].to_numpy()[valid]
+
+    values, codes = {}, []
+    for col in DIMENSION_COLUMNS:
+        present, inverse = np.unique(cube[col].cat.codes.to_numpy()[valid], return_inverse=True)
+        labels = cube[col].cat.categories[present]
+        # codes follow the sorted values, as the sidebar lists them
+        order = labels.astype(str).argsort()
+        rank = np.empty(len(order), dtype="int64")
+        rank[order] = np.arange(len(order))
+        values[col] = labels[order].tolist()
+        codes.append(rank[inverse])
+
+    shape = [max(len(values[col]), 1) for col in DIMENSION_COLUMNS]
+    combos, inverse = np.unique(np.ravel_multi_index(codes, shape), return_inverse=True)
+    return {
+        "values": values,
+        "codes": dict(zip(DIMENSION_COLUMNS, np.unravel_index(combos, shape))),
+        "count": np.bincount(inverse, weights=counts, minlength=len(combos)).astype("int64"),
+    }
+
+# Builds the dimension index once per version of the data file, from the shared cube
+    # file_path, version, partitions = see load_cube
+@st.cache_resource(show_spinner=False, max_entries=4)
+def load_dimension_index(file_path, version=None, partitions=None):
+    return build_dimension_index(load_cube(file_path, version, partitions))
+
+# Returns the number of transactions of every value of every dimension column under the selections of the
+# other columns, so each filter only lists the values that still match something
+    # index = output of build_dimension_index (dict)
+    # spec = filter spec from make_filter_spec, or any dict of selections per dimension column (dict)
+    # a column's own selection does not narrow its options, and the date range is not applied: the counts
+    # cover every date
+    # returns {column: panda Series of transactions indexed by value}, 0 for values without any
+def filter_options(index, spec):
+    masks = {}
+    for col in DIMENSION_COLUMNS:
+        selected = spec.get(col)
+        if selected:
+            lookup = np.zeros(len(index["values"][col]) + 1, dtype=bool)
+            positions = pd.Index(index["values"][col]).get_indexer(list(selected))
+            lookup[positions] = True
+            # values missing from the index land on the extra last position, which is never a code
+            lookup[-1] = False
+            masks[col] = lookup[index["codes"][col]]
+
+    options = {}
+    for col in DIMENSION_COLUMNS:
+        keep = np.ones(len(index["count"]), dtype=bool)
+        for other, mask in masks.items():
+            if other != col:
+                keep &= mask
+        counts = np.bincount(index["codes"][col][keep], weights=index["count"][keep],
+                             minlength=len(index["values"][col]))
+        options[col] = pd.Series(counts.astype("int64"), index=index["values"][col], name="count")
+    return options
+
+## BACKGROUND LOADING FUNCTIONS ##
+
+# a csv that is not in the columnar cache yet is parsed in a background thread, meanwhile the dashboard renders
+# from a stratified sample read from evenly spaced blocks of the file, and reruns on the full data once loaded
+
+# the sample is read from this many blocks of the file, the first one after the header and the last one at the end
+SAMPLE_BLOCKS = 256
+SAMPLE_BLOCK_BYTES = 64 * 1024
+
+# most sampled transactions kept per category and month
+SAMPLE_ROWS_PER_STRATUM = 250
+
+# seconds a rerun waits for the full load before rendering from the sample, a load served by the columnar
+# cache finishes within it
+BACKGROUND_WAIT_SECONDS = 0.5
+
+# seconds between two checks of a running load by the preliminary page
+BACKGROUND_POLL_SECONDS = 1.0
+
+# Returns transactions read from evenly spaced blocks of a csv, without reading the whole file
+    # file_path = path to the source csv (string)
+    # blocks, block_bytes = number and size of the blocks read (int)
+    # returns (rows in the layout of frame_columns, share of the file's rows they stand for (float)), a file
+    # smaller than the blocks is read whole
+def read_sample_rows(file_path, blocks=SAMPLE_BLOCKS, block_bytes=SAMPLE_BLOCK_BYTES):
+    size = os.path.getsize(file_path)
+    with open(file_path, "rb") as f:
+        header = f.readline()
+        body_bytes = size - len(header)
+        if body_bytes <= blocks * block_bytes:
+            return frame_columns(parse_csv(file_path)), 1.0
+
+        chunks = []
+        for offset in np.linspace(len(header), size - block_bytes, blocks).astype("int64"):
+            f.seek(offset)
+            block = f.read(block_bytes)
+            # blocks start and end within lines, only their complete lines are kept
+            if offset > len(header):
+                block = block[block.find(b"\n") + 1:]
+            chunks.append(block[:block.rfind(b"\n") + 1])
+
+    sampled = b"".join(chunks)
+    return frame_columns(parse_csv(io.BytesIO(header + sampled))), len(sampled) / body_bytes
+
+# Returns at most per_stratum of the rows of every category and month, each weighted by the number of
+# transactions of the file it stands for
+    # rows, fraction = output of read_sample_rows
+    # per_stratum = most rows kept per category and month (int)
+    # seed = random seed (int)
+    # a row's weight is the rows read in its stratum over the rows kept, divided by the share of the file read,
+    # so weighted sums estimate those of the whole file; rows without a category form a stratum of their own
+def stratified_sample(rows, fraction, per_stratum=SAMPLE_ROWS_PER_STRATUM, seed=0):
+    strata = pd.DataFrame({"category": rows["category"].cat.codes.to_numpy(),
+                           "month": rows["Date"].to_numpy().astype("datetime64[M]")})
+    groups = strata.groupby(["category", "month"], sort=False, dropna=False)
+    read = groups["category"].transform("size").to_numpy()
+
+    # the rank of every row within its stratum, in a random order
+    shuffled = np.random.default_rng(seed).permutation(len(rows))
+    rank = np.empty(len(rows), dtype="int64")
+    rank[shuffled] = strata.iloc[shuffled].groupby(["category", "month"], sort=False, dropna=False).cumcount().to_numpy()
+    keep = rank < per_stratum
+
+    sample = rows[keep].reset_index(drop=True)
+    sample["weight"] = read[keep] / np.minimum(read[keep], per_stratum) / fraction
+    return sample
+
+# Returns the cube of a weighted sample, its sums and counts scaled to estimate those of the whole file
+    # sample = output of stratified_sample (panda DataFrame)
+    # every row of the cube lies within one category and month, so all of its transactions share one weight
+def build_sample_cube(sample):
+    cube = build_cube(sample)
+
+    def strata(frame):
+        return pd.MultiIndex.from_arrays([frame["category"].cat.codes.to_numpy(),
+                                          frame["Date"].to_numpy().astype("datetime64[M]")])
+
+    weights = pd.Series(sample["weight"].to_numpy(), index=strata(sample))
+    weights = weights[~weights.index.duplicated()].reindex(strata(cube)).to_numpy()
+
+    cube["amount"] = cube["amount"] * weights
+    cube["amount_sq"] = cube["amount_sq"] * weights
+    cube["count"] = np.round(cube["count"] * weights).astype("int64")
+    return round_cube_sums(cube)
+
+# Reads the preliminary sample of a csv once per version of the file
+    # file_path = path to the source csv (string)
+    # version = source_version of the file (tuple)
+    # returns (sample, its cube, its dimension index), read-only and shared by every session like
+    # read_and_clean_data; sample.attrs["sample"] holds the rows read, the estimated rows of the file and the
+    # first and last date read
+@st.cache_resource(show_spinner=False, max_entries=2)
+def load_sample(file_path, version=None):
+    rows, fraction = read_sample_rows(file_path)
+    sample = stratified_sample(rows, fraction)
+    cube = build_sample_cube(sample)
+
+    sample.attrs["sample"] = {
+        "rows_read": len(rows),
+        "estimated_rows": int(round(len(rows) / fraction)),
+        "dates": (rows["Date"].min().date(), rows["Date"].max().date()),
+    }
+    return make_read_only(sample), make_read_only(cube), build_dimension_index(cube)
+
+# One load of a version of the data, running in a background thread
+    # version = source_version of the loaded file (tuple)
+    # future = the running loader, its result is None: the loaded frames live in the cached loaders it calls
+class BackgroundLoad:
+    def __init__(self, version, future):
+        self.version = version
+        self.future = future
+        self.started = time.monotonic()
+
+    # Returns whether the load finished, successfully or not, waiting up to timeout seconds for it
+        # timeout = seconds to wait, 0 only checks (float)
+    def wait(self, timeout=0):
+        try:
+            self.future.exception(timeout=timeout)
+        except TimeoutError:
+            return False
+        return True
+
+    def failed(self):
+        return self.future.done() and self.future.exception() is not None
+
+    # Returns the seconds since the load started, whichever session started it
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+# Loads of the full data running in background threads, one per file, shared by every session so a session
+# opened mid-load attaches to the running load instead of starting another
+    # workers = loads running at once, the others queue (int)
+class BackgroundLoads:
+    def __init__(self, workers=1):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="background-load")
+        self._loads = {}
+        self._lock = threading.Lock()
+
+    # Returns the load of one version of a file, starting it unless it is running or done
+        # file_path = path to the source data (string)
+        # version = source_version of the file (tuple)
+        # loader = function without arguments calling the cached loaders, e.g. read_and_clean_data (callable)
+        # a failed load is started again by the next rerun asking for it
+    def start(self, file_path, version, loader):
+        def run():
+            loader()
+
+        key = os.path.abspath(file_path)
+        with self._lock:
+            load = self._loads.get(key)
+            if load is None or load.version != version or load.failed():
+                load = BackgroundLoad(version, self._executor.submit(run))
+                self._loads[key] = load
+            return load
+
+# Returns the process-wide registry of background loads
+@st.cache_resource
+def get_background_loads():
+    return BackgroundLoads()
+
 ## GRAPH FUNCTIONS ##
 
 # Returns a plotly figure as a line chart with a horizontal line for mean
@@ -86,8 +1103,7 @@ def filter_transaction(df, transactions):
     # y = column name for y-axis (string)
     # freq = frequency for resampling (string: "D", "W", "ME")
 def line_with_mean(df, x, y, freq):
-    df_copy = df.copy()
-    aggregated_df = df_copy.set_index(x)[y].resample(freq).sum().reset_index()
+    aggregated_df = df.set_index(x)[y].resample(freq).sum().reset_index()
 
     freq_labels = {"D": "Daily", "W": "Weekly", "ME": "Monthly"}
     freq_label = freq_labels.get(freq, freq)
@@ -161,11 +1177,27 @@ def bar_line_chart(x1, y1, name1, x2, y2, name2):
     # y = numerical variable on x-axis (string)
     # color = categorical variable for color segments (string)
 def stacked_bar_chart(df, x, y, color):
+    aggregated_df = stacked_bar_data(df, x, y, color)
+    
+    fig = px.bar(
+        aggregated_df,
+        x=y,
+        y=x,
+        color=color,
+        orientation="h",
+    )
+    
+    return fig
+
+# Returns the sums stacked_bar_chart draws: one row per (x, color) pair of the top 5 x values by total
+    # x, y, color = see stacked_bar_chart (string)
+    # x is an ordered categorical listing the top value last, pairs absent from the data sum to 0
+def stacked_bar_data(df, x, y, color):
     df_copy = df.copy()
 
     first_agg = (
         df_copy
-        .groupby([x], as_index=False, observed=False)
+        .groupby([x], as_index=False, observed=True)
         .agg({y:'sum'})
         .sort_values(by=y, ascending=False)
         .head(5)
@@ -183,60 +1215,323 @@ def stacked_bar_chart(df, x, y, color):
         ordered=True
     )
 
+    # only segment by the values that are actually present after filtering
+    if isinstance(df_only_top_5_x[color].dtype, pd.CategoricalDtype):
+        df_only_top_5_x[color] = df_only_top_5_x[color].cat.remove_unused_categories()
+
+    # every (x, color) pair is kept, with reset_index as as_index=False fails on pairs absent from the data
     aggregated_df = (
         df_only_top_5_x
-        .groupby([x, color], as_index=False, observed=False)
-        .agg({y:'sum'})
-    )
-    
-    fig = px.bar(
-        aggregated_df,
-        x=y,
-        y=x,
-        color=color,
-        orientation="h",
+        .groupby([x, color], observed=False)[y]
+        .sum()
+        .reset_index()
     )
-    
-    return fig
+
+    return aggregated_df
+
+# pd.Timestamp("1970-01-01").toordinal(), the offset between numpy day counts and python ordinals
+UNIX_EPOCH_ORDINAL = 719163
+
+# default maximum number of points sent to the browser by scatterplot_with_line
+SCATTER_POINT_BUDGET = 20_000
+
+# above this many points the scatter plot is drawn with WebGL (Scattergl) instead of SVG
+WEBGL_THRESHOLD = 5_000
+
+# Returns the dates as day ordinals, equal to pd.Timestamp.toordinal but computed on the whole column
+    # dates = datetime64 column (panda Series)
+def date_ordinals(dates):
+    return np.asarray(dates).astype("datetime64[D]").astype("int64") + UNIX_EPOCH_ORDINAL
+
+# Returns how many points of each colour group to keep, at most budget in total
+    # sizes = number of points in each group (numpy array)
+    # budget = points to share out (int)
+    # every group gets one point out of the budget, the rest of it is shared in proportion to the group sizes;
+    # with more groups than points, the largest groups get one point each
+def group_quotas(sizes, budget):
+    sizes = np.asarray(sizes, dtype="int64")
+    budget = max(int(budget), 0)
+    if budget >= len(sizes):
+        return 1 + np.floor(sizes * (budget - len(sizes)) / max(sizes.sum(), 1)).astype("int64")
+    quota = np.zeros(len(sizes), dtype="int64")
+    quota[np.argsort(-sizes, kind="stable")[:budget]] = 1
+    return quota
+
+# Returns the sorted positions of the points to plot so that at most max_points are kept
+    # x, y = numerical variables (numpy array)
+    # color = categorical variable for color segments, or None (numpy array)
+    # max_points = point budget (int)
+    # slope, intercept = best fit line (float)
+    # highlight = positions of points that are always kept, e.g. the top scored outliers (numpy array)
+    # up to half of the budget keeps the largest residuals above the best fit line (the potential anomalies),
+    # or the highlighted points when given, the rest is a random sample stratified by color group so every
+    # group keeps its share of points
+def downsample_scatter(x, y, color, max_points, slope, intercept, seed=0, highlight=None):
+    n = len(y)
+    if max_points is None or n <= max_points:
+        return np.arange(n)
+
+    keep = np.zeros(n, dtype=bool)
+
+    if highlight is not None:
+        keep[highlight[:max_points]] = True
+        n_top = int(keep.sum())
+    else:
+        residual = y - (slope * x + intercept)
+        above = np.flatnonzero(residual > 0)
+        n_top = min(len(above), max_points // 2)
+        if n_top:
+            keep[above[np.argpartition(-residual[above], n_top - 1)[:n_top]]] = True
+
+    rest = np.flatnonzero(~keep)
+    n_rest = max_points - n_top
+
+    if color is None:
+        codes = np.zeros(len(rest), dtype="int64")
+    else:
+        codes = pd.factorize(color[rest])[0]
+
+    sizes = np.bincount(codes)
+    quota = group_quotas(sizes, n_rest)
+
+    rng = np.random.default_rng(seed)
+    order = np.lexsort((rng.random(len(rest)), codes))
+    group_start = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    rank = np.arange(len(rest)) - group_start[codes[order]]
+    keep[rest[order[rank < quota[codes[order]]]]] = True
+
+    return np.flatnonzero(keep)
 
 # Returns a scatterplot with a linear regression best fit line
     # x = numerical variable on x-axis (list)
     # y = numerical variable on y-axis (list)
     # color = categorical variable for color segments (list)
-def scatterplot_with_line(x, y, color=None):
-    fig = px.scatter(
-        x=x,
-        y=y,
-        color=color
+    # max_points = most points sent to the browser, None keeps every point (int)
+    # webgl_threshold = switch to WebGL rendering above this many plotted points (int)
+    # fit = (slope, intercept) computed elsewhere, e.g. by the sql backend on every row, when x and y are a sample (tuple)
+    # x_range = (min, max) of x over every row, used for the best fit line when x and y are a sample (tuple)
+    # without points and without a fit, e.g. when no transaction matches the filters, no line is drawn
+    # highlight = positions of points drawn on top as "Top Outliers", e.g. from outliers.top_positions (numpy array)
+    # highlight_only = only draw the highlighted points and the line (bool)
+def scatterplot_with_line(x, y, color=None, max_points=SCATTER_POINT_BUDGET, webgl_threshold=WEBGL_THRESHOLD,
+                          fit=None, x_range=None, highlight=None, highlight_only=False):
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    color = None if color is None else np.asarray(color, dtype=object)
+
+    # compute regression line on every point, before downsampling
+    if fit is not None:
+        slope, intercept = fit
+    elif len(x):
+        slope, intercept = np.polyfit(x, y, 1)
+    else:
+        slope, intercept = None, None
+
+    if highlight is not None:
+        highlight = np.asarray(highlight, dtype="int64")
+    plotted = downsample_scatter(x, y, color, max_points, slope, intercept, highlight=highlight)
+    if highlight is not None:
+        plotted = highlight[:0] if highlight_only else np.setdiff1d(plotted, highlight)
+
+    # plotly express cannot draw an empty scatter, the highlighted points and the line are drawn on their own
+    fig = go.Figure() if not len(plotted) else px.scatter(
+        x=x[plotted],
+        y=y[plotted],
+        color=None if color is None else color[plotted],
+        render_mode="webgl" if len(plotted) > webgl_threshold else "svg"
     )
 
-    # compute regression line
-    coeffs = np.polyfit(x, y, 1)
-    slope, intercept = coeffs
-    best_fit_line = slope * np.array(x) + intercept
+    if slope is not None:
+        # a straight line only needs its two end points
+        line_x = np.array(x_range if x_range is not None else [x.min(), x.max()], dtype="float64")
+        best_fit_line = slope * line_x + intercept
 
-    fig.add_trace(go.Scatter(
-        x=x,
-        y=best_fit_line,
-        mode='lines',
-        line=dict(color='#E54E04', width=2),
-        name='Best Fit Line'
-    ))
+        fig.add_trace(go.Scatter(
+            x=line_x,
+            y=best_fit_line,
+            mode='lines',
+            line=dict(color='#E54E04', width=2),
+            name='Best Fit Line'
+        ))
+
+    if highlight is not None:
+        fig.add_trace(go.Scatter(
+            x=x[highlight],
+            y=y[highlight],
+            mode='markers',
+            marker=dict(color='#E54E04', size=9, symbol='circle-open', line=dict(width=2)),
+            name='Top Outliers'
+        ))
 
     return fig
 
-# Returns a histogram plotly figure from a given dataframe
+# upper bound on the number of histogram bins, whatever rule picks the bin count
+MAX_HISTOGRAM_BINS = 100
+
+# Returns the linear-interpolated percentiles of weighted values, equal to np.percentile on the expanded values
+    # values = sorted distinct values (numpy array)
+    # weights = number of occurrences of each value (numpy array)
+    # q = percentiles between 0 and 100 (list)
+def weighted_percentile(values, weights, q):
+    cumulative = np.cumsum(weights)
+    virtual = (cumulative[-1] - 1) * (np.asarray(q, dtype="float64") / 100)
+    previous = np.floor(virtual)
+    following = np.minimum(previous + 1, cumulative[-1] - 1)
+    gamma = virtual - previous
+
+    a = values[np.searchsorted(cumulative, previous, side="right")]
+    b = values[np.searchsorted(cumulative, following, side="right")]
+
+    # same two-sided interpolation as numpy, so both paths return identical bins
+    diff = b - a
+    return np.where(gamma >= 0.5, b - diff * (1 - gamma), a + diff * gamma)
+
+# Returns histogram bin edges and counts computed on the server
+    # values = amounts (numpy array or panda Series)
+    # bins = "fd" (Freedman-Diaconis), "sturges" or a fixed number of bins (string or int)
+    # log_scale = bin log10 of the amounts, only positive amounts are kept (bool)
+    # weights = occurrences of each value when values are pre-aggregated distinct amounts (numpy array)
+    # returns (edges, counts) as numpy arrays, edges in the original units
+def histogram_bins(values, bins="fd", log_scale=False, max_bins=MAX_HISTOGRAM_BINS, weights=None):
+    values = np.asarray(values, dtype="float64")
+    weights = None if weights is None else np.asarray(weights, dtype="int64")
+
+    keep = np.isfinite(values)
+    if log_scale:
+        keep &= values > 0
+    values = values[keep]
+    weights = None if weights is None else weights[keep]
+    if log_scale:
+        values = np.log10(values)
+
+    n_values = len(values) if weights is None else int(weights.sum())
+    if n_values == 0:
+        # a single empty bin, with edges a log scale can place
+        return (np.array([1.0, 10.0]) if log_scale else np.array([0.0, 1.0])), np.array([0])
+
+    value_range = values.max() - values.min()
+    if isinstance(bins, (int, np.integer)):
+        n_bins = int(bins)
+    elif bins == "sturges":
+        n_bins = int(np.ceil(np.log2(n_values))) + 1
+    else:
+        if weights is None:
+            q25, q75 = np.percentile(values, [25, 75])
+        else:
+            q25, q75 = weighted_percentile(values, weights, [25, 75])
+        width = 2 * (q75 - q25) / n_values ** (1 / 3)
+        n_bins = int(np.ceil(value_range / width)) if width > 0 else 1
+    n_bins = min(max(n_bins, 1), max_bins)
+
+    counts, edges = np.histogram(values, bins=n_bins, weights=weights)
+    counts = counts.astype("int64")
+    if log_scale:
+        edges = 10 ** edges
+
+    return edges, counts
+
+# Returns a histogram plotly figure from a given dataframe, binned on the server
     # df = DataFrame to be visualized as histogram (panda DataFrame)
     # x = column name for x-axis (string)
-def histogram(df, x):
-    fig = px.histogram(
-        df,
-        x=x,
-        text_auto=True
-    )
+    # bins, log_scale = see histogram_bins
+    # binned = pre-computed (edges, counts), skips binning df (tuple)
+    # only the bin edges and counts are sent to the browser, hover shows the range as customdata
+def histogram(df, x, bins="fd", log_scale=False, binned=None):
+    edges, counts = binned if binned is not None else histogram_bins(df[x], bins=bins, log_scale=log_scale)
+    edges = np.asarray(edges, dtype="float64")
+
+    # edges of zero or below have no log, e.g. linear edges of an empty selection: the figure is left empty
+    if log_scale and (edges <= 0).any():
+        fig = go.Figure(go.Bar(x=[], y=[]))
+        fig.update_layout(bargap=0)
+        return fig
+
+    # on a log scale the bars are placed in log10 units so they keep equal widths
+    positions = np.log10(edges) if log_scale else edges
+
+    fig = go.Figure(go.Bar(
+        x=(positions[:-1] + positions[1:]) / 2,
+        y=counts,
+        width=np.diff(positions),
+        text=counts,
+        customdata=np.column_stack([edges[:-1], edges[1:]]),
+    ))
+
+    if log_scale:
+        powers = np.arange(np.floor(positions[0]), np.ceil(positions[-1]) + 1)
+        fig.update_xaxes(tickvals=powers, ticktext=[f"{10 ** p:,g}" for p in powers])
+
+    fig.update_layout(bargap=0)
 
     return fig
 
+# time buckets a heatmap axis can use instead of a dimension column, with their numpy datetime unit
+# (weeks are computed from days so that they start on Monday, numpy weeks start on Thursday)
+HEATMAP_TIME_BUCKETS = {"day": "D", "week": "D", "month": "M", "year": "Y"}
+
+# Returns the integer code of every row on one heatmap axis, and the label of every code
+    # df = cube from build_cube, or transactions (panda DataFrame)
+    # dimension = dimension column, or a key of HEATMAP_TIME_BUCKETS (string)
+    # time buckets get one code per bucket between the first and the last date, dimension columns one per value,
+    # rows with a missing value get -1
+def heatmap_axis(df, dimension):
+    if dimension in HEATMAP_TIME_BUCKETS:
+        unit = HEATMAP_TIME_BUCKETS[dimension]
+        buckets = np.asarray(df["Date"]).astype(f"datetime64[{unit}]").astype("int64")
+        step = 1
+        if dimension == "week":
+            # 1970-01-01 was a Thursday, (days + 3) % 7 is the weekday with Monday = 0
+            buckets = buckets - (buckets + 3) % 7
+            step = 7
+        if not len(buckets):
+            return buckets, pd.DatetimeIndex([], name=dimension.capitalize())
+        first = buckets.min()
+        labels = np.arange(first, buckets.max() + 1, step).astype(f"datetime64[{unit}]").astype("datetime64[ns]")
+        return (buckets - first) // step, pd.DatetimeIndex(labels, name=dimension.capitalize())
+
+    values = df[dimension]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.cat.codes.to_numpy().astype("int64"), pd.Index(values.cat.categories, name=dimension)
+    codes, labels = pd.factorize(values, sort=True)
+    return codes, pd.Index(labels, name=dimension)
+
+# Returns the number of transactions and total amount of the top rows of a heatmap, counted in one pass
+    # df = cube from build_cube, usually after filter_data, or transactions with amount_cents (panda DataFrame)
+    # rows = dimension on the heatmap rows, a dimension column or a time bucket, see heatmap_axis (string)
+    # columns = dimension on the heatmap columns, e.g. "month", "week" or "category" (string)
+    # top_n = number of rows kept, None keeps every row with transactions (int)
+    # rank_by = "count" or "amount", the row total the top rows are chosen by (string)
+    # returns two panda DataFrames (rows x columns) for heatmap, counts then amounts, top row first;
+    # rows and columns without any transaction are left out
+def heatmap_matrices(df, rows="merchant", columns="month", top_n=10, rank_by="count"):
+    row_codes, row_labels = heatmap_axis(df, rows)
+    col_codes, col_labels = heatmap_axis(df, columns)
+
+    counts = df["count"].to_numpy() if "count" in df else np.ones(len(df))
+    amounts = df["amount"].to_numpy() if "amount" in df else df["amount_cents"].to_numpy() / 100
+
+    # counts and amounts of every (row, column) cell from the same flat cell index
+    valid = (row_codes >= 0) & (col_codes >= 0)
+    cells = row_codes[valid] * len(col_labels) + col_codes[valid]
+    size = len(row_labels) * len(col_labels)
+    shape = (len(row_labels), len(col_labels))
+    count_matrix = np.bincount(cells, weights=counts[valid], minlength=size).reshape(shape)
+    amount_matrix = np.bincount(cells, weights=amounts[valid], minlength=size).reshape(shape)
+
+    # top rows by total without sorting every row: argpartition, then sort the kept ones (ties by label order)
+    totals = (count_matrix if rank_by == "count" else amount_matrix).sum(axis=1)
+    candidates = np.flatnonzero(count_matrix.sum(axis=1) > 0)
+    if top_n is not None and len(candidates) > top_n:
+        candidates = candidates[np.argpartition(-totals[candidates], top_n - 1)[:top_n]]
+    top = candidates[np.lexsort((candidates, -totals[candidates]))]
+
+    kept_columns = np.flatnonzero(count_matrix[top].sum(axis=0) > 0)
+    index, header = row_labels[top], col_labels[kept_columns]
+
+    count_data = pd.DataFrame(count_matrix[np.ix_(top, kept_columns)].round().astype("int64"), index=index, columns=header)
+    amount_data = pd.DataFrame(amount_matrix[np.ix_(top, kept_columns)].round(2), index=index, columns=header)
+    return count_data, amount_data
+
 # Returns a heatmap figure from a given dataframe
     # df = DataFrame to be visualized as heatmap (panda DataFrame)
 def heatmap(df):
@@ -276,4 +1571,133 @@ def dual_bar_chart(x1, y1, name1, x2, y2, name2):
         opacity=0.6
     ))
 
-    return fig
\ No newline at end of file
+    return fig
+
+## FIGURE CACHE FUNCTIONS ##
+
+# Returns a canonical hash of a filter spec: the date range plus the sorted selections
+    # spec = filter spec from make_filter_spec (dict)
+def filter_spec_hash(spec):
+    canonical = json.dumps(filter_spec_key(spec), separators=(",", ":"))
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+# Returns the cache key of one chart or aggregate
+    # name = chart or aggregate name (string)
+    # file_path = path to the source data, its source_version is part of the key (string)
+    # spec = filter spec from make_filter_spec (dict)
+    # params = the chart's own parameters, e.g. freq="W" (keyword arguments)
+def figure_key(name, file_path, spec, **params):
+    canonical = json.dumps(
+        [name, os.path.abspath(file_path), source_version(file_path),
+         filter_spec_hash(spec), sorted(params.items())],
+        separators=(",", ":"),
+        default=str
+    )
+    return hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+# Returns an estimate of the bytes held by a cached figure or aggregate
+    # value = plotly figure, DataFrame, numpy array, encoded response or a tuple/list of these
+def estimate_size(value):
+    if isinstance(value, go.Figure):
+        return len(value.to_json())
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, (np.ndarray, pd.Categorical)):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_size(item) for item in value)
+    if isinstance(value, dict):
+        return sum(estimate_size(item) for item in value.values())
+    return 64
+
+# Returns the estimated bytes held by each named object, largest first
+    # objects = {(name, scope): object}, scope says who holds it, e.g. "session" or "shared" (dict)
+def memory_usage(objects):
+    usage = pd.DataFrame(
+        [(name, scope, estimate_size(value)) for (name, scope), value in objects.items()],
+        columns=["object", "scope", "bytes"]
+    )
+    return usage.sort_values("bytes", ascending=False, kind="stable").reset_index(drop=True)
+
+# Bounded LRU cache of figures and aggregates with hit/miss counters, safe to share between sessions
+    # max_entries = most cached values (int)
+    # max_bytes = most estimated bytes held (int)
+    # ttl = seconds a value stays cached, None keeps it until evicted (float)
+    # cached values are shared, so callers must not modify them after get_or_build returns
+class FigureCache:
+    def __init__(self, max_entries=256, max_bytes=256 * 1024 * 1024, ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.bytes = 0
+
+    # Returns the cached value for key, calling builder() and caching its result on a miss
+        # key = key from figure_key (string)
+        # builder = function without arguments building the value (callable)
+    def get_or_build(self, key, builder):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] <= time.monotonic():
+                # an expired value is dropped and rebuilt like a miss
+                del self._entries[key]
+                self.bytes -= entry[1]
+                self.expirations += 1
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # build outside the lock so other sessions are not blocked by a slow chart
+        value = builder()
+        size = estimate_size(value)
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (value, size, expires)
+                self.bytes += size
+            self._evict()
+
+        return value
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self.bytes > self.max_bytes):
+            _, (_, size, _) = self._entries.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+
+    # Returns the counters and current size of the cache (dict)
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+# Returns the process-wide figure cache shared by every session
+@st.cache_resource
+def get_figure_cache():
+    return FigureCache()
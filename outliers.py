@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+
+import detection
+
+## BASELINE FUNCTIONS ##
+
+# every transaction is compared with the usual amounts of its merchant, its category and its account type
+SCORE_COLUMNS = ["merchant", "category", "account_type"]
+
+# groups with fewer transactions than this get no baseline, their transactions are scored on the other columns
+MIN_BASELINE_ROWS = 5
+
+# scales a median absolute deviation to the standard deviation of normally distributed amounts
+MAD_SCALE = 1.4826
+
+# the spread of a group never goes below one cent, so a change in a group of identical amounts (rent,
+# subscriptions) still gets a finite, very high score
+MIN_SCALE = 0.01
+
+# Returns the mean and standard deviation of the amounts of every group, from the sums of a cube
+    # cube = cube from fx.build_cube or sql_backend.query_cube, or any frame with the group column and the
+    # count, amount (sum) and amount_sq (sum of squares) columns (panda DataFrame)
+    # group_col = dimension column (string)
+    # the sums merge by addition, so these baselines follow the cube as appended rows are folded into it
+    # (fx.load_cube, streaming.current_aggregates) without reading the earlier rows again
+    # returns a panda DataFrame indexed by group with the columns count, center (mean) and scale (std)
+def moment_baselines(cube, group_col):
+    sums = cube.groupby(group_col, observed=True)[["count", "amount", "amount_sq"]].sum()
+    count = sums["count"].to_numpy(dtype="float64")
+    mean = sums["amount"].to_numpy() / count
+    # sum of squared deviations, never negative whatever the rounding of the sums
+    m2 = np.maximum(sums["amount_sq"].to_numpy() - count * mean * mean, 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        std = np.sqrt(m2 / (count - 1))
+
+    return pd.DataFrame({"count": count.astype("int64"), "center": mean, "scale": std}, index=sums.index)
+
+# Returns the median and scaled median absolute deviation of the amounts of every group
+    # df = transactions with amount_cents or amount and the group column (panda DataFrame)
+    # group_col = dimension column (string)
+    # every group's median comes from one sort of the rows by group and amount, and its MAD from a second sort
+    # by group and deviation, so all groups are done in two vectorized passes
+    # returns a panda DataFrame like moment_baselines, center being the median and scale MAD_SCALE * MAD
+def robust_baselines(df, group_col):
+    codes, labels = detection.group_codes(df, [group_col])
+    cents = detection.amount_cents(df)
+    valid = np.flatnonzero((codes >= 0) & (cents != detection.MISSING_CENTS))
+    codes, cents = codes[valid], cents[valid]
+
+    count = np.bincount(codes, minlength=len(labels[0]))
+    median = _group_medians(codes, cents, count)
+    # deviations are kept in half cents so the median of an even group stays an integer
+    deviation = np.abs(2 * cents - np.round(2 * np.nan_to_num(median)).astype("int64")[codes])
+    mad = _group_medians(codes, deviation, count) / 2
+
+    return pd.DataFrame(
+        {"count": count, "center": median / 100, "scale": MAD_SCALE * mad / 100},
+        index=labels[0]
+    )[count > 0]
+
+def _group_medians(codes, values, count):
+    ordered = values[detection.sort_order([codes, values])]
+    start = np.cumsum(count) - count
+    present = count > 0
+    medians = np.full(len(count), np.nan)
+    medians[present] = (ordered[(start + (count - 1) // 2)[present]] + ordered[(start + count // 2)[present]]) / 2
+    return medians
+
+# Returns the baselines used to score transactions, for every score column
+    # data = cube for the "moments" method, transactions for the "robust" method (panda DataFrame)
+    # method = "moments" (mean and standard deviation) or "robust" (median and MAD) (string)
+    # group_cols = dimension columns to compare each transaction with (list)
+    # groups with fewer than MIN_BASELINE_ROWS transactions are left out and spreads are at least MIN_SCALE
+    # returns {column: panda DataFrame indexed by group with count, center and scale}
+def group_baselines(data, method="moments", group_cols=SCORE_COLUMNS):
+    build = {"moments": moment_baselines, "robust": robust_baselines}[method]
+    baselines = {}
+    for col in group_cols:
+        base = build(data, col)
+        base = base[base["count"] >= MIN_BASELINE_ROWS].copy()
+        base["scale"] = np.fmax(base["scale"].to_numpy(), MIN_SCALE)
+        baselines[col] = base
+    return baselines
+
+## SCORING FUNCTIONS ##
+
+# Returns the position of every value in a baseline index, -1 for values without a baseline
+    # index = baseline index (pd.Index)
+    # values = group of every transaction (pd.Categorical, Series or array)
+    # categoricals are matched once per category instead of once per row
+def baseline_positions(index, values):
+    if isinstance(values, pd.Series):
+        values = values.array
+    if isinstance(values, pd.Categorical):
+        by_category = np.append(index.get_indexer(values.categories), -1)
+        return by_category[values.codes]
+    return index.get_indexer(np.asarray(values, dtype=object))
+
+# Returns the outlier score of every transaction: how many spreads its amount is above the baseline of its
+# merchant, category or account type, the highest of the three
+    # amounts = amounts in dollars (numpy array)
+    # groups = {column: group of every transaction} for the columns of the baselines (dict)
+    # baselines = output of group_baselines (dict)
+    # amounts below their baselines score negative, transactions without any baseline score nan
+def score_amounts(amounts, groups, baselines):
+    amounts = np.asarray(amounts, dtype="float64")
+    scores = np.full(len(amounts), np.nan)
+    for col, base in baselines.items():
+        positions = baseline_positions(base.index, groups[col])
+        center = np.append(base["center"].to_numpy(), np.nan)[positions]
+        scale = np.append(base["scale"].to_numpy(), np.nan)[positions]
+        scores = np.fmax(scores, (amounts - center) / scale)
+    return scores
+
+# Returns the positions of the k highest scores, highest first, ignoring nan scores
+    # scores = output of score_amounts (numpy array)
+    # k = number of positions (int)
+def top_positions(scores, k):
+    scores = np.nan_to_num(np.asarray(scores, dtype="float64"), nan=-np.inf)
+    k = min(k, int(np.isfinite(scores).sum()))
+    if k <= 0:
+        return np.zeros(0, dtype="int64")
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
@@ -0,0 +1,206 @@
+import contextlib
+import functools
+import inspect
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+## PROFILING FUNCTIONS ##
+
+# profiling is opt-in (DASHBOARD_PROFILE=1): when it is off nothing is wrapped, stage() returns a shared no-op
+# context and plotly_chart calls st.plotly_chart directly, so the dashboard runs the same code as without it
+ENABLED = os.environ.get("DASHBOARD_PROFILE", "") not in ("", "0")
+
+# stage records kept in each session's rolling log
+LOG_RECORDS = 5_000
+
+# calls nested deeper than this inside an instrumented function are not recorded (helpers called in loops)
+MAX_DEPTH = 4
+
+LOG_COLUMNS = ["rerun", "started", "stage", "kind", "depth", "seconds", "rows", "bytes"]
+
+_NO_OP = contextlib.nullcontext()
+_INSTRUMENTED = set()
+_instrument_lock = threading.Lock()
+
+# Records the stages of one session: the rerun counter, the stages still running and the rolling log
+class Profiler:
+    def __init__(self, max_records=LOG_RECORDS):
+        self.rerun = 0
+        self.log = deque(maxlen=max_records)
+        self._open = []
+
+    def start_rerun(self):
+        self.rerun += 1
+        self._open.clear()
+
+    # Records one stage
+        # name = stage name, e.g. "functions.filter_data" (string)
+        # kind = "section", "function" or "chart" (string)
+        # started = time.perf_counter() when the stage started (float)
+        # rows, bytes = size of the stage's output, None when it has none (int)
+    def record(self, name, kind, started, rows=None, bytes=None):
+        self.log.append({
+            "rerun": self.rerun,
+            "started": time.time() - (time.perf_counter() - started),
+            "stage": name,
+            "kind": kind,
+            "depth": len(self._open),
+            "seconds": time.perf_counter() - started,
+            "rows": rows,
+            "bytes": bytes,
+        })
+
+    # Returns the log as a panda DataFrame, in the order the stages started
+        # rerun = only keep the stages of this rerun, None keeps the whole log (int)
+    def frame(self, rerun=None):
+        log = pd.DataFrame(list(self.log), columns=LOG_COLUMNS)
+        if rerun is not None:
+            log = log[log["rerun"] == rerun]
+        return log.sort_values("started", kind="stable").reset_index(drop=True)
+
+# Returns the profiler of the session running this script, None when profiling is off or outside of a script run
+# (e.g. in the worker threads reading partitions)
+def current_profiler():
+    if not ENABLED or get_script_run_ctx(suppress_warning=True) is None:
+        return None
+    if "profiler" not in st.session_state:
+        st.session_state["profiler"] = Profiler()
+    return st.session_state["profiler"]
+
+# Starts a new rerun in the session's log, called once at the top of the script
+def start_rerun():
+    profiler = current_profiler()
+    if profiler is not None:
+        profiler.start_rerun()
+
+# Returns the number of rows and bytes of a stage's output, (None, None) for other values
+    # value = returned value (any)
+def output_size(value):
+    if isinstance(value, pd.DataFrame):
+        return len(value), int(value.memory_usage(index=False).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return len(value), int(value.memory_usage(index=False) if isinstance(value, pd.Series) else value.nbytes)
+    if isinstance(value, np.ndarray):
+        return len(value) if value.ndim else 1, value.nbytes
+    if isinstance(value, tuple) and value and isinstance(value[0], (pd.DataFrame, np.ndarray)):
+        return output_size(value[0])
+    return None, None
+
+@contextlib.contextmanager
+def _recorded_stage(profiler, name, kind, rows):
+    started = time.perf_counter()
+    profiler._open.append(name)
+    try:
+        yield
+    finally:
+        profiler._open.pop()
+        profiler.record(name, kind, started, rows=rows)
+
+# Returns a context manager timing the code inside it as one stage of the current rerun
+    # name = stage name (string)
+    # kind = "section" for parts of app.py (string)
+    # rows = number of rows the stage works on, if known (int)
+def stage(name, kind="section", rows=None):
+    profiler = current_profiler()
+    if profiler is None:
+        return _NO_OP
+    return _recorded_stage(profiler, name, kind, rows)
+
+# Decorates an app.py section so every run of it, fragment reruns included, is recorded as one stage
+    # func = section function (callable)
+    # returns func itself when profiling is off
+def section(func):
+    if not ENABLED:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with stage(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+def _wrap_function(name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = current_profiler()
+        if profiler is None or len(profiler._open) >= MAX_DEPTH:
+            return func(*args, **kwargs)
+
+        started = time.perf_counter()
+        profiler._open.append(name)
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            profiler._open.pop()
+        rows, size = output_size(result)
+        profiler.record(name, "function", started, rows=rows, bytes=size)
+        return result
+
+    wrapper.__profiled__ = True
+    return wrapper
+
+# Replaces the public functions of the given modules and classes with wrappers recording each call, once per process
+    # targets = modules or classes to instrument, e.g. functions and functions.FigureCache (modules / classes)
+    # st.cache_data / st.cache_resource functions are wrapped too, so their time covers cache hits and misses;
+    # a module's own calls between its functions go through the wrappers as well
+def instrument(*targets):
+    if not ENABLED:
+        return
+
+    with _instrument_lock:
+        for target in targets:
+            owner = target.__module__ if inspect.isclass(target) else target.__name__
+            label = f"{owner}.{target.__name__}" if inspect.isclass(target) else owner
+            if label in _INSTRUMENTED:
+                continue
+            for name, value in list(vars(target).items()):
+                if name.startswith("_") or getattr(value, "__profiled__", False):
+                    continue
+                # cached functions keep the __module__ of the function they wrap, imported functions and classes are skipped
+                if callable(value) and not inspect.isclass(value) and getattr(value, "__module__", None) == owner:
+                    setattr(target, name, _wrap_function(f"{label}.{name}", value))
+            _INSTRUMENTED.add(label)
+
+# Shows a plotly figure like st.plotly_chart, recording the size of its JSON payload and the time to send it
+    # fig = figure to show (go.Figure)
+    # name = chart name in the log (string)
+    # kwargs = passed on to st.plotly_chart
+def plotly_chart(fig, name="chart", **kwargs):
+    profiler = current_profiler()
+    if profiler is None:
+        return st.plotly_chart(fig, **kwargs)
+
+    # streamlit serializes the figure again, the payload is measured on a separate serialization
+    started = time.perf_counter()
+    payload = fig.to_json() if isinstance(fig, go.Figure) else ""
+    points = sum(len(trace.x) for trace in fig.data if getattr(trace, "x", None) is not None)
+    profiler.record(f"serialize {name}", "chart", started, rows=points, bytes=len(payload))
+
+    with stage(f"st.plotly_chart {name}", kind="chart"):
+        return st.plotly_chart(fig, **kwargs)
+
+# Returns the stages of the session's latest rerun, with each stage's share of the rerun's top-level time
+    # min_seconds = function calls faster than this are left out, sections and charts are always kept (float)
+def rerun_breakdown(min_seconds=0.001):
+    profiler = current_profiler()
+    if profiler is None:
+        return pd.DataFrame(columns=LOG_COLUMNS + ["share"])
+
+    breakdown = profiler.frame(profiler.rerun)
+    total = breakdown.loc[breakdown["depth"] == 0, "seconds"].sum()
+    breakdown["share"] = breakdown["seconds"] / total if total else np.nan
+    keep = (breakdown["kind"] != "function") | (breakdown["seconds"] >= min_seconds)
+    return breakdown[keep].reset_index(drop=True)
+
+# Returns the session's rolling log of every recorded stage
+def log_frame():
+    profiler = current_profiler()
+    return profiler.frame() if profiler is not None else pd.DataFrame(columns=LOG_COLUMNS)
@@ -0,0 +1,239 @@
+"""Render the dashboard's charts for a list of filter specs to standalone HTML and JSON files, without streamlit.
+
+Run from the project root:
+    python report.py --per account_type --output reports
+    python report.py --specs specs.json --output reports --workers 4
+
+A specs file is a JSON list of reports, each with a name and any of the sidebar filters, e.g.
+    [{"name": "travel-2024", "date_range": ["2024-01-01", "2024-12-31"], "category": ["Travel", "Dining"]}]
+"""
+import argparse
+import html
+import json
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+import streamlit.config
+import streamlit.logger
+
+# no streamlit server runs the reports, the cached functions would log "No runtime found" warnings from their
+# import on; the config is read first, otherwise reading it later resets the log level
+streamlit.config.get_option("logger.level")
+streamlit.logger.set_log_level("error")
+
+import benford  # noqa: E402
+import charts  # noqa: E402
+import functions as fx  # noqa: E402
+
+## REPORT FUNCTIONS ##
+
+# filters a report can set, as in the dashboard sidebar
+SPEC_FIELDS = ["date_range"] + fx.DIMENSION_COLUMNS
+
+REPORT_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>{title}</title></head>
+<body style="font-family: sans-serif">
+<h1>{title}</h1>
+<p>{summary}</p>
+{body}
+</body>
+</html>
+"""
+
+# the dataset and its cube, set once in every worker process by init_worker
+_dataset = {}
+
+# Returns the reports of a specs file as (name, filter spec) pairs
+    # path = path to a JSON list of objects with a name and SPEC_FIELDS (string)
+def load_specs(path):
+    with open(path) as f:
+        entries = json.load(f)
+
+    specs = []
+    for i, entry in enumerate(entries):
+        unknown = set(entry) - set(SPEC_FIELDS) - {"name"}
+        if unknown:
+            raise ValueError(f"report {i} in {path} has unknown fields: {', '.join(sorted(unknown))}")
+        spec = fx.make_filter_spec(entry.get("date_range"), *[entry.get(col) for col in fx.DIMENSION_COLUMNS])
+        specs.append((entry.get("name", f"report-{i + 1}"), spec))
+    return specs
+
+# Returns one report per value of a dimension column, each narrowing the base spec to that value
+    # cube = cube of the dataset, whose categories give the values (panda DataFrame)
+    # column = dimension column, e.g. "account_type" (string)
+    # base = (name, spec) the reports start from, None for the whole dataset (tuple)
+def per_value_specs(cube, column, base=None):
+    base_name, base_spec = base or ("", fx.make_filter_spec())
+    values = [value for value in cube[column].cat.categories
+              if not base_spec[column] or value in base_spec[column]]
+    return [(f"{base_name}-{value}" if base_name else str(value), {**base_spec, column: [value]}) for value in values]
+
+# Returns a file and folder name for a report name
+    # name = report name (string)
+def safe_name(name):
+    return re.sub(r"[^\w.-]+", "_", str(name)).strip("_") or "report"
+
+# Returns the number of CPUs this process may run on, the default number of workers
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+# Loads the dataset in a worker process: a single csv is memory-mapped from the columnar cache written by the
+# parent, so every worker shares the same pages instead of parsing the file again
+    # file_path = path to the source data (string)
+    # cube = cube built once by the parent (panda DataFrame)
+def init_worker(file_path, cube):
+    _dataset["df"] = fx.read_and_clean_data(file_path)
+    _dataset["cube"] = cube
+
+# Returns the figures and tables of one report, with the dashboard's default chart settings
+    # df = transactions from read_and_clean_data (panda DataFrame)
+    # cube = cube of the transactions (panda DataFrame)
+    # spec = filter spec from fx.make_filter_spec (dict)
+    # returns (metrics dict, {figure name: go.Figure}, {table name: panda DataFrame})
+def report_contents(df, cube, spec):
+    filtered_cube = fx.filter_data(cube, spec)
+    total, mean, count = fx.cube_metrics(filtered_cube)
+    metrics = {"transactions": count, "total_amount": round(float(total), 2),
+               "mean_amount": None if np.isnan(mean) else round(float(mean), 2)}
+    if not count:
+        return metrics, {}, {}
+
+    positions = fx.filter_positions(df, spec)
+    amounts = fx.filtered_column(df, positions, "amount")
+    dates = fx.filtered_column(df, positions, "Date")
+
+    # the date range is applied on the daily prefix sums, as the dashboard does
+    dimension_spec = {**spec, "date_range": None}
+    daily_totals = fx.range_daily_totals(fx.build_prefix_index(fx.filter_data(cube, dimension_spec)), spec["date_range"])
+
+    scatter_fig = fx.scatterplot_with_line(x=fx.date_ordinals(dates), y=amounts,
+                                           color=fx.filtered_column(df, positions, "category"))
+    heatmap_count, heatmap_amount = fx.heatmap_matrices(filtered_cube)
+
+    first_digits = benford.first_digit(amounts[amounts >= 1])
+    observed_values = benford.digit_counts(first_digits)[0].tolist()
+
+    figures = {
+        "transactions_over_time": charts.overall_figure(daily_totals),
+        "by_day_of_week": charts.weekday_figure(filtered_cube),
+        "spending_by_category": charts.stacked_bar_figure(filtered_cube),
+        "distribution": charts.histogram_figure(fx.histogram_bins(amounts)),
+        "scatter": charts.style_scatter(scatter_fig, pd.Timestamp(dates.min()), pd.Timestamp(dates.max())),
+        "heatmap_count": charts.heatmap_figure(heatmap_count, value="count"),
+        "heatmap_amount": charts.heatmap_figure(heatmap_amount, value="amount"),
+        "benford": charts.benford_figure(observed_values, 0, 0),
+    }
+
+    by_merchant = pd.DataFrame({"merchant": fx.filtered_column(df, positions, "merchant"), "amount": amounts})
+    tables = {"benford_ranking": benford.benford_by_group(by_merchant[by_merchant["amount"] >= 1], "merchant", min_count=30)}
+
+    return metrics, figures, tables
+
+# Renders one report to its own folder: report.html with every figure and table, one JSON file per figure
+# and summary.json with the spec, metrics and tables
+    # name = report name (string)
+    # spec = filter spec from fx.make_filter_spec (dict)
+    # output_dir = folder the report folders are written to (string)
+    # plotlyjs = "inline" embeds plotly.js so the html opens offline, "cdn" links to it (string)
+    # returns the name, folder, metrics and time taken of the report (dict)
+def render_report(name, spec, output_dir, plotlyjs="inline"):
+    started = time.perf_counter()
+    metrics, figures, tables = report_contents(_dataset["df"], _dataset["cube"], spec)
+
+    report_dir = os.path.join(output_dir, safe_name(name))
+    os.makedirs(report_dir, exist_ok=True)
+
+    body = []
+    for i, (figure_name, fig) in enumerate(figures.items()):
+        with open(os.path.join(report_dir, f"{figure_name}.json"), "w") as f:
+            f.write(fig.to_json())
+        # plotly.js is included once, with the first figure
+        include = (True if plotlyjs == "inline" else "cdn") if i == 0 else False
+        body.append(fig.to_html(full_html=False, include_plotlyjs=include))
+    for table_name, table in tables.items():
+        body.append(f"<h2>{html.escape(table_name.replace('_', ' ').title())}</h2>")
+        body.append(table.to_html(index=False, float_format="%.4f", border=0))
+
+    if metrics["transactions"]:
+        summary = (f"{metrics['transactions']:,} transactions, total ${metrics['total_amount']:,.2f}, "
+                   f"average ${metrics['mean_amount']:,.2f}")
+    else:
+        summary = "No transactions match the filters."
+    with open(os.path.join(report_dir, "report.html"), "w") as f:
+        f.write(REPORT_TEMPLATE.format(title=html.escape(str(name)), summary=summary, body="\n".join(body)))
+
+    with open(os.path.join(report_dir, "summary.json"), "w") as f:
+        json.dump({"name": name, "spec": spec, **metrics, "figures": list(figures),
+                   **{table_name: table.to_dict(orient="records") for table_name, table in tables.items()}},
+                  f, indent=2, default=str)
+
+    return {"name": name, "path": report_dir, **metrics, "seconds": time.perf_counter() - started}
+
+# Renders every report, in parallel across a process pool with the dataset loaded once
+    # file_path = path to the source data (string)
+    # specs = (name, filter spec) pairs (list)
+    # output_dir = folder the report folders are written to (string)
+    # workers = number of processes, 1 renders in this process (int)
+    # plotlyjs = see render_report (string)
+    # cube = cube of the dataset, built here when not given (panda DataFrame)
+    # yields the result of every report as it finishes
+def render_reports(file_path, specs, output_dir, workers=None, plotlyjs="inline", cube=None):
+    # the parent parses the data once and writes the columnar cache the workers map
+    df = fx.read_and_clean_data(file_path)
+    cube = fx.build_cube(df) if cube is None else cube
+    workers = min(workers or available_cpus(), len(specs))
+
+    if workers <= 1:
+        _dataset.update(df=df, cube=cube)
+        for name, spec in specs:
+            yield render_report(name, spec, output_dir, plotlyjs)
+        return
+
+    # spawned workers start clean instead of forking the parent's arrow and pandas threads
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=init_worker, initargs=(file_path, cube)) as pool:
+        futures = [pool.submit(render_report, name, spec, output_dir, plotlyjs) for name, spec in specs]
+        for future in as_completed(futures):
+            yield future.result()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data", default=os.environ.get("DASHBOARD_DATA", "financial_transactions.csv"),
+                        help="csv, or directory or glob of partition files (default: $DASHBOARD_DATA)")
+    parser.add_argument("--specs", help="JSON file listing the reports and their filters")
+    parser.add_argument("--per", choices=fx.DIMENSION_COLUMNS,
+                        help="one report per value of this column (of every report in --specs, if given)")
+    parser.add_argument("--output", default="reports")
+    parser.add_argument("--workers", type=int, default=None, help="processes (default: one per available CPU, 1 renders in this process)")
+    parser.add_argument("--plotlyjs", choices=["inline", "cdn"], default="inline",
+                        help="embed plotly.js in every report (opens offline) or link to its CDN")
+    args = parser.parse_args()
+
+    specs = load_specs(args.specs) if args.specs else [("all", fx.make_filter_spec())]
+    cube = None
+    if args.per:
+        cube = fx.build_cube(fx.read_and_clean_data(args.data))
+        specs = [per for base in specs for per in per_value_specs(cube, args.per, base if args.specs else None)]
+
+    started = time.perf_counter()
+    results = []
+    for result in render_reports(args.data, specs, args.output, args.workers, args.plotlyjs, cube=cube):
+        results.append(result)
+        print(f"{result['name']:<40} {result['transactions']:>12,} transactions {result['seconds']:>8.2f} s")
+
+    os.makedirs(args.output, exist_ok=True)
+    with open(os.path.join(args.output, "reports.json"), "w") as f:
+        json.dump(sorted(results, key=lambda result: result["name"]), f, indent=2)
+    print(f"{len(results)} reports written to {args.output} in {time.perf_counter() - started:.1f} s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+import os
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+import functions as fx
+
+## AMOUNT SKETCH FUNCTIONS ##
+
+# the approximate mode reads the amount percentiles and distinct counts from a sketch of the transactions: the
+# number of transactions per month, dimension combination and amount bucket. Buckets are log-spaced so every
+# amount is within QUANTILE_ACCURACY of its bucket's centre (the relative error guarantee of a DDSketch), and
+# the sketches of any two sets of rows merge by adding their counts. A date range is answered to the day: its
+# whole months are read from the sketch and the days of the months it only partly covers are sketched from
+# the rows, found through a day order of the transactions
+
+# every percentile read from a sketch is within this fraction of the exact amount
+QUANTILE_ACCURACY = 0.01
+
+# ratio between the upper and lower bound of a bucket
+BUCKET_GAMMA = (1 + QUANTILE_ACCURACY) / (1 - QUANTILE_ACCURACY)
+
+# amounts closer to zero than this share bucket 0 with zero
+MIN_SKETCH_AMOUNT = 0.01
+
+SKETCH_KEYS = ["Date"] + fx.DIMENSION_COLUMNS + ["bucket"]
+
+# percentiles shown in the header, and the columns whose distinct values are counted
+QUANTILES = [0.5, 0.9, 0.99]
+DISTINCT_COLUMNS = ["merchant", "account_type"]
+
+# keys of a filtered sketch: all the percentiles, distribution and distinct counts need
+SUMMARY_KEYS = DISTINCT_COLUMNS + ["bucket"]
+
+# Returns the sketch bucket of each amount: 0 for zero, negative buckets for negative amounts
+    # amounts = amounts in dollars (numpy array)
+    # bucket i >= 1 holds the magnitudes in (MIN_SKETCH_AMOUNT * gamma^(i-2), MIN_SKETCH_AMOUNT * gamma^(i-1)]
+def amount_buckets(amounts):
+    amounts = np.asarray(amounts, dtype="float64")
+    magnitude = np.abs(amounts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        index = np.ceil(np.log(magnitude / MIN_SKETCH_AMOUNT) / np.log(BUCKET_GAMMA)) + 1
+    index = np.where(magnitude >= MIN_SKETCH_AMOUNT, np.maximum(index, 1), 0)
+    return (np.sign(amounts) * index).astype("int32")
+
+# Returns the amount each bucket stands for, within QUANTILE_ACCURACY of every amount in it
+    # buckets = sketch buckets (numpy array)
+def bucket_amounts(buckets):
+    buckets = np.asarray(buckets)
+    magnitude = MIN_SKETCH_AMOUNT * 2 * BUCKET_GAMMA ** (np.abs(buckets) - 1.0) / (BUCKET_GAMMA + 1)
+    return np.where(buckets == 0, 0.0, np.sign(buckets) * magnitude)
+
+# Returns the sketch of a set of transactions
+    # df = transactions with amount_cents or amount, the dimension columns as categoricals and, by month, Date
+    # (panda DataFrame)
+    # columns = dimension columns kept in the sketch (list)
+    # by_month = keep the month of the transactions (bool)
+    # the month, dimension codes and bucket of every row are packed into one integer key and counted, with
+    # np.bincount when the keys span few values and np.unique otherwise; rows with a missing dimension are left
+    # out as in build_cube
+    # returns a panda DataFrame with SKETCH_KEYS (Date being the month start) and count, or the kept keys only
+def build_sketch(df, columns=fx.DIMENSION_COLUMNS, by_month=True):
+    amounts = df["amount_cents"].to_numpy() / 100 if "amount_cents" in df else df["amount"].to_numpy()
+    codes = [df[col].cat.codes.to_numpy().astype("int64") for col in columns]
+    keys = codes + [amount_buckets(amounts).astype("int64")]
+    if by_month:
+        keys.insert(0, df["Date"].to_numpy().astype("datetime64[M]").astype("int64"))
+
+    # rows without an amount have no bucket
+    valid = ~np.isnan(amounts)
+    for col_codes in codes:
+        valid &= col_codes >= 0
+    if not valid.any():
+        return _empty_sketch(df, columns, by_month)
+
+    keys = [key[valid] for key in keys]
+    lows = [int(key.min()) for key in keys]
+    shape = [int(key.max()) - low + 1 for key, low in zip(keys, lows)]
+    packed = np.ravel_multi_index([key - low for key, low in zip(keys, lows)], shape)
+    if np.prod(shape, dtype="float64") <= max(4 * len(packed), 1 << 16):
+        counts = np.bincount(packed, minlength=int(np.prod(shape)))
+        packed = np.flatnonzero(counts)
+        counts = counts[packed]
+    else:
+        packed, counts = np.unique(packed, return_counts=True)
+
+    parts = [part + low for part, low in zip(np.unravel_index(packed, shape), lows)]
+    sketch = pd.DataFrame()
+    if by_month:
+        sketch["Date"] = parts.pop(0).astype("datetime64[M]").astype("datetime64[ns]")
+    for col, part in zip(columns, parts[:-1]):
+        sketch[col] = pd.Categorical.from_codes(part, dtype=df[col].dtype)
+    sketch["bucket"] = parts[-1].astype("int32")
+    sketch["count"] = counts.astype("int64")
+    return sketch
+
+def _empty_sketch(df, columns=fx.DIMENSION_COLUMNS, by_month=True):
+    sketch = pd.DataFrame()
+    if by_month:
+        sketch["Date"] = pd.Series(dtype="datetime64[ns]")
+    for col in columns:
+        sketch[col] = pd.Categorical([], dtype=df[col].dtype)
+    sketch["bucket"] = pd.Series(dtype="int32")
+    sketch["count"] = pd.Series(dtype="int64")
+    return sketch
+
+# Merges sketches of different rows, e.g. of the rows appended to a file, in any order
+    # sketches = outputs of build_sketch (list of panda DataFrames)
+    # keys = columns the counts are kept by, those of the sketches (list)
+def merge_sketches(sketches, keys=SKETCH_KEYS):
+    return (
+        fx.concat_categorical(sketches)
+        .groupby(keys, as_index=False, observed=True, sort=True)["count"]
+        .sum()
+    )
+
+@st.cache_resource
+def get_sketch_store():
+    return {}
+
+# Builds the sketch once per version of the data file, only sketching the appended rows when the previous
+# sketch was built from a prefix of the file, as fx.load_cube does
+    # file_path, version, partitions = see fx.load_cube
+    # returns a read-only sketch shared by every session
+@st.cache_resource(show_spinner=False, max_entries=2)
+def load_sketch(file_path, version=None, partitions=None):
+    df = fx.read_and_clean_data(file_path, version=version, partitions=partitions)
+    meta = df.attrs.get("ingest")
+    if meta is None:
+        return fx.make_read_only(build_sketch(df))
+
+    store = get_sketch_store()
+    previous = store.get(os.path.abspath(file_path))
+    if previous and previous["rows"] == len(df) and previous["content_hash"] == meta["content_hash"]:
+        sketch = previous["sketch"]
+    elif previous and fx.is_ingested_prefix(meta, previous["offset"], previous["content_hash"]):
+        sketch = merge_sketches([previous["sketch"], build_sketch(df.iloc[previous["rows"]:])])
+    else:
+        sketch = build_sketch(df)
+
+    store[os.path.abspath(file_path)] = {
+        "offset": meta["offset"], "content_hash": meta["content_hash"], "rows": len(df), "sketch": sketch
+    }
+    return fx.make_read_only(sketch)
+
+# Returns the positions of the transactions sorted by day, with where each day starts, to read the rows of a
+# few days without scanning the others
+    # df = transactions with a Date column (panda DataFrame)
+    # returns a dict: days = every day with transactions (numpy datetime64[D] array), starts = position in
+    # positions of the first row of each day, followed by the number of rows (numpy array), positions (numpy array)
+def build_day_order(df):
+    days = df["Date"].to_numpy().astype("datetime64[D]")
+    # the stable sort keeps the rows of each day in file order
+    positions = np.argsort(days, kind="stable")
+    unique_days, starts = np.unique(days[positions], return_index=True)
+    positions = positions.astype("int32" if len(df) < np.iinfo("int32").max else "int64")
+    return {"days": unique_days, "starts": np.append(starts, len(df)), "positions": positions}
+
+# Builds the day order once per version of the data file, see load_sketch
+    # file_path, version, partitions = see fx.load_cube
+@st.cache_resource(show_spinner=False, max_entries=2)
+def load_day_order(file_path, version=None, partitions=None):
+    day_order = build_day_order(fx.read_and_clean_data(file_path, version=version, partitions=partitions))
+    for array in day_order.values():
+        array.flags.writeable = False
+    return day_order
+
+# Returns the positions of the transactions from the first to the last day, both included
+    # day_order = output of build_day_order (dict)
+    # first, last = dates (datetime.date)
+def day_rows(day_order, first, last):
+    lo = np.searchsorted(day_order["days"], np.datetime64(first, "D"), side="left")
+    hi = np.searchsorted(day_order["days"], np.datetime64(last, "D"), side="right")
+    return day_order["positions"][day_order["starts"][lo]:day_order["starts"][hi]]
+
+## SKETCH QUERY FUNCTIONS ##
+
+# Splits a date range into the whole months it covers and the days of the months it only partly covers
+    # date_range = (start, end) dates (tuple)
+    # returns ((first, last) month start of the whole months, None without any, [(first, last) day of each
+    # stretch of partly covered days])
+def split_months(date_range):
+    start, end = pd.Timestamp(date_range[0]), pd.Timestamp(date_range[1])
+    if start > end:
+        return None, []
+
+    first_whole = start if start.is_month_start else start + pd.offsets.MonthBegin(1)
+    last_whole = end if end.is_month_end else end - pd.offsets.MonthEnd(1)
+    if first_whole > last_whole:
+        return None, [(start.date(), end.date())]
+
+    partial = []
+    if start < first_whole:
+        partial.append((start.date(), (first_whole - pd.Timedelta(days=1)).date()))
+    if end > last_whole:
+        partial.append(((last_whole + pd.Timedelta(days=1)).date(), end.date()))
+    return (first_whole.date(), last_whole.replace(day=1).date()), partial
+
+# Returns the counts of the transactions matching the filters by SUMMARY_KEYS, exact to the day: the whole
+# months of the date range are read from the sketch and the days of the months it only partly covers are
+# sketched from the rows
+    # sketch = output of load_sketch (panda DataFrame)
+    # spec = filter spec from fx.make_filter_spec (dict)
+    # df = transactions the sketch was built from (panda DataFrame)
+    # day_order = output of load_day_order for the same transactions (dict)
+def filter_sketch(sketch, spec, df, day_order):
+    whole_months, partial = (None, None), []
+    date_range = spec.get("date_range")
+    if date_range and len(date_range) == 2:
+        whole_months, partial = split_months(date_range)
+
+    parts = []
+    if whole_months:
+        filtered = fx.filter_data(sketch, dict(spec, date_range=whole_months if whole_months[0] else None))
+        parts.append(merge_sketches([filtered], SUMMARY_KEYS))
+
+    # at most two months of rows, read by position instead of filtering every transaction, with only the
+    # columns the filters and the summary need
+    selected = [col for col in fx.DIMENSION_COLUMNS if spec.get(col)]
+    columns = df[["amount_cents"] + sorted(set(DISTINCT_COLUMNS + selected), key=fx.DIMENSION_COLUMNS.index)]
+    for first, last in partial:
+        rows = columns.take(np.sort(day_rows(day_order, first, last)))
+        for col in selected:
+            mask = fx.code_mask(rows[col], spec[col])
+            if mask is not None:
+                rows = rows[mask]
+        parts.append(build_sketch(rows, DISTINCT_COLUMNS, by_month=False))
+
+    if not parts:
+        return _empty_sketch(sketch, DISTINCT_COLUMNS, by_month=False)
+    return parts[0] if len(parts) == 1 else merge_sketches(parts, SUMMARY_KEYS)
+
+# Returns the amount of every bucket holding transactions and their number, smallest amount first
+    # filtered = sketch from filter_sketch (panda DataFrame)
+    # returns (amounts, counts) as numpy arrays, for fx.histogram_bins(weights=...) or weighted_quantiles
+def bucket_counts(filtered):
+    buckets, inverse = np.unique(filtered["bucket"].to_numpy(), return_inverse=True)
+    counts = np.bincount(inverse, weights=filtered["count"].to_numpy(), minlength=len(buckets))
+    return bucket_amounts(buckets), counts.astype("int64")
+
+# Returns the quantiles of values given with their number of occurrences, the smallest value whose cumulative
+# share reaches each quantile (np.quantile's "inverted_cdf" method)
+    # values = sorted values (numpy array)
+    # counts = occurrences or weight of each value (numpy array)
+    # quantiles = quantiles between 0 and 1 (list)
+def weighted_quantiles(values, counts, quantiles=QUANTILES):
+    cumulative = np.cumsum(counts)
+    if not len(cumulative) or cumulative[-1] == 0:
+        return [np.nan] * len(quantiles)
+    positions = np.searchsorted(cumulative, np.asarray(quantiles) * cumulative[-1], side="left")
+    return np.asarray(values, dtype="float64")[np.minimum(positions, len(values) - 1)].tolist()
+
+# Returns the number of distinct values of some dimension columns among the rows of a filtered cube or sketch
+    # frame = filtered cube or sketch, with a count column (panda DataFrame)
+    # columns = dimension columns (list)
+def distinct_counts(frame, columns=DISTINCT_COLUMNS):
+    present = frame[frame["count"] > 0]
+    return {col: int(present[col].nunique()) for col in columns}
+
+# Returns the header percentiles and distinct counts from a filtered sketch
+    # filtered = sketch from filter_sketch (panda DataFrame)
+    # returns a dict: quantiles (list, one per QUANTILES) and distinct ({column: count})
+def sketch_summary(filtered):
+    return {"quantiles": weighted_quantiles(*bucket_counts(filtered)), "distinct": distinct_counts(filtered)}
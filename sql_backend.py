@@ -0,0 +1,393 @@
+import contextlib
+import json
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+import functions as fx
+
+## DATABASE FUNCTIONS ##
+
+# rows parsed and inserted per chunk while loading the csv, bounds memory during the load
+LOAD_CHUNK_ROWS = 250_000
+
+# Returns the path of the sqlite database built for a given csv, next to the columnar cache
+    # file_path = path to the source csv (string)
+def database_path(file_path):
+    arrow_path, _ = fx.cache_paths(file_path)
+    return arrow_path[:-len(".arrow")] + ".sqlite"
+
+# Opens a read-only connection, closed when the with block ends
+    # db_path = path to the sqlite database (string)
+@contextlib.contextmanager
+def connect(db_path):
+    con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        yield con
+    finally:
+        con.close()
+
+# Inserts the rows of a csv into the transactions table in chunks, the description column is not loaded
+    # con = open connection (sqlite3.Connection)
+    # source = path to the csv, or a buffer from fx.appended_rows (string)
+    # returns the number of rows inserted
+def insert_rows(con, source):
+    chunks = pd.read_csv(
+        source,
+        usecols=["date", "amount"] + fx.DIMENSION_COLUMNS,
+        dtype={col: "str" for col in fx.DIMENSION_COLUMNS} | {"amount": "float64"},
+        chunksize=LOAD_CHUNK_ROWS
+    )
+    n_rows = 0
+    for chunk in chunks:
+        # days since 1970-01-01, the same day the pandas path truncates Date to
+        day = pd.to_datetime(chunk["date"], format=fx.DATE_FORMAT).to_numpy().astype("datetime64[D]").astype("int64")
+        rows = pd.DataFrame({"day": day, "amount": chunk["amount"].to_numpy()})
+        for col in fx.DIMENSION_COLUMNS:
+            rows[col] = chunk[col].to_numpy()
+        rows.to_sql("transactions", con, if_exists="append", index=False)
+        n_rows += len(rows)
+    return n_rows
+
+# Loads the csv into a new sqlite database
+    # file_path = path to the source csv (string)
+    # db_path = path of the database to write (string)
+def build_database(file_path, db_path):
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    tmp_path = db_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    con = sqlite3.connect(tmp_path)
+    try:
+        con.execute(
+            "CREATE TABLE transactions ("
+            "day INTEGER, amount REAL, "
+            + ", ".join(f"{col} TEXT" for col in fx.DIMENSION_COLUMNS)
+            + ")"
+        )
+        n_rows = insert_rows(con, file_path)
+        con.execute("CREATE INDEX idx_transactions_day ON transactions (day)")
+
+        meta = fx.full_ingest_meta(file_path, n_rows)
+        con.execute("CREATE TABLE meta (value TEXT)")
+        con.execute("INSERT INTO meta VALUES (?)", (json.dumps(meta),))
+        con.execute("ANALYZE")
+        con.commit()
+    finally:
+        con.close()
+
+    os.replace(tmp_path, db_path)
+
+# Brings the database up to date with the csv, inserting only the rows appended since it was built
+    # file_path = path to the source csv (string)
+    # db_path = path to the sqlite database (string)
+    # returns False if there is no database or the csv was rewritten, so it must be rebuilt
+def update_database(file_path, db_path):
+    if not os.path.exists(db_path):
+        return False
+
+    try:
+        with connect(db_path) as con:
+            meta = json.loads(con.execute("SELECT value FROM meta").fetchone()[0])
+    except sqlite3.Error:
+        return False
+
+    status, appended, new_meta = fx.source_changes(file_path, meta)
+    if status == "rewritten":
+        return False
+    if new_meta == meta:
+        return True
+
+    con = sqlite3.connect(db_path)
+    try:
+        # the rows and the metadata are committed together, a failed append leaves the database as it was
+        if appended:
+            new_meta["rows"] = meta["rows"] + insert_rows(con, fx.appended_rows(file_path, appended))
+        con.execute("UPDATE meta SET value = ?", (json.dumps(new_meta),))
+        con.commit()
+    finally:
+        con.close()
+    return True
+
+# Returns the path of an up-to-date database for the csv, building it when missing or rewritten
+    # file_path = path to the source csv (string)
+    # version = fx.source_version of the csv, so a changed file is checked again (tuple)
+@st.cache_resource(show_spinner="Loading transactions into the local database...", max_entries=2)
+def load_database(file_path, version=None):
+    db_path = database_path(file_path)
+    if not update_database(file_path, db_path):
+        build_database(file_path, db_path)
+    return db_path
+
+## QUERY FUNCTIONS ##
+
+# Returns the sorted distinct values of every dimension column and the first and last date
+    # db_path = path to the sqlite database (string)
+    # version = fx.source_version of the csv the database was loaded from (tuple)
+@st.cache_data(show_spinner=False, max_entries=2)
+def load_dimension_values(db_path, version=None):
+    with connect(db_path) as con:
+        values = {
+            col: [row[0] for row in con.execute(f"SELECT DISTINCT {col} FROM transactions ORDER BY {col}")]
+            for col in fx.DIMENSION_COLUMNS
+        }
+        min_day, max_day = con.execute("SELECT MIN(day), MAX(day) FROM transactions").fetchone()
+
+    dates = (pd.Timestamp(np.datetime64(min_day, "D")).date(), pd.Timestamp(np.datetime64(max_day, "D")).date())
+    return values, dates
+
+# Returns the dimension dictionary and co-occurrence index of the database, see fx.build_dimension_index
+    # db_path, version = see load_dimension_values
+    # one GROUP BY over the dimension columns, the sidebar then narrows its options without querying again
+@st.cache_resource(show_spinner=False, max_entries=2)
+def load_dimension_index(db_path, version=None):
+    dims = ", ".join(fx.DIMENSION_COLUMNS)
+    combos = query(db_path, f"SELECT {dims}, COUNT(*) AS count FROM transactions GROUP BY {dims}")
+    for col in fx.DIMENSION_COLUMNS:
+        combos[col] = combos[col].astype("category")
+    return fx.build_dimension_index(combos)
+
+# Compiles the sidebar filters into a WHERE clause and its parameters
+    # spec = filter spec from make_filter_spec (dict)
+    # dimension_values = all values per dimension from load_dimension_values, selections
+    # covering every value are left out of the query (dict)
+def compile_filters(spec, dimension_values=None):
+    clauses, params = [], []
+
+    date_range = spec.get("date_range")
+    if date_range and len(date_range) == 2:
+        clauses.append("day BETWEEN ? AND ?")
+        params += [int(np.datetime64(d, "D").astype("int64")) for d in date_range]
+
+    for col in fx.DIMENSION_COLUMNS:
+        selected = spec.get(col)
+        if not selected:
+            continue
+        if dimension_values is not None and set(map(str, selected)) >= set(dimension_values[col]):
+            continue
+        clauses.append(f"{col} IN ({', '.join('?' * len(selected))})")
+        params += [str(value) for value in selected]
+
+    return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+# Runs a query and returns the result as a DataFrame
+    # db_path = path to the sqlite database (string)
+    # sql = query (string)
+    # params = query parameters (list)
+def query(db_path, sql, params=()):
+    with connect(db_path) as con:
+        return pd.read_sql_query(sql, con, params=list(params))
+
+# Returns the filtered day x dimension cube, the same frame as filter_data(build_cube(df), spec)
+    # db_path = path to the sqlite database (string)
+    # spec = filter spec from make_filter_spec (dict)
+    # dimension_values = see compile_filters (dict)
+def query_cube(db_path, spec, dimension_values):
+    where, params = compile_filters(spec, dimension_values)
+    dims = ", ".join(fx.DIMENSION_COLUMNS)
+
+    cube = query(
+        db_path,
+        f"SELECT day, {dims}, SUM(amount) AS amount, COUNT(*) AS count, SUM(amount * amount) AS amount_sq "
+        f"FROM transactions {where} GROUP BY day, {dims} ORDER BY day, {dims}",
+        params
+    )
+
+    cube.insert(0, "Date", cube.pop("day").to_numpy().astype("datetime64[D]").astype("datetime64[ns]"))
+    for col in fx.DIMENSION_COLUMNS:
+        cube[col] = pd.Categorical(cube[col], categories=dimension_values[col])
+    # sqlite types the columns of an empty result as object, the cube keeps the dtypes of build_cube
+    cube = cube.astype({"amount": "float64", "count": "int64", "amount_sq": "float64"})
+
+    return fx.round_cube_sums(cube)
+
+# Builds the prefix-sum index for a combination of non-date filters, see fx.load_prefix_index
+    # db_path = path to the sqlite database (string)
+    # dimension_key = key from dimension_filter_key (tuple)
+    # version = see load_dimension_values (tuple)
+@st.cache_data(show_spinner=False, max_entries=64)
+def load_prefix_index(db_path, dimension_key, version=None):
+    spec = {col: list(values) if values else None for col, values in dimension_key}
+    dimension_values, _ = load_dimension_values(db_path, version)
+    return fx.build_prefix_index(query_cube(db_path, spec, dimension_values))
+
+# Returns the distinct amounts and how often each occurs, enough to bin a histogram exactly
+    # db_path = path to the sqlite database (string)
+    # spec = filter spec from make_filter_spec (dict)
+    # dimension_values = see compile_filters (dict)
+def query_amount_counts(db_path, spec, dimension_values):
+    where, params = compile_filters(spec, dimension_values)
+    counts = query(
+        db_path,
+        f"SELECT amount, COUNT(*) AS count FROM transactions {where} GROUP BY amount ORDER BY amount",
+        params
+    )
+    # missing amounts are stored as NULL, which sorts first and has no rank
+    counts = counts[counts["amount"].notna()]
+    return counts["amount"].to_numpy(dtype="float64"), counts["count"].to_numpy()
+
+# first digit of amounts of 1 or more, the same digit as benford.first_digit
+FIRST_DIGIT_SQL = "CAST(substr(CAST(CAST(amount AS INTEGER) AS TEXT), 1, 1) AS INTEGER)"
+
+# Returns the first digit counts (1-9) of amounts of 1 or more, with the number of negative and (0, 1) amounts
+    # db_path = path to the sqlite database (string)
+    # spec = filter spec from make_filter_spec (dict)
+    # dimension_values = see compile_filters (dict)
+def query_first_digit_counts(db_path, spec, dimension_values):
+    where, params = compile_filters(spec, dimension_values)
+    counts = query(
+        db_path,
+        f"SELECT CASE WHEN amount >= 1 THEN {FIRST_DIGIT_SQL} WHEN amount < 0 THEN -1 WHEN amount > 0 THEN 0 END AS digit, "
+        f"COUNT(*) AS count FROM transactions {where} GROUP BY digit",
+        params
+    ).dropna()
+    counts = dict(zip(counts["digit"].astype(int), counts["count"].astype(int)))
+
+    return [counts.get(d, 0) for d in range(1, 10)], counts.get(-1, 0), counts.get(0, 0)
+
+# Returns the labels and (groups x 9) first digit count matrix of amounts of 1 or more, for benford.rank_groups
+    # db_path = path to the sqlite database (string)
+    # spec = filter spec from make_filter_spec (dict)
+    # dimension_values = see compile_filters (dict)
+    # group_col = dimension column to group by (string)
+def query_first_digit_counts_by_group(db_path, spec, dimension_values, group_col):
+    where, params = compile_filters(spec, dimension_values)
+    where = (where + " AND " if where else "WHERE ") + "amount >= 1"
+    counts = query(
+        db_path,
+        f"SELECT {group_col} AS grp, {FIRST_DIGIT_SQL} AS digit, COUNT(*) AS count "
+        f"FROM transactions {where} GROUP BY grp, digit",
+        params
+    )
+
+    matrix = (
+        counts.pivot(index="grp", columns="digit", values="count")
+        .reindex(columns=range(1, 10), fill_value=0)
+        .fillna(0)
+        .sort_index()
+    )
+    return list(matrix.index), matrix.to_numpy(dtype="int64")
+
+# Returns the date, amount in cents and the given dimension columns of the filtered rows, for detection.py
+    # db_path = path to the sqlite database (string)
+    # spec = filter spec from make_filter_spec (dict)
+    # dimension_values = see compile_filters (dict)
+    # columns = dimension columns to read (list)
+    # the database only stores the day of each transaction, so times fall at midnight
+def query_detection_rows(db_path, spec, dimension_values, columns):
+    where, params = compile_filters(spec, dimension_values)
+    selected = "".join(f", {col}" for col in columns)
+
+    rows = query(db_path, f"SELECT day, CAST(ROUND(amount * 100) AS INTEGER) AS amount_cents{selected} FROM transactions {where}", params)
+    rows.insert(0, "Date", rows.pop("day").to_numpy().astype("datetime64[D]").astype("datetime64[ns]"))
+    for col in columns:
+        rows[col] = pd.Categorical(rows[col], categories=dimension_values[col])
+
+    return rows
+
+# Returns the transactions with the highest outlier scores, scored in the database like outliers.score_amounts
+    # db_path = path to the sqlite database (string)
+    # spec = filter spec from make_filter_spec (dict)
+    # dimension_values = see compile_filters (dict)
+    # baselines = output of outliers.group_baselines (dict)
+    # k = number of transactions (int)
+    # each baseline is passed as a VALUES table joined on its column, so only the top k rows leave the database
+    # returns a panda DataFrame with Date, amount, every dimension column and score, highest score first
+def query_top_scores(db_path, spec, dimension_values, baselines, k):
+    where, params = compile_filters(spec, dimension_values)
+    tables, joins, terms, table_params = [], [], [], []
+    for i, (col, base) in enumerate(baselines.items()):
+        if not len(base):
+            continue
+        tables.append(f"b{i}(label, center, scale) AS (VALUES {', '.join(['(?, ?, ?)'] * len(base))})")
+        table_params += [value for row in zip(map(str, base.index), base["center"].tolist(), base["scale"].tolist())
+                         for value in row]
+        joins.append(f"LEFT JOIN b{i} ON {col} = b{i}.label")
+        # transactions without a baseline for this column are scored on the others
+        terms.append(f"COALESCE((amount - b{i}.center) / b{i}.scale, -1e308)")
+
+    columns = ["Date", "amount"] + fx.DIMENSION_COLUMNS + ["score"]
+    if not terms:
+        return pd.DataFrame(columns=columns)
+
+    score = terms[0] if len(terms) == 1 else f"max({', '.join(terms)})"
+    dims = ", ".join(fx.DIMENSION_COLUMNS)
+    top = query(
+        db_path,
+        f"WITH {', '.join(tables)} "
+        f"SELECT * FROM (SELECT day, amount, {dims}, {score} AS score FROM transactions {' '.join(joins)} {where}) "
+        f"WHERE score > -1e308 ORDER BY score DESC LIMIT ?",
+        table_params + params + [int(k)]
+    )
+    top.insert(0, "Date", top.pop("day").to_numpy().astype("datetime64[D]").astype("datetime64[ns]"))
+
+    return top[columns]
+
+# Returns a bounded sample of points for the anomaly scatter plot, with the best fit line over every row
+    # db_path = path to the sqlite database (string)
+    # spec = filter spec from make_filter_spec (dict)
+    # dimension_values = see compile_filters (dict)
+    # color_col = dimension column used to colour the points (string)
+    # max_points = point budget, split like fx.downsample_scatter (int)
+    # returns a dict with x (day ordinals), y, color, fit (slope, intercept), x_range and n (rows matching the filters),
+    # fit and x_range are None when no row matches
+def query_scatter_sample(db_path, spec, dimension_values, color_col, max_points):
+    where, params = compile_filters(spec, dimension_values)
+    x_sql = f"(day + {fx.UNIX_EPOCH_ORDINAL})"
+
+    with connect(db_path) as con:
+        n, mean_x, mean_y, min_x, max_x = con.execute(
+            f"SELECT COUNT(*), AVG({x_sql}), AVG(amount), MIN({x_sql}), MAX({x_sql}) FROM transactions {where}",
+            params
+        ).fetchone()
+        if n == 0:
+            return {"x": np.empty(0), "y": np.empty(0), "color": np.empty(0, dtype=object),
+                    "fit": None, "x_range": None, "n": 0}
+
+        # least squares on centred values avoids the cancellation of the raw sums of squares
+        sxy, sxx = con.execute(
+            f"SELECT SUM(({x_sql} - ?) * (amount - ?)), SUM(({x_sql} - ?) * ({x_sql} - ?)) FROM transactions {where}",
+            [mean_x, mean_y, mean_x, mean_x] + params
+        ).fetchone()
+    slope = sxy / sxx if sxx else 0.0
+    intercept = mean_y - slope * mean_x
+
+    n_top = max_points // 2
+    top = query(
+        db_path,
+        f"SELECT rowid, {x_sql} AS x, amount AS y, {color_col} AS color FROM transactions {where} "
+        f"{'AND' if where else 'WHERE'} amount - (? * {x_sql} + ?) > 0 "
+        f"ORDER BY amount - (? * {x_sql} + ?) DESC LIMIT ?",
+        params + [slope, intercept, slope, intercept, n_top]
+    )
+
+    # the rest of the budget is a random sample of each colour group, shared out as in fx.downsample_scatter
+    sizes = query(db_path, f"SELECT {color_col} AS color, COUNT(*) AS size FROM transactions {where} GROUP BY color", params)
+    quota = fx.group_quotas(sizes["size"].to_numpy(), max_points - len(top))
+    quota_sql = "CASE color " + " ".join("WHEN ? THEN ?" for _ in range(len(sizes))) + " END"
+    quota_params = [value for pair in zip(sizes["color"], quota.tolist()) for value in pair]
+    rest = query(
+        db_path,
+        f"SELECT rowid, x, y, color FROM ("
+        f"SELECT rowid, {x_sql} AS x, amount AS y, {color_col} AS color, "
+        f"ROW_NUMBER() OVER (PARTITION BY {color_col} ORDER BY random()) AS rn FROM transactions {where}"
+        f") WHERE rn <= {quota_sql}",
+        params + quota_params
+    )
+
+    # empty frames are left out of the concat, their all-NA columns would set the dtypes
+    sample = pd.concat([frame for frame in (top, rest) if len(frame)] or [top])
+    sample = sample.drop_duplicates("rowid").sort_values("rowid")
+
+    return {
+        "x": sample["x"].to_numpy(dtype="float64"),
+        "y": sample["y"].to_numpy(dtype="float64"),
+        "color": sample["color"].to_numpy(dtype=object),
+        "fit": (slope, intercept),
+        "x_range": (min_x, max_x),
+        "n": n,
+    }
@@ -0,0 +1,316 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+import streamlit as st
+
+import benford
+import functions as fx
+
+## STREAMING INGESTION FUNCTIONS ##
+
+# rows parsed per chunk, peak memory is bounded by one chunk plus the aggregates
+STREAM_CHUNK_ROWS = 250_000
+
+# pending chunk aggregates are merged into the running totals every this many chunks
+COMPACT_EVERY = 8
+
+# only these columns are parsed, the description and transaction id are never read
+STREAM_COLUMNS = ["date", "amount"] + fx.DIMENSION_COLUMNS
+
+# cube columns holding the first digit counts (amounts of 1 or more), plus negative and (0, 1) amounts
+DIGIT_COLUMNS = [f"digit_{d}" for d in benford.FIRST_DIGITS]
+CUBE_VALUE_COLUMNS = ["amount", "count", "amount_sq"] + DIGIT_COLUMNS + ["negative", "below_one"]
+
+# amounts are counted on a fixed log-spaced grid so histogram counts from any chunk can be added together,
+# bins are 10 ** (1 / 50) - 1 = 4.7% wide and bin 1 starts at $0.01
+HISTOGRAM_BINS_PER_DECADE = 50
+HISTOGRAM_GRID_OFFSET = 2 * HISTOGRAM_BINS_PER_DECADE + 1
+
+# largest relative distance between an amount and the geometric centre of its grid bin (2.3%)
+HISTOGRAM_ACCURACY = 10 ** (0.5 / HISTOGRAM_BINS_PER_DECADE) - 1
+
+# rows kept for the scatter plot: the largest amounts and a uniform random sample (smallest random keys)
+SAMPLE_TOP_ROWS = 10_000
+SAMPLE_RANDOM_ROWS = 20_000
+
+# Returns the paths of the aggregate files and their metadata file for a given csv
+    # file_path = path to the source csv (string)
+def aggregate_paths(file_path):
+    arrow_path, _ = fx.cache_paths(file_path)
+    base = arrow_path[:-len(".arrow")]
+    return {
+        "cube": base + ".cube.arrow",
+        "histogram": base + ".histogram.arrow",
+        "sample": base + ".sample.arrow",
+        "meta": base + ".stream.json",
+    }
+
+# Returns the fixed grid bin of each amount: 0 for zero, negative bins for negative amounts
+    # amounts = amounts (numpy array)
+def amount_grid(amounts):
+    magnitude = np.abs(amounts)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        position = np.floor(np.log10(magnitude) * HISTOGRAM_BINS_PER_DECADE) + HISTOGRAM_GRID_OFFSET
+    position = np.where(magnitude > 0, np.maximum(position, 1), 0)
+    return (np.sign(amounts) * position).astype("int32")
+
+# Returns the amount at the geometric centre of each grid bin, the inverse of amount_grid
+    # bins = grid bins (numpy array)
+def grid_amounts(bins):
+    bins = np.asarray(bins)
+    magnitude = 10.0 ** ((np.abs(bins) - HISTOGRAM_GRID_OFFSET + 0.5) / HISTOGRAM_BINS_PER_DECADE)
+    return np.where(bins == 0, 0.0, np.sign(bins) * magnitude)
+
+# Returns the mergeable aggregates of one chunk of the csv
+    # chunk = rows from pd.read_csv with STREAM_COLUMNS (panda DataFrame)
+    # seed = random seed of the chunk, for the random sample keys (int or list)
+    # returns a dict with a day x dimension cube, month x dimension histogram grid counts and a row sample
+def chunk_aggregates(chunk, seed):
+    dates = pd.to_datetime(chunk["date"], format=fx.DATE_FORMAT)
+    amount = chunk["amount"].to_numpy()
+    dims = {col: chunk[col] for col in fx.DIMENSION_COLUMNS}
+
+    digits = np.where(amount >= 1, benford.first_digit(amount), 0)
+    keyed = pd.DataFrame({
+        "Date": dates.to_numpy().astype("datetime64[D]").astype("datetime64[ns]"),
+        **dims,
+        "amount": amount,
+        "count": 1,
+        "amount_sq": amount * amount,
+        **{col: (digits == d).astype("int64") for col, d in zip(DIGIT_COLUMNS, benford.FIRST_DIGITS)},
+        "negative": (amount < 0).astype("int64"),
+        "below_one": ((amount > 0) & (amount < 1)).astype("int64"),
+    })
+    cube = keyed.groupby(["Date"] + fx.DIMENSION_COLUMNS, as_index=False, observed=True, sort=True).sum()
+
+    grid = pd.DataFrame({
+        "Date": dates.to_numpy().astype("datetime64[M]").astype("datetime64[ns]"),
+        **dims,
+        "bin": amount_grid(amount),
+        "count": 1,
+    })
+    # missing amounts have no bin, they are still counted in the cube
+    grid = grid[~np.isnan(amount)]
+    histogram = grid.groupby(["Date"] + fx.DIMENSION_COLUMNS + ["bin"], as_index=False, observed=True).sum()
+
+    sample = pd.DataFrame({"Date": dates, "amount": amount, **dims})
+    sample["key"] = np.random.default_rng(seed).random(len(sample))
+
+    return {"cube": cube, "histogram": histogram, "sample": trim_sample(sample), "rows": len(chunk)}
+
+# Keeps the rows with the largest amounts and the rows with the smallest random keys
+    # sample = rows with a "key" column of uniform random numbers (panda DataFrame)
+def trim_sample(sample):
+    keep = np.zeros(len(sample), dtype=bool)
+    amount, key = sample["amount"].to_numpy(), sample["key"].to_numpy()
+    if len(sample) > SAMPLE_TOP_ROWS:
+        keep[np.argpartition(-amount, SAMPLE_TOP_ROWS - 1)[:SAMPLE_TOP_ROWS]] = True
+    else:
+        keep[:] = True
+    if len(sample) > SAMPLE_RANDOM_ROWS:
+        keep[np.argpartition(key, SAMPLE_RANDOM_ROWS - 1)[:SAMPLE_RANDOM_ROWS]] = True
+    return sample[keep].reset_index(drop=True)
+
+# Merges aggregates from chunk_aggregates (or earlier merges) into one, in any order
+    # parts = aggregates to merge (list of dict)
+def merge_aggregates(parts):
+    histogram = (
+        fx.concat_categorical([part["histogram"] for part in parts])
+        .groupby(["Date"] + fx.DIMENSION_COLUMNS + ["bin"], as_index=False, observed=True, sort=True)
+        .sum()
+    )
+    sample = trim_sample(fx.concat_categorical([part["sample"] for part in parts]))
+
+    return {
+        "cube": fx.merge_cubes([part["cube"] for part in parts]),
+        "histogram": histogram,
+        "sample": sample,
+        "rows": sum(part["rows"] for part in parts),
+    }
+
+# Streams the csv in chunks and folds every chunk into the aggregates, without holding the rows in memory
+    # file_path = path to the source csv, or a buffer from fx.appended_rows (string)
+    # progress = called after every chunk with the fraction of the file read and the rows so far (function)
+    # chunk_rows = rows per chunk (int)
+    # seed = base seed of the random sample keys, different for every append (int)
+def stream_aggregates(file_path, progress=None, chunk_rows=STREAM_CHUNK_ROWS, seed=0):
+    f = open(file_path, "rb") if isinstance(file_path, str) else file_path
+    size = max(f.seek(0, os.SEEK_END), 1)
+    f.seek(0)
+    totals, pending = None, []
+
+    with f:
+        chunks = pd.read_csv(
+            f,
+            usecols=STREAM_COLUMNS,
+            dtype={col: "category" for col in fx.DIMENSION_COLUMNS} | {"amount": "float64"},
+            chunksize=chunk_rows
+        )
+        rows = 0
+        for i, chunk in enumerate(chunks):
+            pending.append(chunk_aggregates(chunk, [seed, i]))
+            rows += len(chunk)
+            if len(pending) >= COMPACT_EVERY:
+                totals = merge_aggregates(([totals] if totals else []) + pending)
+                pending = []
+            if progress is not None:
+                progress(min(f.tell() / size, 1.0), rows)
+
+    if totals is None and not pending:
+        raise ValueError(f"{file_path} has no rows")
+
+    return merge_aggregates(([totals] if totals else []) + pending)
+
+# Streams the csv and writes the aggregates next to the columnar cache
+    # file_path = path to the source csv (string)
+    # progress = see stream_aggregates (function)
+def build_aggregates(file_path, progress=None):
+    aggregates = stream_aggregates(file_path, progress=progress)
+    meta = fx.full_ingest_meta(file_path, aggregates["rows"])
+    write_aggregates(file_path, aggregates, meta)
+    return meta
+
+# Writes the aggregates and their ingest metadata
+    # file_path = path to the source csv (string)
+    # aggregates = output of stream_aggregates (dict)
+    # meta = metadata from fx.full_ingest_meta or fx.source_changes (dict)
+def write_aggregates(file_path, aggregates, meta):
+    paths = aggregate_paths(file_path)
+    os.makedirs(os.path.dirname(paths["meta"]), exist_ok=True)
+    for name in ["cube", "histogram", "sample"]:
+        tmp_path = paths[name] + ".tmp"
+        feather.write_feather(aggregates[name], tmp_path, compression="uncompressed")
+        os.replace(tmp_path, paths[name])
+
+    with open(paths["meta"], "w") as f:
+        json.dump(meta, f)
+
+# Returns the metadata of the stored aggregates brought up to date with the csv, or None if they must be rebuilt
+    # file_path = path to the source csv (string)
+    # rows appended to the csv since the aggregates were written are streamed on their own and merged in
+def current_aggregates(file_path):
+    paths = aggregate_paths(file_path)
+    if not all(os.path.exists(path) for path in paths.values()):
+        return None
+
+    with open(paths["meta"]) as f:
+        meta = json.load(f)
+
+    status, appended, new_meta = fx.source_changes(file_path, meta)
+    if status == "rewritten":
+        return None
+
+    if appended:
+        stored = {name: feather.read_feather(paths[name]) for name in ["cube", "histogram", "sample"]}
+        stored["rows"] = meta["rows"]
+        added = stream_aggregates(fx.appended_rows(file_path, appended), seed=meta["offset"])
+        aggregates = merge_aggregates([stored, added])
+        new_meta["rows"] = aggregates["rows"]
+        write_aggregates(file_path, aggregates, new_meta)
+    elif new_meta != meta:
+        with open(paths["meta"], "w") as f:
+            json.dump(new_meta, f)
+
+    return new_meta
+
+# Reads the stored aggregates once per version of the csv, shared read-only by every session
+    # file_path = path to the source csv (string)
+    # content_hash = content hash from the aggregate metadata, so a rebuilt file is read again (string)
+@st.cache_resource(show_spinner=False, max_entries=4)
+def load_aggregates(file_path, content_hash):
+    paths = aggregate_paths(file_path)
+    return {name: fx.make_read_only(feather.read_feather(paths[name])) for name in ["cube", "histogram", "sample"]}
+
+# Builds the prefix-sum index for a combination of non-date filters, see fx.load_prefix_index
+    # file_path, content_hash = see load_aggregates
+    # dimension_key = key from fx.dimension_filter_key (tuple)
+@st.cache_data(show_spinner=False, max_entries=64)
+def load_prefix_index(file_path, content_hash, dimension_key):
+    spec = {col: list(values) if values else None for col, values in dimension_key}
+    cube = load_aggregates(file_path, content_hash)["cube"]
+    return fx.build_prefix_index(fx.filter_data(cube, spec))
+
+# Builds the dimension index of the stored cube, see fx.build_dimension_index
+    # file_path, content_hash = see load_aggregates
+@st.cache_resource(show_spinner=False, max_entries=4)
+def load_dimension_index(file_path, content_hash):
+    return fx.build_dimension_index(load_aggregates(file_path, content_hash)["cube"])
+
+## AGGREGATE QUERY FUNCTIONS ##
+
+# Returns the date range widened to the whole months it touches, from the first day of its first month to the
+# last day of its last month, or None if no range is set
+    # date_range = (start, end) dates from the sidebar (tuple)
+def month_range(date_range):
+    if not date_range or len(date_range) != 2:
+        return None
+    start, end = pd.Timestamp(date_range[0]), pd.Timestamp(date_range[1])
+    return start.replace(day=1).date(), (end + pd.offsets.MonthEnd(0)).date()
+
+# Returns the grid amounts and their counts matching the filters, for fx.histogram_bins(weights=...)
+    # histogram = histogram grid counts from the aggregates (panda DataFrame)
+    # spec = filter spec from fx.make_filter_spec (dict)
+    # the counts are kept per month, so the date range is widened to whole months at both ends (month_range)
+def histogram_counts(histogram, spec):
+    if spec.get("date_range"):
+        spec = dict(spec, date_range=month_range(spec["date_range"]))
+
+    counts = fx.filter_data(histogram, spec).groupby("bin")["count"].sum()
+    return grid_amounts(counts.index.to_numpy()), counts.to_numpy()
+
+# Returns the first digit counts (1-9) with the number of negative and (0, 1) amounts of a filtered cube
+    # cube = cube from the aggregates, after fx.filter_data (panda DataFrame)
+def first_digit_counts(cube):
+    return (
+        cube[DIGIT_COLUMNS].sum().astype(int).tolist(),
+        int(cube["negative"].sum()),
+        int(cube["below_one"].sum()),
+    )
+
+# Returns the labels and (groups x 9) first digit count matrix of a filtered cube, for benford.rank_groups
+    # cube = cube from the aggregates, after fx.filter_data (panda DataFrame)
+    # group_col = dimension column to group by (string)
+def first_digit_counts_by_group(cube, group_col):
+    counts = cube.groupby(group_col, observed=True)[DIGIT_COLUMNS].sum().sort_index()
+    return list(counts.index), counts.to_numpy(dtype="int64")
+
+# Returns the least squares fit of amount against day ordinal over every row summarised by a cube
+    # cube = cube from the aggregates, after fx.filter_data (panda DataFrame)
+    # returns (slope, intercept) and the (min, max) day ordinal, None and None for an empty cube
+def cube_fit(cube):
+    x = fx.date_ordinals(cube["Date"]).astype("float64")
+    count = cube["count"].to_numpy()
+    amount = cube["amount"].to_numpy()
+
+    n = count.sum()
+    if len(x) == 0 or n == 0:
+        return None, None
+    mean_x, mean_y = (x * count).sum() / n, amount.sum() / n
+    # centred sums, as in sql_backend.query_scatter_sample
+    sxy = ((x - mean_x) * (amount - count * mean_y)).sum()
+    sxx = (count * (x - mean_x) ** 2).sum()
+    slope = sxy / sxx if sxx else 0.0
+
+    return (slope, mean_y - slope * mean_x), (x.min(), x.max())
+
+# Returns the scatter plot points from the row sample, with the best fit line over every row
+    # aggregates = output of load_aggregates (dict)
+    # filtered_cube = cube after fx.filter_data with the same spec (panda DataFrame)
+    # spec = filter spec from fx.make_filter_spec (dict)
+    # color_col = dimension column used to colour the points (string)
+    # returns a dict like sql_backend.query_scatter_sample
+def scatter_sample(aggregates, filtered_cube, spec, color_col):
+    sample = fx.filter_data(aggregates["sample"], spec)
+    fit, x_range = cube_fit(filtered_cube)
+
+    return {
+        "x": fx.date_ordinals(sample["Date"]).astype("float64"),
+        "y": sample["amount"].to_numpy(dtype="float64"),
+        "color": sample[color_col].to_numpy(dtype=object),
+        "fit": fit,
+        "x_range": x_range,
+        "n": int(filtered_cube["count"].sum()),
+    }
@@ -0,0 +1,12 @@
+import os
+import sys
+
+import streamlit.config
+import streamlit.logger
+
+# the tests run without a streamlit server, the cached functions would log "No runtime found" warnings from
+# their import on; the config is read first, otherwise reading it later resets the log level
+streamlit.config.get_option("logger.level")
+streamlit.logger.set_log_level("error")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
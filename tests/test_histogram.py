@@ -0,0 +1,17 @@
+import numpy as np
+import pandas as pd
+
+import charts
+import functions as fx
+
+def test_empty_log_scale_histogram_has_log_valid_edges():
+    edges, counts = fx.histogram_bins(np.array([-5.0, 0.0]), log_scale=True)
+    assert (edges > 0).all() and counts.sum() == 0
+
+    fig = charts.histogram_figure((edges, counts), log_scale=True)
+    assert fig.data[0].y.tolist() == [0]
+
+def test_log_scale_histogram_of_linear_empty_edges():
+    empty = pd.DataFrame({"amount": pd.Series(dtype="float64")})
+    fig = fx.histogram(empty, "amount", log_scale=True, binned=(np.array([0.0, 1.0]), np.array([0])))
+    assert len(fig.data[0].x) == 0
@@ -0,0 +1,53 @@
+import io
+import sqlite3
+
+import pandas as pd
+
+import functions as fx
+import sql_backend
+import streaming
+
+# whole-second timestamps are written without a fractional part, e.g. by str() when the microseconds are 0
+CSV = (
+    "transaction_id,date,amount,category,merchant,payment_method,account_type,transaction_type,description\n"
+    "T-1,2024-08-26 14:40:08,10.50,Dining,Chipotle,Cash,Savings,Payment,lunch\n"
+    "T-2,2024-08-26 14:40:08.881401,20.25,Travel,Delta,Debit Card,Checking,Payment,flight\n"
+    "T-3,2024-08-27 09:00:00.5,5.00,Dining,Chipotle,Cash,Savings,Payment,coffee\n"
+)
+
+EXPECTED = pd.DatetimeIndex([pd.Timestamp(value) for value in
+                             ["2024-08-26 14:40:08", "2024-08-26 14:40:08.881401", "2024-08-27 09:00:00.5"]])
+
+def test_parse_csv_accepts_whole_and_fractional_seconds():
+    df = fx.parse_csv(io.BytesIO(CSV.encode()))
+    assert (df["Date"].to_numpy() == EXPECTED.to_numpy()).all()
+    assert df["amount_cents"].tolist() == [1050, 2025, 500]
+
+def test_stream_chunk_accepts_whole_and_fractional_seconds():
+    chunk = pd.read_csv(io.StringIO(CSV), usecols=streaming.STREAM_COLUMNS)
+    cube = streaming.chunk_aggregates(chunk, seed=0)["cube"]
+    assert cube["count"].sum() == 3
+    assert sorted(cube["Date"].dt.date.unique().astype(str)) == ["2024-08-26", "2024-08-27"]
+
+def test_sql_insert_accepts_whole_and_fractional_seconds():
+    con = sqlite3.connect(":memory:")
+    assert sql_backend.insert_rows(con, io.StringIO(CSV)) == 3
+    days = [row[0] for row in con.execute("SELECT day FROM transactions ORDER BY day")]
+    assert days == (EXPECTED.normalize().to_numpy().astype("datetime64[D]").astype("int64")).tolist()
+
+def test_descriptions_are_read_for_the_given_rows(tmp_path):
+    csv_path = tmp_path / "transactions.csv"
+    csv_path.write_text(CSV)
+    df = fx.read_and_clean_data(str(csv_path))
+    assert "description" not in df
+
+    assert fx.load_descriptions(str(csv_path), [2, 0]).tolist() == ["coffee", "lunch"]
+
+def test_missing_amounts_are_kept_as_nan():
+    csv = CSV.replace(",20.25,", ",,")
+    df = fx.parse_csv(io.BytesIO(csv.encode()))
+    assert df["amount_cents"].isna().tolist() == [False, True, False]
+
+    cube = fx.build_cube(df)
+    assert cube["count"].sum() == 3
+    assert cube["amount"].sum() == 15.5
@@ -0,0 +1,35 @@
+import numpy as np
+
+import functions as fx
+
+def test_downsample_keeps_budget_with_many_small_groups():
+    rng = np.random.default_rng(0)
+    n = 5_000
+    x = np.arange(n, dtype="float64")
+    y = rng.normal(100, 10, n)
+    # one large group and 2,000 groups of one or two points
+    color = np.where(np.arange(n) < 3_000, "large", np.char.add("g", (np.arange(n) % 2_000).astype(str)))
+
+    for max_points in [100, 1_000, 2_500, 4_000]:
+        kept = fx.downsample_scatter(x, y, color, max_points, slope=0.0, intercept=100.0)
+        assert len(kept) <= max_points
+        assert len(np.unique(kept)) == len(kept)
+
+def test_downsample_keeps_every_group_when_the_budget_allows():
+    x = np.arange(1_000, dtype="float64")
+    y = np.zeros(1_000)
+    color = np.array(["a"] * 990 + [f"small{i}" for i in range(10)])
+
+    kept = fx.downsample_scatter(x, y, color, 100, slope=0.0, intercept=1.0)
+    assert len(kept) <= 100
+    assert set(color[kept]) == set(color)
+
+def test_downsample_keeps_highlighted_points_within_budget():
+    x = np.arange(2_000, dtype="float64")
+    y = np.ones(2_000)
+    color = np.char.add("g", (np.arange(2_000) % 500).astype(str))
+    highlight = np.arange(50)
+
+    kept = fx.downsample_scatter(x, y, color, 200, slope=0.0, intercept=0.0, highlight=highlight)
+    assert len(kept) <= 200
+    assert np.isin(highlight, kept).all()
@@ -0,0 +1,43 @@
+import datetime
+
+import numpy as np
+
+import functions as fx
+import sketches
+
+def test_split_months_reads_partly_covered_months_from_the_rows():
+    whole, partial = sketches.split_months((datetime.date(2024, 8, 15), datetime.date(2024, 11, 10)))
+    assert whole == (datetime.date(2024, 9, 1), datetime.date(2024, 10, 1))
+    assert partial == [(datetime.date(2024, 8, 15), datetime.date(2024, 8, 31)),
+                       (datetime.date(2024, 11, 1), datetime.date(2024, 11, 10))]
+
+    whole, partial = sketches.split_months((datetime.date(2024, 9, 1), datetime.date(2024, 9, 15)))
+    assert whole is None
+    assert partial == [(datetime.date(2024, 9, 1), datetime.date(2024, 9, 15))]
+
+def test_filter_sketch_is_exact_to_the_day():
+    df = fx.read_and_clean_data("financial_transactions.csv")
+    sketch = sketches.build_sketch(df)
+    day_order = sketches.build_day_order(df)
+
+    for date_range in [(datetime.date(2024, 9, 1), datetime.date(2024, 9, 15)),
+                       (datetime.date(2024, 10, 10), datetime.date(2025, 2, 20)),
+                       (datetime.date(2024, 11, 1), datetime.date(2025, 1, 31))]:
+        spec = fx.make_filter_spec(date_range, ["Travel"])
+        summary = sketches.sketch_summary(sketches.filter_sketch(sketch, spec, df, day_order))
+
+        rows = fx.filter_data(df, spec)
+        assert len(rows)
+        assert int(sketches.filter_sketch(sketch, spec, df, day_order)["count"].sum()) == len(rows)
+        assert summary["distinct"] == {col: rows[col].nunique() for col in sketches.DISTINCT_COLUMNS}
+        exact = np.quantile(rows["amount_cents"] / 100, sketches.QUANTILES, method="inverted_cdf")
+        assert np.allclose(summary["quantiles"], exact, rtol=sketches.QUANTILE_ACCURACY)
+
+def test_weighted_quantiles_match_the_expanded_values():
+    rng = np.random.default_rng(0)
+    values = np.sort(rng.lognormal(4, 1, 500).round(2))
+    weights = rng.integers(1, 20, 500)
+
+    expanded = np.repeat(values, weights)
+    exact = np.quantile(expanded, sketches.QUANTILES, method="inverted_cdf")
+    assert sketches.weighted_quantiles(values, weights.astype("float64")) == exact.tolist()
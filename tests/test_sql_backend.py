@@ -0,0 +1,64 @@
+import datetime
+
+import numpy as np
+
+import functions as fx
+import sql_backend
+
+CSV = (
+    "transaction_id,date,amount,category,merchant,payment_method,account_type,transaction_type,description\n"
+    "T-1,2024-08-26 14:40:08.1,10.50,Dining,Chipotle,Cash,Savings,Payment,lunch\n"
+    "T-2,2024-08-28 09:00:00.2,20.25,Travel,Delta,Debit Card,Checking,Payment,flight\n"
+)
+
+def make_database(tmp_path, csv=CSV):
+    csv_path = tmp_path / "transactions.csv"
+    csv_path.write_text(csv)
+    db_path = str(tmp_path / "db" / "transactions.sqlite")
+    sql_backend.build_database(str(csv_path), db_path)
+    dimension_values, _ = sql_backend.load_dimension_values(db_path)
+    return db_path, dimension_values
+
+# a day without transactions between the first and the last one
+EMPTY_SPEC = fx.make_filter_spec((datetime.date(2024, 8, 27), datetime.date(2024, 8, 27)))
+
+def test_query_cube_without_matches_keeps_the_cube_dtypes(tmp_path):
+    db_path, dimension_values = make_database(tmp_path)
+
+    cube = sql_backend.query_cube(db_path, EMPTY_SPEC, dimension_values)
+    assert len(cube) == 0
+    assert cube["amount"].dtype == "float64"
+    assert cube["amount_sq"].dtype == "float64"
+    assert cube["count"].dtype == "int64"
+    assert fx.cube_metrics(cube)[2] == 0
+
+def test_query_scatter_sample_without_matches_has_no_fit(tmp_path):
+    db_path, dimension_values = make_database(tmp_path)
+
+    sample = sql_backend.query_scatter_sample(db_path, EMPTY_SPEC, dimension_values, "category", 100)
+    assert sample["n"] == 0 and len(sample["x"]) == 0
+    assert sample["fit"] is None and sample["x_range"] is None
+
+    fig = fx.scatterplot_with_line(sample["x"], sample["y"], sample["color"], fit=sample["fit"],
+                                   x_range=sample["x_range"])
+    assert not any(trace.name == "Best Fit Line" for trace in fig.data)
+
+def test_query_scatter_sample_fit_matches_numpy(tmp_path):
+    db_path, dimension_values = make_database(tmp_path)
+
+    sample = sql_backend.query_scatter_sample(db_path, fx.make_filter_spec(), dimension_values, "category", 100)
+    assert sample["n"] == 2
+    assert np.allclose(sample["fit"], np.polyfit(sample["x"], sample["y"], 1))
+
+def test_query_scatter_sample_keeps_budget_with_many_small_groups(tmp_path):
+    # one large merchant and 300 merchants with a single transaction
+    rows = [f"T-{i},2024-08-{1 + i % 28:02d} 10:00:00.5,{10 + i % 97}.25,Dining,Chipotle,Cash,Savings,Payment,lunch"
+            for i in range(2_000)]
+    rows += [f"S-{i},2024-08-15 12:00:00.5,{5 + i % 13}.50,Travel,Merchant {i},Cash,Savings,Payment,trip"
+             for i in range(300)]
+    db_path, dimension_values = make_database(tmp_path, CSV.split("\n")[0] + "\n" + "\n".join(rows) + "\n")
+
+    for max_points in [50, 400, 1_000]:
+        sample = sql_backend.query_scatter_sample(db_path, fx.make_filter_spec(), dimension_values, "merchant", max_points)
+        assert sample["n"] == 2_300
+        assert len(sample["x"]) <= max_points
@@ -0,0 +1,40 @@
+import datetime
+import io
+
+import pandas as pd
+
+import functions as fx
+import streaming
+
+CSV = (
+    "transaction_id,date,amount,category,merchant,payment_method,account_type,transaction_type,description\n"
+    "T-1,2024-08-26 14:40:08.1,10.50,Dining,Chipotle,Cash,Savings,Payment,lunch\n"
+    "T-2,2024-09-10 09:00:00.2,20.25,Travel,Delta,Debit Card,Checking,Payment,flight\n"
+    "T-3,2024-09-28 18:30:00.3,30.00,Travel,Delta,Debit Card,Checking,Payment,hotel\n"
+    "T-4,2024-10-02 12:00:00.4,40.00,Travel,Delta,Debit Card,Checking,Payment,train\n"
+)
+
+def make_aggregates():
+    chunk = pd.read_csv(io.StringIO(CSV), usecols=streaming.STREAM_COLUMNS)
+    return streaming.chunk_aggregates(chunk, seed=0)
+
+def test_month_range_widens_both_ends():
+    assert streaming.month_range((datetime.date(2024, 9, 5), datetime.date(2024, 10, 1))) == (
+        datetime.date(2024, 9, 1), datetime.date(2024, 10, 31))
+    assert streaming.month_range((datetime.date(2024, 9, 1),)) is None
+
+def test_histogram_counts_cover_whole_months():
+    histogram = make_aggregates()["histogram"]
+
+    # 2024-09-15 to 2024-10-01 counts all of September and October, not the end of August
+    spec = fx.make_filter_spec((datetime.date(2024, 9, 15), datetime.date(2024, 10, 1)))
+    _, counts = streaming.histogram_counts(histogram, spec)
+    assert counts.sum() == 3
+
+def test_cube_fit_without_rows():
+    cube = make_aggregates()["cube"]
+    empty = fx.filter_data(cube, fx.make_filter_spec((datetime.date(2024, 9, 1), datetime.date(2024, 9, 5))))
+    assert len(empty) == 0
+    assert streaming.cube_fit(empty) == (None, None)
+    fit, x_range = streaming.cube_fit(cube)
+    assert x_range[0] < x_range[1]